@@ -49,21 +49,29 @@ def make_bacon_shor_round(
         builder.gate(f'R{basis}', patch.data_set)
         builder.tick()
 
-    for xx in patch_x.tiles:
-        if xx.measurement_qubit.real % 2 == 0.5:
-            builder.measure_pauli_product(xs=xx.data_set, key=gen.AtLayer(xx.measurement_qubit, 'solo'))
+    tiles = [xx for xx in patch_x.tiles if xx.measurement_qubit.real % 2 == 0.5]
+    builder.measure_pauli_products(
+        [{q: 'X' for q in xx.data_set} for xx in tiles],
+        keys=[gen.AtLayer(xx.measurement_qubit, 'solo') for xx in tiles],
+    )
     builder.tick()
-    for xx in patch_x.tiles:
-        if xx.measurement_qubit.real % 2 == 1.5:
-            builder.measure_pauli_product(xs=xx.data_set, key=gen.AtLayer(xx.measurement_qubit, 'solo'))
+    tiles = [xx for xx in patch_x.tiles if xx.measurement_qubit.real % 2 == 1.5]
+    builder.measure_pauli_products(
+        [{q: 'X' for q in xx.data_set} for xx in tiles],
+        keys=[gen.AtLayer(xx.measurement_qubit, 'solo') for xx in tiles],
+    )
     builder.tick()
-    for zz in patch_z.tiles:
-        if zz.measurement_qubit.imag % 2 == 0.5:
-            builder.measure_pauli_product(zs=zz.data_set, key=gen.AtLayer(zz.measurement_qubit, 'solo'))
+    tiles = [zz for zz in patch_z.tiles if zz.measurement_qubit.imag % 2 == 0.5]
+    builder.measure_pauli_products(
+        [{q: 'Z' for q in zz.data_set} for zz in tiles],
+        keys=[gen.AtLayer(zz.measurement_qubit, 'solo') for zz in tiles],
+    )
     builder.tick()
-    for zz in patch_z.tiles:
-        if zz.measurement_qubit.imag % 2 == 1.5:
-            builder.measure_pauli_product(zs=zz.data_set, key=gen.AtLayer(zz.measurement_qubit, 'solo'))
+    tiles = [zz for zz in patch_z.tiles if zz.measurement_qubit.imag % 2 == 1.5]
+    builder.measure_pauli_products(
+        [{q: 'Z' for q in zz.data_set} for zz in tiles],
+        keys=[gen.AtLayer(zz.measurement_qubit, 'solo') for zz in tiles],
+    )
 
     if end:
         builder.tick()
@@ -94,11 +102,12 @@ def make_bacon_shor_round(
                     center=tile.measurement_qubit,
                 ))
     for key, group in groups.items():
-        ps = gen.PauliString({})
+        packed = gen.PackedPauliString()
         ms = []
         for tile in group:
-            ps *= gen.PauliString.from_tile_data(tile)
+            packed *= gen.PackedPauliString.from_tile_data(tile)
             ms.append(gen.AtLayer(tile.measurement_qubit, 'solo'))
+        ps = packed.to_pauli_string()
         tm = builder.tracker.measurement_indices(ms)
         tile_basis, = set(ps.qubits.values())
         if not init or tile_basis == basis == 'Z':
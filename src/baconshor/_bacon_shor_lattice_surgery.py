@@ -7,50 +7,42 @@ import gen
 from baconshor._bacon_shor import make_bacon_shor_patch
 
 
-def _det(*, builder: gen.Builder, group: List[gen.Tile], layers: List[Any], include_data: bool = False):
-    builder.detector(
-        [
-            gen.AtLayer(q, layer)
-            for tile in group
-            for layer in layers
-            for q in (tile.used_set if include_data else [tile.measurement_qubit])
-        ],
-        pos=min([tile.measurement_qubit for tile in group], key=gen.complex_key),
-    )
-
-
 def _do_det_groups(*, builder: gen.Builder, patch: gen.Patch, basis: str, layers: List[Any], include_data: bool = False):
     groups = sinter.group_by(
         [tile for tile in patch.tiles if tile.basis == basis],
         key=lambda tile: tile.measurement_qubit.real if basis == 'X' else tile.measurement_qubit.imag,
     )
-    for _, group in sorted(groups.items()):
-        _det(builder=builder, group=group, layers=layers, include_data=include_data)
+    groups = [group for _, group in sorted(groups.items())]
+    builder.detectors(
+        [
+            [
+                gen.AtLayer(q, layer)
+                for tile in group
+                for layer in layers
+                for q in (tile.used_set if include_data else [tile.measurement_qubit])
+            ]
+            for group in groups
+        ],
+        positions=[min([tile.measurement_qubit for tile in group], key=gen.complex_key) for group in groups],
+    )
 
 
 def _run_round(*,
                builder: gen.Builder,
                patch: gen.Patch,
                save_layer: Any):
-    for tile in patch.tiles:
-        m = tile.measurement_qubit
-        if tile.basis == 'X' and m.real % 2 == 0.5:
-            builder.measure_pauli_product(xs=tile.data_set, key=gen.AtLayer(m, save_layer))
-    builder.tick()
-    for tile in patch.tiles:
-        m = tile.measurement_qubit
-        if tile.basis == 'X' and m.real % 2 == 1.5:
-            builder.measure_pauli_product(xs=tile.data_set, key=gen.AtLayer(m, save_layer))
-    builder.tick()
-    for tile in patch.tiles:
-        m = tile.measurement_qubit
-        if tile.basis == 'Z' and m.imag % 2 == 0.5:
-            builder.measure_pauli_product(zs=tile.data_set, key=gen.AtLayer(m, save_layer))
-    builder.tick()
-    for tile in patch.tiles:
-        m = tile.measurement_qubit
-        if tile.basis == 'Z' and m.imag % 2 == 1.5:
-            builder.measure_pauli_product(zs=tile.data_set, key=gen.AtLayer(m, save_layer))
+    for k, (basis, parity) in enumerate([('X', 0.5), ('X', 1.5), ('Z', 0.5), ('Z', 1.5)]):
+        if k:
+            builder.tick()
+        tiles = []
+        for tile in patch.tiles:
+            m = tile.measurement_qubit
+            if tile.basis == basis and (m.real if basis == 'X' else m.imag) % 2 == parity:
+                tiles.append(tile)
+        builder.measure_pauli_products(
+            [{q: basis for q in tile.data_set} for tile in tiles],
+            keys=[gen.AtLayer(tile.measurement_qubit, save_layer) for tile in tiles],
+        )
 
 
 def make_bacon_shor_xx_lattice_surgery_circuit(
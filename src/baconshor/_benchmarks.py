@@ -0,0 +1,93 @@
+from typing import List, Union
+
+import stim
+
+import gen
+from baconshor._bacon_shor import make_bacon_shor_circuit
+from baconshor._bacon_shor_lattice_surgery import make_bacon_shor_xx_lattice_surgery_circuit
+from baconshor._fractal_bacon_shor import make_bacon_shor_fractal_circuit
+
+BENCHMARK_DIAMETERS = [5, 11, 21, 43]
+
+
+def _memory_chunks(d: int) -> List[Union[gen.Chunk, gen.ChunkLoop]]:
+    return make_bacon_shor_circuit(width=d, height=d, basis='X', rounds=4 * d)
+
+
+def _memory_circuit(d: int) -> stim.Circuit:
+    return gen.compile_chunks_into_circuit(_memory_chunks(d)).with_inlined_feedback()
+
+
+def _memory_cz_circuit(d: int) -> stim.Circuit:
+    return gen.to_z_basis_interaction_circuit(_memory_circuit(d), is_entire_circuit=True)
+
+
+def _verify_all(chunks: List[Union[gen.Chunk, gen.ChunkLoop]]) -> None:
+    for chunk in chunks:
+        chunk.verify()
+
+
+def make_benchmark_cases(diameters: List[int]) -> List[gen.BenchmarkCase]:
+    """The benchmark suite for circuit generation: each stage of the pipeline at each diameter.
+
+    Memory experiments use 4*d rounds of X basis bacon shor, the fractal circuits use a pitch of 5,
+    and the lattice surgery circuits use d rounds. Noise is SI1000 at p=0.001 on the CZ circuit.
+    """
+    cases = []
+    for d in diameters:
+        cases.extend([
+            gen.BenchmarkCase(
+                name='make_bacon_shor_circuit',
+                diameter=d,
+                func=lambda _, d=d: _memory_chunks(d),
+            ),
+            gen.BenchmarkCase(
+                name='make_bacon_shor_fractal_circuit',
+                diameter=d,
+                func=lambda _, d=d: make_bacon_shor_fractal_circuit(
+                    width=d,
+                    height=d,
+                    rounds=4 * d,
+                    basis='X',
+                    fractal_pitch=5,
+                    surgery_hold_factor=1,
+                    fold_repetitions=True,
+                ),
+            ),
+            gen.BenchmarkCase(
+                name='make_bacon_shor_xx_lattice_surgery_circuit',
+                diameter=d,
+                func=lambda _, d=d: make_bacon_shor_xx_lattice_surgery_circuit(
+                    width=d,
+                    height=d,
+                    basis='X',
+                    rounds=d,
+                ),
+            ),
+            gen.BenchmarkCase(
+                name='compile_chunks_into_circuit',
+                diameter=d,
+                setup=lambda d=d: _memory_chunks(d),
+                func=gen.compile_chunks_into_circuit,
+            ),
+            gen.BenchmarkCase(
+                name='to_z_basis_interaction_circuit',
+                diameter=d,
+                setup=lambda d=d: _memory_circuit(d),
+                func=lambda circuit: gen.to_z_basis_interaction_circuit(circuit, is_entire_circuit=True),
+            ),
+            gen.BenchmarkCase(
+                name='NoiseModel.noisy_circuit',
+                diameter=d,
+                setup=lambda d=d: _memory_cz_circuit(d),
+                func=gen.NoiseModel.si1000(1e-3).noisy_circuit,
+                dem=True,
+            ),
+            gen.BenchmarkCase(
+                name='Chunk.verify',
+                diameter=d,
+                setup=lambda d=d: _memory_chunks(d),
+                func=_verify_all,
+            ),
+        ])
+    return cases
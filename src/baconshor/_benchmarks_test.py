@@ -0,0 +1,20 @@
+import gen
+from baconshor._benchmarks import make_benchmark_cases
+
+
+def test_make_benchmark_cases():
+    cases = make_benchmark_cases([3])
+    assert [case.name for case in cases] == [
+        'make_bacon_shor_circuit',
+        'make_bacon_shor_fractal_circuit',
+        'make_bacon_shor_xx_lattice_surgery_circuit',
+        'compile_chunks_into_circuit',
+        'to_z_basis_interaction_circuit',
+        'NoiseModel.noisy_circuit',
+        'Chunk.verify',
+    ]
+    for case in cases:
+        result = gen.run_benchmark_case(case, repeats=1, measure_memory=False)
+        assert result['diameter'] == 3
+        assert (result['dem_seconds'] is not None) == (case.name == 'NoiseModel.noisy_circuit')
+        assert (result['output_size'] is None) == (case.name == 'Chunk.verify')
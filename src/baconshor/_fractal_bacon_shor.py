@@ -1,5 +1,8 @@
-from typing import List, Union, Dict, Callable, Set
+import bisect
+import functools
+from typing import List, Union, Dict, Callable, Tuple
 
+import numpy as np
 import sinter
 import stim
 
@@ -33,37 +36,100 @@ def is_parity_measurement_active(
     return False
 
 
-def fractal_bacon_shor_detector_ranges(
+@functools.lru_cache(maxsize=None)
+def parity_measurement_activity_table(
         *,
-        line_top_left: complex,
-        line_dir: complex,
-        span: int,
-        line_cuts_inplace_edit: Set[complex],
-) -> List[List[complex]]:
-    result = []
-
-    start = 0
-    while start < span:
-        end = start
-        vs = []
-        while end < span:
-            v = line_top_left + 0.5 + 0.5j + end * line_dir
-            vs.append(v - 0.5*line_dir)
-            end += 1
-            if v not in line_cuts_inplace_edit:
-                break
-            line_cuts_inplace_edit.discard(v)
-        result.append(vs)
-        start = end
-
+        num_dividers: int,
+        num_time_steps: int,
+        space_d: int,
+        time_d: int,
+        phase1: int,
+        phase2: int,
+) -> np.ndarray:
+    """Vectorized version of `is_parity_measurement_active`, for a whole schedule at once.
+
+    The result is cached, so the same table is shared by every circuit (e.g. both memory
+    bases) using the same schedule. It is read-only.
+
+    Returns:
+        A boolean array where `result[divider_index, time_step]` is
+        `is_parity_measurement_active(divider_index=divider_index, time_step=time_step, ...)`.
+    """
+    phases = np.array([phase1, phase2])
+    dividers = np.arange(1, num_dividers + 1)[:, None]
+    time_steps = np.arange(num_time_steps)[None, :]
+    dividers, time_steps = np.broadcast_arrays(dividers, time_steps)
+    dividers = dividers.copy()
+    time_steps = time_steps.copy()
+
+    result = np.zeros(shape=dividers.shape, dtype=np.bool_)
+    undecided = np.ones(shape=dividers.shape, dtype=np.bool_)
+    while np.any(undecided):
+        undecided &= dividers > 0
+        active = undecided & (dividers % space_d != 0)
+        result |= active
+        undecided &= ~active
+        dividers //= space_d
+        time_steps //= time_d
+        undecided &= time_steps % 4 == phases[dividers % 2]
+        time_steps //= 4
+
+    result.setflags(write=False)
     return result
 
 
+class DetectorLineCuts:
+    """Tracks which neighboring detector cells along each line have been merged.
+
+    A line is a column (or row) of cells, identified by a number. A cut at index `k` of a line
+    records that cell `k` and cell `k + 1` of the line belong to the same detector range. Cuts
+    are kept sorted per line, so recording a cut costs O(log n) and taking a line's ranges costs
+    O(#ranges) instead of a walk over every cell of the line.
+    """
+
+    def __init__(self):
+        self._line_cuts: Dict[float, List[int]] = {}
+
+    def add(self, *, line: float, index: int) -> None:
+        cuts = self._line_cuts.setdefault(line, [])
+        k = bisect.bisect_left(cuts, index)
+        if k == len(cuts) or cuts[k] != index:
+            cuts.insert(k, index)
+
+    def take_ranges(self, *, line: float, span: int) -> List[Tuple[int, int]]:
+        """Returns the merged cell ranges of a line, and clears the line's cuts.
+
+        Args:
+            line: The line to get ranges for.
+            span: The number of cells in the line.
+
+        Returns:
+            A list of (start, stop) half-open cell index ranges, covering range(span) in order.
+        """
+        result = []
+        start = 0
+        stop = 1
+        for k in self._line_cuts.pop(line, ()):
+            if k < 0 or k >= span - 1:
+                continue
+            if k == stop - 1:
+                stop = k + 2
+                continue
+            result.append((start, stop))
+            result.extend((c, c + 1) for c in range(stop, k))
+            start = k
+            stop = k + 2
+        if span > 0:
+            result.append((start, stop))
+            result.extend((c, c + 1) for c in range(stop, span))
+        return result
+
+
 def do_x_measures(
         *,
         patch: gen.Patch,
-        z_cuts: Set[complex],
-        x_cuts: Set[complex],
+        z_cuts: DetectorLineCuts,
+        x_cuts: DetectorLineCuts,
         builder: gen.Builder,
         last_usage_x: Dict[int, int],
         height: int,
@@ -71,24 +137,27 @@ def do_x_measures(
         is_active_func: Callable[[gen.Tile], bool],
 ):
     used_xs = set()
+    measured = []
     for tile in patch.tiles:
         m = tile.measurement_qubit
         if tile.basis == 'X' and is_active_func(tile):
-            builder.measure_pauli_product(xs=tile.data_set, key=gen.AtLayer(m, f'x_round{step}'))
-            z_cuts.add(m - 0.5j)
-            z_cuts.add(m + 0.5j)
+            measured.append(tile)
+            z_cuts.add(line=m.imag - 1, index=int(m.real - 0.5))
+            z_cuts.add(line=m.imag, index=int(m.real - 0.5))
             used_xs.add(m.real - 0.5)
+    builder.measure_pauli_products(
+        [{q: 'X' for q in tile.data_set} for tile in measured],
+        keys=[gen.AtLayer(tile.measurement_qubit, ('x_round', step)) for tile in measured],
+    )
 
     for x in used_xs:
         prev_step = last_usage_x.get(x)
         last_usage_x[x] = step
 
-        vvs = fractal_bacon_shor_detector_ranges(
-            line_top_left=x,
-            line_dir=1j,
-            span=height,
-            line_cuts_inplace_edit=x_cuts,
-        )
+        vvs = [
+            [x + 0.5 + k*1j for k in range(start, stop)]
+            for start, stop in x_cuts.take_ranges(line=x, span=height)
+        ]
 
         if prev_step is None:
             continue
@@ -97,12 +166,11 @@ def do_x_measures(
         else:
             cmp = [prev_step, step]
 
-        for vs in vvs:
-            builder.detector([
-                gen.AtLayer(v, f'x_round{t}')
-                for v in vs
-                for t in cmp
-            ], pos=min(vs, key=gen.complex_key), extra_coords=[1])
+        builder.detectors(
+            [[gen.AtLayer(v, ('x_round', t)) for v in vs for t in cmp] for vs in vvs],
+            positions=[min(vs, key=gen.complex_key) for vs in vvs],
+            extra_coords=[1],
+        )
     builder.shift_coords(dt=1)
     builder.tick()
 
@@ -110,8 +178,8 @@ def do_x_measures(
 def do_z_measures(
         *,
         patch: gen.Patch,
-        z_cuts: Set[complex],
-        x_cuts: Set[complex],
+        z_cuts: DetectorLineCuts,
+        x_cuts: DetectorLineCuts,
         builder: gen.Builder,
         last_usage_z: Dict[int, int],
         width: int,
@@ -119,24 +187,27 @@ def do_z_measures(
         is_active_func: Callable[[gen.Tile], bool],
 ):
     used_zs = set()
+    measured = []
     for tile in patch.tiles:
         m = tile.measurement_qubit
         if tile.basis == 'Z' and is_active_func(tile):
-            builder.measure_pauli_product(zs=tile.data_set, key=gen.AtLayer(m, f'z_round{step}'))
+            measured.append(tile)
             used_zs.add(m.imag - 0.5)
-            x_cuts.add(m - 0.5)
-            x_cuts.add(m + 0.5)
+            x_cuts.add(line=m.real - 1, index=int(m.imag - 0.5))
+            x_cuts.add(line=m.real, index=int(m.imag - 0.5))
+    builder.measure_pauli_products(
+        [{q: 'Z' for q in tile.data_set} for tile in measured],
+        keys=[gen.AtLayer(tile.measurement_qubit, ('z_round', step)) for tile in measured],
+    )
 
     for z in used_zs:
         prev_step = last_usage_z.get(z)
         last_usage_z[z] = step
 
-        vvs = fractal_bacon_shor_detector_ranges(
-            line_top_left=z*1j,
-            line_dir=1,
-            span=width,
-            line_cuts_inplace_edit=z_cuts,
-        )
+        vvs = [
+            [k + z*1j + 0.5j for k in range(start, stop)]
+            for start, stop in z_cuts.take_ranges(line=z, span=width)
+        ]
 
         if prev_step is None:
             continue
@@ -145,12 +216,11 @@ def do_z_measures(
         else:
             cmp = [prev_step, step]
 
-        for vs in vvs:
-            builder.detector([
-                gen.AtLayer(v, f'z_round{t}')
-                for v in vs
-                for t in cmp
-            ], pos=min(vs, key=gen.complex_key) + 10, extra_coords=[2])
+        builder.detectors(
+            [[gen.AtLayer(v, ('z_round', t)) for v in vs for t in cmp] for vs in vvs],
+            positions=[min(vs, key=gen.complex_key) + 10 for vs in vvs],
+            extra_coords=[2],
+        )
     builder.shift_coords(dt=1)
     builder.tick()
 
@@ -158,7 +228,7 @@ def do_z_measures(
 def do_end_x_measures(
         *,
         patch: gen.Patch,
-        x_cuts: Set[complex],
+        x_cuts: DetectorLineCuts,
         builder: gen.Builder,
         last_usage_x: Dict[int, int],
         height: int,
@@ -172,12 +242,10 @@ def do_end_x_measures(
     for x in used_xs:
         prev_step = last_usage_x.get(x)
 
-        vvs = fractal_bacon_shor_detector_ranges(
-            line_top_left=x,
-            line_dir=1j,
-            span=height,
-            line_cuts_inplace_edit=x_cuts,
-        )
+        vvs = [
+            [x + 0.5 + k*1j for k in range(start, stop)]
+            for start, stop in x_cuts.take_ranges(line=x, span=height)
+        ]
 
         if prev_step is None:
             continue
@@ -186,22 +254,21 @@ def do_end_x_measures(
         else:
             cmp = [prev_step]
 
-        for vs in vvs:
-            builder.detector([
-                gen.AtLayer(v, f'x_round{t}')
-                for v in vs
-                for t in cmp
-            ] + [
-                gen.AtLayer(v + d, f'end')
-                for v in vs
-                for d in [-0.5, +0.5]
-            ], pos=min(vs, key=gen.complex_key), extra_coords=[1])
+        builder.detectors(
+            [
+                [gen.AtLayer(v, ('x_round', t)) for v in vs for t in cmp]
+                + [gen.AtLayer(v + d, f'end') for v in vs for d in [-0.5, +0.5]]
+                for vs in vvs
+            ],
+            positions=[min(vs, key=gen.complex_key) for vs in vvs],
+            extra_coords=[1],
+        )
 
 
 def do_end_z_measures(
         *,
         patch: gen.Patch,
-        z_cuts: Set[complex],
+        z_cuts: DetectorLineCuts,
         builder: gen.Builder,
         last_usage_z: Dict[int, int],
         width: int,
@@ -215,12 +282,10 @@ def do_end_z_measures(
     for z in used_zs:
         prev_step = last_usage_z.get(z)
 
-        vvs = fractal_bacon_shor_detector_ranges(
-            line_top_left=z*1j,
-            line_dir=1,
-            span=width,
-            line_cuts_inplace_edit=z_cuts,
-        )
+        vvs = [
+            [k + z*1j + 0.5j for k in range(start, stop)]
+            for start, stop in z_cuts.take_ranges(line=z, span=width)
+        ]
 
         if prev_step is None:
             continue
@@ -229,16 +294,15 @@ def do_end_z_measures(
         else:
             cmp = [prev_step]
 
-        for vs in vvs:
-            builder.detector([
-                gen.AtLayer(v, f'z_round{t}')
-                for v in vs
-                for t in cmp
-            ] + [
-                gen.AtLayer(v + d, f'end')
-                for v in vs
-                for d in [-0.5j, +0.5j]
-            ], pos=min(vs, key=gen.complex_key), extra_coords=[2])
+        builder.detectors(
+            [
+                [gen.AtLayer(v, ('z_round', t)) for v in vs for t in cmp]
+                + [gen.AtLayer(v + d, f'end') for v in vs for d in [-0.5j, +0.5j]]
+                for vs in vvs
+            ],
+            positions=[min(vs, key=gen.complex_key) for vs in vvs],
+            extra_coords=[2],
+        )
 
 
 def make_bacon_shor_fractal_circuit(
@@ -249,57 +313,89 @@ def make_bacon_shor_fractal_circuit(
         basis: str,
         fractal_pitch: int,
         surgery_hold_factor: int,
+        fold_repetitions: bool = False,
 ) -> stim.Circuit:
+    """Makes a memory experiment circuit for the fractal bacon shor code.
+
+    Args:
+        fold_repetitions: When set, steps that repeat (the schedule is periodic at each level of
+            the fractal) are folded into nested REPEAT blocks instead of being unrolled. The
+            flattened circuit is the same either way.
+    """
     code = make_bacon_shor_patch(width=width, height=height)
     patch = code.patch
 
-    x_cuts = set()
-    z_cuts = set()
+    x_cuts = DetectorLineCuts()
+    z_cuts = DetectorLineCuts()
     last_usage_x = {x: 'init' for x in range(width)} if basis == 'X' else {}
     last_usage_z = {z: 'init' for z in range(height)} if basis == 'Z' else {}
 
-    builder = gen.Builder.for_qubits(patch.data_set)
+    builder = gen.Builder.for_qubits(patch.data_set, tracker=gen.ArrayMeasurementTracker())
     builder.gate(f'R{basis}', patch.data_set)
     builder.tick()
 
+    x_activity = parity_measurement_activity_table(
+        num_dividers=width,
+        num_time_steps=rounds,
+        space_d=fractal_pitch,
+        time_d=surgery_hold_factor,
+        phase1=0,
+        phase2=2,
+    )
+    z_activity = parity_measurement_activity_table(
+        num_dividers=height,
+        num_time_steps=rounds,
+        space_d=fractal_pitch,
+        time_d=surgery_hold_factor,
+        phase1=1,
+        phase2=3,
+    )
+
+    segments = []
     for step in range(rounds):
+        segment = builder.fork()
         for parity in [0.5, 1.5]:
             do_x_measures(
                 patch=patch,
                 z_cuts=z_cuts,
                 x_cuts=x_cuts,
-                builder=builder,
+                builder=segment,
                 last_usage_x=last_usage_x,
                 height=height,
                 step=step,
-                is_active_func=lambda tile: tile.measurement_qubit.real % 2 == parity and is_parity_measurement_active(
-                    divider_index=int(tile.ordered_data_qubits[0].real),
-                    time_step=step,
-                    space_d=fractal_pitch,
-                    time_d=surgery_hold_factor,
-                    phase1=0,
-                    phase2=2,
-                ),
+                is_active_func=lambda tile: tile.measurement_qubit.real % 2 == parity and x_activity[
+                    int(tile.ordered_data_qubits[0].real),
+                    step,
+                ],
             )
         for parity in [0.5, 1.5]:
             do_z_measures(
                 patch=patch,
                 z_cuts=z_cuts,
                 x_cuts=x_cuts,
-                builder=builder,
+                builder=segment,
                 last_usage_z=last_usage_z,
                 width=width,
                 step=step,
-                is_active_func=lambda tile: tile.measurement_qubit.imag % 2 == parity and is_parity_measurement_active(
-                    divider_index=int(tile.ordered_data_qubits[0].imag),
-                    time_step=step,
-                    space_d=fractal_pitch,
-                    time_d=surgery_hold_factor,
-                    phase1=1,
-                    phase2=3,
-                ),
+                is_active_func=lambda tile: tile.measurement_qubit.imag % 2 == parity and z_activity[
+                    int(tile.ordered_data_qubits[0].imag),
+                    step,
+                ],
             )
 
+        segments.append(segment.circuit)
+
+        # Detectors only look back as far as the least recently used line, so older rounds can be forgotten.
+        oldest_x_round = min([v for v in last_usage_x.values() if v != 'init'], default=step)
+        oldest_z_round = min([v for v in last_usage_z.values() if v != 'init'], default=step)
+        builder.tracker.evict_layers_before('x_round', oldest_x_round)
+        builder.tracker.evict_layers_before('z_round', oldest_z_round)
+    if fold_repetitions:
+        builder.circuit += gen.stim_circuit_from_repeating_segments(segments)
+    else:
+        for segment_circuit in segments:
+            builder.circuit += segment_circuit
+
     if basis == 'X':
         do_end_x_measures(
             patch=patch,
@@ -330,6 +426,7 @@ def _fractal_bacon_shor_circuit_chunks_from_params(params: gen.CircuitBuildParam
         rounds=params.rounds,
         fractal_pitch=params.custom['fractal_pitch'],
         surgery_hold_factor=params.custom['surgery_hold_factor'],
+        fold_repetitions=True,
     )
     return [gen.Chunk(
         circuit=circuit,
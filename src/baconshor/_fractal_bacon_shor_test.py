@@ -1,12 +1,15 @@
 import itertools
-from typing import Set, Tuple
+import random
+from typing import List, Set, Tuple
 
+import numpy as np
 import pytest
 import stim
 
 import gen
 from baconshor._fractal_bacon_shor import \
-    fractal_bacon_shor_detector_ranges, make_bacon_shor_fractal_circuit, is_parity_measurement_active
+    make_bacon_shor_fractal_circuit, is_parity_measurement_active, \
+    parity_measurement_activity_table, DetectorLineCuts
 
 
 def _l(k: int, f: int) -> int:
@@ -171,6 +174,62 @@ def test_is_parity_measurement_active():
     """
 
 
+@pytest.mark.parametrize('space_d,time_d,phase1,phase2', itertools.product(
+    [2, 3, 5],
+    [1, 2, 3],
+    [0, 1],
+    [2, 3],
+))
+def test_parity_measurement_activity_table(space_d: int, time_d: int, phase1: int, phase2: int):
+    table = parity_measurement_activity_table(
+        num_dividers=30,
+        num_time_steps=100,
+        space_d=space_d,
+        time_d=time_d,
+        phase1=phase1,
+        phase2=phase2,
+    )
+    assert table.shape == (30, 100)
+    assert table.dtype == np.bool_
+    for divider_index in range(30):
+        for time_step in range(100):
+            assert table[divider_index, time_step] == is_parity_measurement_active(
+                divider_index=divider_index,
+                time_step=time_step,
+                space_d=space_d,
+                time_d=time_d,
+                phase1=phase1,
+                phase2=phase2,
+            )
+
+
+def fractal_bacon_shor_detector_ranges(
+        *,
+        line_top_left: complex,
+        line_dir: complex,
+        span: int,
+        line_cuts_inplace_edit: Set[complex],
+) -> List[List[complex]]:
+    """The original set-based way of splitting a line into detectors, used as a reference for DetectorLineCuts."""
+    result = []
+
+    start = 0
+    while start < span:
+        end = start
+        vs = []
+        while end < span:
+            v = line_top_left + 0.5 + 0.5j + end * line_dir
+            vs.append(v - 0.5*line_dir)
+            end += 1
+            if v not in line_cuts_inplace_edit:
+                break
+            line_cuts_inplace_edit.discard(v)
+        result.append(vs)
+        start = end
+
+    return result
+
+
 def test_fractal_bacon_shor_detector_ranges():
     line_cuts: Set[complex] = set()
 
@@ -201,6 +260,47 @@ def test_fractal_bacon_shor_detector_ranges():
     assert line_cuts == set()
 
 
+def test_detector_line_cuts():
+    cuts = DetectorLineCuts()
+    assert cuts.take_ranges(line=0, span=5) == [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5)]
+
+    cuts.add(line=0, index=2)
+    cuts.add(line=0, index=2)
+    cuts.add(line=1, index=1)
+    assert cuts.take_ranges(line=0, span=5) == [(0, 1), (1, 2), (2, 4), (4, 5)]
+    assert cuts.take_ranges(line=0, span=5) == [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5)]
+
+    cuts.add(line=1, index=0)
+    cuts.add(line=1, index=-1)
+    cuts.add(line=1, index=4)
+    assert cuts.take_ranges(line=1, span=5) == [(0, 3), (3, 4), (4, 5)]
+    assert cuts.take_ranges(line=1, span=0) == []
+
+
+def test_detector_line_cuts_matches_detector_ranges():
+    rng = random.Random(5)
+    for _ in range(100):
+        span = rng.randrange(1, 12)
+        line_cuts: Set[complex] = set()
+        cuts = DetectorLineCuts()
+        for _ in range(rng.randrange(span + 1)):
+            k = rng.randrange(-1, span)
+            line_cuts.add(0.5 + 0.5j + k*1j)
+            cuts.add(line=0, index=k)
+
+        expected = fractal_bacon_shor_detector_ranges(
+            line_top_left=0,
+            line_dir=1j,
+            span=span,
+            line_cuts_inplace_edit=line_cuts,
+        )
+        actual = [
+            [0.5 + k*1j for k in range(start, stop)]
+            for start, stop in cuts.take_ranges(line=0, span=span)
+        ]
+        assert actual == expected
+
+
 @pytest.mark.parametrize('width,height,basis,rounds', itertools.product(
     [4, 16],
     [6, 12],
@@ -587,3 +687,35 @@ def test_exact_circuit():
         DETECTOR(4.5, 0, 0, 1) rec[-78] rec[-77] rec[-76] rec[-12] rec[-11] rec[-10] rec[-6] rec[-5] rec[-4]
         DETECTOR(4.5, 3, 0, 1) rec[-75] rec[-74] rec[-73] rec[-9] rec[-8] rec[-7] rec[-3] rec[-2] rec[-1]
     """)
+
+
+@pytest.mark.parametrize('width,height,basis,rounds,surgery_hold_factor', itertools.product(
+    [4, 16],
+    [12],
+    ['X', 'Z'],
+    [24],
+    [1, 2],
+))
+def test_make_fractal_circuit_fold_repetitions(width: int, height: int, basis: str, rounds: int, surgery_hold_factor: int):
+    kwargs = dict(
+        width=width,
+        height=height,
+        rounds=rounds,
+        basis=basis,
+        fractal_pitch=3,
+        surgery_hold_factor=surgery_hold_factor,
+    )
+    unrolled = make_bacon_shor_fractal_circuit(**kwargs)
+    folded = make_bacon_shor_fractal_circuit(**kwargs, fold_repetitions=True)
+    assert folded.flattened() == unrolled.flattened()
+
+
+def test_make_fractal_circuit_fold_repetitions_shrinks_long_circuits():
+    kwargs = dict(width=9, height=9, rounds=36, basis='X', fractal_pitch=3, surgery_hold_factor=1)
+    unrolled = make_bacon_shor_fractal_circuit(**kwargs)
+    folded = make_bacon_shor_fractal_circuit(**kwargs, fold_repetitions=True)
+    assert folded.flattened() == unrolled.flattened()
+    assert len(str(folded)) * 3 < len(str(unrolled))
+
+    model = gen.NoiseModel.uniform_depolarizing(1e-3)
+    assert model.noisy_circuit(folded).flattened() == model.noisy_circuit(unrolled).flattened()
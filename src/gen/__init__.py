@@ -1,5 +1,7 @@
 from gen._gen_util import (
     main_generate_circuits,
+    main_collect_stats,
+    iter_sinter_tasks,
     generate_noisy_circuit_from_chunks,
     CircuitBuildParams,
 )
@@ -9,12 +11,14 @@ from gen._layer_translate import (
 from gen._noise import (
     NoiseModel,
     NoiseRule,
+    NoiseTemplate,
     occurs_in_classical_control_system,
 )
 from gen._builder import (
     Builder,
     AtLayer,
     MeasurementTracker,
+    ArrayMeasurementTracker,
 )
 from gen._tile import (
     Tile,
@@ -24,12 +28,21 @@ from gen._patch import (
 )
 from gen._util import (
     stim_circuit_with_transformed_coords,
+    stim_circuit_from_repeating_segments,
     count_determined_measurements_in_circuit,
     sorted_complex,
     complex_key,
     estimate_qubit_count_during_postselection,
     write_file,
 )
+from gen._circuit_writer import (
+    write_circuit_file,
+)
+from gen._circuit_manifest import (
+    CircuitManifest,
+    circuit_stats,
+    construction_source_hash,
+)
 from gen._viz_circuit_html import (
     stim_circuit_html_viewer,
 )
@@ -56,9 +69,26 @@ from gen._flow import (
     Flow,
     PauliString,
 )
+from gen._packed_pauli_string import (
+    PackedPauliString,
+)
 from gen._flow_verifier import (
     FlowStabilizerVerifier,
 )
+from gen._stage_profiler import (
+    StageProfiler,
+    count_instructions,
+)
+from gen._benchmark import (
+    BenchmarkCase,
+    compare_benchmark_results,
+    main_benchmark,
+    run_benchmark_case,
+)
+from gen._verification_cache import (
+    VerificationCache,
+    chunk_content_key,
+)
 from gen._boundary_list import (
     checkerboard_basis,
     Curve,
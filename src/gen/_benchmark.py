@@ -0,0 +1,258 @@
+import argparse
+import dataclasses
+import json
+import multiprocessing
+import pathlib
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import stim
+
+from gen._stage_profiler import count_instructions, _peak_rss_bytes
+
+
+@dataclasses.dataclass
+class BenchmarkCase:
+    """A piece of work to time at a given code distance.
+
+    Attributes:
+        name: The name of the benchmarked operation (e.g. 'compile_chunks_into_circuit').
+        diameter: The code distance the case is built for.
+        func: The timed work. Called with the result of `setup`.
+        setup: Untimed preparation (e.g. building the chunks to compile). Called once per case.
+        dem: When set, the output of `func` is a circuit whose detector error model generation
+            is also timed.
+    """
+    name: str
+    diameter: int
+    func: Callable[[Any], Any]
+    setup: Callable[[], Any] = lambda: None
+    dem: bool = False
+
+
+def _output_size(output: Any) -> Optional[int]:
+    if isinstance(output, stim.Circuit):
+        return count_instructions(output)
+    if isinstance(output, (list, tuple)):
+        return len(output)
+    return None
+
+
+def _send_peak_rss_growth(case: BenchmarkCase, sender: Any) -> None:
+    try:
+        inputs = case.setup()
+        before = _peak_rss_bytes()
+        case.func(inputs)
+        sender.send(_peak_rss_bytes() - before)
+    except BaseException as ex:
+        sender.send(RuntimeError(f'{case.name} d={case.diameter} failed: {ex!r}'))
+    finally:
+        sender.close()
+
+
+def _peak_rss_growth_in_fresh_process(case: BenchmarkCase) -> Optional[int]:
+    """Runs the case once in a forked process, and returns how much the process's peak RSS grew during `func`.
+
+    Returns None on platforms without the `resource` module or without forking.
+    """
+    if _peak_rss_bytes() is None or 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_send_peak_rss_growth, args=(case, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = RuntimeError(f'{case.name} d={case.diameter} killed the process measuring its memory.')
+    finally:
+        receiver.close()
+        process.join()
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def run_benchmark_case(
+        case: BenchmarkCase,
+        *,
+        repeats: int = 3,
+        measure_memory: bool = True,
+        trace_python_memory: bool = False,
+) -> Dict[str, Any]:
+    """Runs a benchmark case and returns a json-friendly record of the measurements.
+
+    The record's keys are:
+
+        'name', 'diameter': Identify the case.
+        'seconds': The best wall time over `repeats` runs of `func`.
+        'peak_rss_bytes': How much the peak resident set size grew while running `func` once
+            more, in a forked process that only ran `setup` before. This includes stim's C++
+            allocations, which are most of the memory used by circuit generation. None if
+            `measure_memory` isn't set, or on platforms without `resource` or forking.
+        'traced_peak_bytes': The peak memory allocated by Python code during one extra run of
+            `func`, as seen by tracemalloc (which doesn't see stim's allocations). None if
+            `trace_python_memory` isn't set.
+        'output_size': Instructions in the output circuit (loop bodies counted once), or the
+            number of items if the output is a list (e.g. of chunks).
+        'dem_seconds': Time taken to make the output circuit's detector error model, if the
+            case asks for it.
+    """
+    if repeats < 1:
+        raise ValueError(f'{repeats=} < 1')
+    peak_rss = _peak_rss_growth_in_fresh_process(case) if measure_memory else None
+    inputs = case.setup()
+    best = None
+    output = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        output = case.func(inputs)
+        t1 = time.perf_counter()
+        best = t1 - t0 if best is None else min(best, t1 - t0)
+
+    traced_peak = None
+    if trace_python_memory:
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        case.func(inputs)
+        traced_peak = tracemalloc.get_traced_memory()[1] - base
+        if not was_tracing:
+            tracemalloc.stop()
+
+    dem_seconds = None
+    if case.dem:
+        t0 = time.perf_counter()
+        output.detector_error_model()
+        dem_seconds = time.perf_counter() - t0
+
+    return {
+        'name': case.name,
+        'diameter': case.diameter,
+        'seconds': best,
+        'peak_rss_bytes': peak_rss,
+        'traced_peak_bytes': traced_peak,
+        'output_size': _output_size(output),
+        'dem_seconds': dem_seconds,
+    }
+
+
+def compare_benchmark_results(
+        results: List[Dict[str, Any]],
+        baseline: List[Dict[str, Any]],
+        *,
+        threshold: float = 0.25,
+        min_seconds: float = 0.05,
+        min_bytes: int = 1 << 20,
+) -> List[str]:
+    """Describes the results that regressed relative to a baseline.
+
+    A time ('seconds' or 'dem_seconds') regresses when it's more than `threshold` (as a fraction)
+    slower than the baseline, and the difference is at least `min_seconds` (so tiny timings don't
+    trip on noise). Memory ('peak_rss_bytes' or 'traced_peak_bytes') regresses when it grows by
+    more than `threshold`, and by at least `min_bytes`. The output size
+    regresses whenever it changes, since that means the benchmark is measuring different work.
+    Cases missing from the baseline are ignored.
+
+    Returns:
+        A list of human readable descriptions, one per regression. Empty if nothing regressed.
+    """
+    old_by_key = {(r['name'], r['diameter']): r for r in baseline}
+    problems = []
+    for new in results:
+        old = old_by_key.get((new['name'], new['diameter']))
+        if old is None:
+            continue
+        label = f"{new['name']} d={new['diameter']}"
+        for key in ['seconds', 'dem_seconds']:
+            a, b = old.get(key), new.get(key)
+            if a is not None and b is not None and b > a * (1 + threshold) and b - a >= min_seconds:
+                problems.append(f'{label}: {key} went from {a:.3f} to {b:.3f}')
+        for key in ['peak_rss_bytes', 'traced_peak_bytes']:
+            a, b = old.get(key), new.get(key)
+            if a is not None and b is not None and b > a * (1 + threshold) and b - a >= min_bytes:
+                problems.append(f'{label}: {key} went from {a} to {b}')
+        if old.get('output_size') != new.get('output_size'):
+            problems.append(f"{label}: output_size changed from {old.get('output_size')} to {new.get('output_size')}")
+    return problems
+
+
+def _read_benchmark_results(path: Union[str, pathlib.Path]) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def _write_benchmark_results(path: Union[str, pathlib.Path], results: List[Dict[str, Any]]) -> None:
+    with open(path, 'w') as f:
+        json.dump({'stim_version': stim.__version__, 'results': results}, f, indent=2)
+        print(file=f)
+
+
+def main_benchmark(
+        *,
+        make_cases: Callable[[List[int]], List[BenchmarkCase]],
+        default_diameters: List[int],
+) -> None:
+    """Runs benchmark cases, prints their measurements, and compares them against a baseline.
+
+    Exits with a non-zero status when a baseline is given and a case regressed.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--diameter", nargs='+', type=int, default=default_diameters)
+    parser.add_argument("--name", nargs='+', type=str, default=None, help="Only run the cases with these names.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--no_memory", action='store_true', help="Skip the extra run (in a forked process) used to measure peak RSS.")
+    parser.add_argument("--trace_python_memory", action='store_true', help="Also measure the peak Python heap usage with tracemalloc.")
+    parser.add_argument("--out", type=str, default=None, help="Write the results to this JSON file (e.g. to use as a baseline later).")
+    parser.add_argument("--baseline", type=str, default=None, help="A JSON file written by --out to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Fractional slowdown (or memory growth) counted as a regression.")
+    parser.add_argument("--min_seconds", type=float, default=0.05, help="Slowdowns smaller than this many seconds aren't counted as regressions.")
+    parser.add_argument("--min_bytes", type=int, default=1 << 20, help="Memory growth smaller than this many bytes isn't counted as a regression.")
+    args = parser.parse_args()
+
+    cases = make_cases(args.diameter)
+    if args.name is not None:
+        unknown = set(args.name) - {case.name for case in cases}
+        if unknown:
+            parser.error(f'unknown benchmark names: {sorted(unknown)}')
+        cases = [case for case in cases if case.name in args.name]
+
+    results = []
+    print(f"{'name':<45} {'d':>3} {'seconds':>9} {'rss MB':>9} {'py MB':>9} {'size':>9} {'dem s':>8}")
+    for case in cases:
+        result = run_benchmark_case(
+            case,
+            repeats=args.repeats,
+            measure_memory=not args.no_memory,
+            trace_python_memory=args.trace_python_memory,
+        )
+        results.append(result)
+        rss = '' if result['peak_rss_bytes'] is None else f"{result['peak_rss_bytes'] / 1e6:.1f}"
+        traced = '' if result['traced_peak_bytes'] is None else f"{result['traced_peak_bytes'] / 1e6:.1f}"
+        size = '' if result['output_size'] is None else str(result['output_size'])
+        dem = '' if result['dem_seconds'] is None else f"{result['dem_seconds']:.3f}"
+        print(f"{case.name:<45} {case.diameter:>3} {result['seconds']:>9.3f} {rss:>9} {traced:>9} {size:>9} {dem:>8}", flush=True)
+
+    if args.out is not None:
+        _write_benchmark_results(args.out, results)
+        print(f'wrote file://{pathlib.Path(args.out).absolute()}')
+
+    if args.baseline is not None:
+        problems = compare_benchmark_results(
+            results,
+            _read_benchmark_results(args.baseline),
+            threshold=args.threshold,
+            min_seconds=args.min_seconds,
+            min_bytes=args.min_bytes,
+        )
+        if problems:
+            print(f'{len(problems)} regressions relative to {args.baseline}:', file=sys.stderr)
+            for problem in problems:
+                print('    ' + problem, file=sys.stderr)
+            sys.exit(1)
+        print(f'no regressions relative to {args.baseline}')
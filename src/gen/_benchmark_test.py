@@ -0,0 +1,110 @@
+import os
+
+import pytest
+import stim
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import gen
+
+
+def test_run_benchmark_case():
+    calls = []
+
+    def setup():
+        calls.append('setup')
+        return 3
+
+    def func(d):
+        calls.append('func')
+        return stim.Circuit.generated('repetition_code:memory', distance=d, rounds=5, before_measure_flip_probability=0.01)
+
+    result = gen.run_benchmark_case(
+        gen.BenchmarkCase(name='rep', diameter=3, setup=setup, func=func, dem=True),
+        repeats=2,
+    )
+    # The run measuring memory happens in a forked process, so it doesn't show up here.
+    assert calls == ['setup', 'func', 'func']
+    assert result['name'] == 'rep'
+    assert result['diameter'] == 3
+    assert result['seconds'] >= 0
+    assert result['peak_rss_bytes'] >= 0
+    assert result['traced_peak_bytes'] is None
+    assert result['dem_seconds'] >= 0
+    assert result['output_size'] == gen.count_instructions(func(3))
+
+    result = gen.run_benchmark_case(
+        gen.BenchmarkCase(name='list', diameter=1, func=lambda _: [1, 2, 3]),
+        repeats=1,
+        measure_memory=False,
+        trace_python_memory=True,
+    )
+    assert result['peak_rss_bytes'] is None
+    assert result['traced_peak_bytes'] >= 0
+    assert result['dem_seconds'] is None
+    assert result['output_size'] == 3
+
+    with pytest.raises(ValueError):
+        gen.run_benchmark_case(gen.BenchmarkCase(name='x', diameter=1, func=lambda _: None), repeats=0)
+
+
+def _allocate_in_stim(size: int) -> stim.TableauSimulator:
+    sim = stim.TableauSimulator()
+    sim.set_num_qubits(size)
+    return sim
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork') or resource is None, reason='needs fork and resource')
+def test_run_benchmark_case_peak_rss_sees_stim_allocations():
+    small = gen.run_benchmark_case(
+        gen.BenchmarkCase(name='small', diameter=1, func=lambda _: _allocate_in_stim(10)),
+        repeats=1,
+        trace_python_memory=True,
+    )
+    # A 10000 qubit tableau holds four 10000x10000 bit tables (about 50MB), all allocated by stim.
+    big = gen.run_benchmark_case(
+        gen.BenchmarkCase(name='big', diameter=1, func=lambda _: _allocate_in_stim(10000)),
+        repeats=1,
+        trace_python_memory=True,
+    )
+    assert big['peak_rss_bytes'] > small['peak_rss_bytes'] + 20_000_000
+    assert big['traced_peak_bytes'] < 1_000_000
+
+    with pytest.raises(RuntimeError, match='bad d=1 failed'):
+        gen.run_benchmark_case(gen.BenchmarkCase(name='bad', diameter=1, func=lambda _: 1 / 0), repeats=1)
+
+
+def test_compare_benchmark_results():
+    def r(name, d, seconds, memory=10_000_000, size=10, dem=None):
+        return {
+            'name': name,
+            'diameter': d,
+            'seconds': seconds,
+            'peak_rss_bytes': memory,
+            'traced_peak_bytes': None,
+            'output_size': size,
+            'dem_seconds': dem,
+        }
+
+    baseline = [r('a', 5, 1.0, dem=2.0), r('a', 11, 0.01), r('b', 5, 1.0)]
+    assert gen.compare_benchmark_results([r('a', 5, 1.2, dem=2.4), r('c', 5, 100)], baseline) == []
+    assert gen.compare_benchmark_results([r('a', 11, 0.03)], baseline) == []
+    assert gen.compare_benchmark_results([r('a', 11, 0.03)], baseline, min_seconds=0.01) == [
+        'a d=11: seconds went from 0.010 to 0.030',
+    ]
+    assert gen.compare_benchmark_results(
+        [r('a', 5, 1.5, dem=3.0), r('b', 5, 0.5, memory=20_000_000, size=11)],
+        baseline,
+    ) == [
+        'a d=5: seconds went from 1.000 to 1.500',
+        'a d=5: dem_seconds went from 2.000 to 3.000',
+        'b d=5: peak_rss_bytes went from 10000000 to 20000000',
+        'b d=5: output_size changed from 10 to 11',
+    ]
+    assert gen.compare_benchmark_results([r('a', 5, 1.5)], baseline, threshold=1) == []
+
+    # Tiny memory changes (e.g. a few pages of a tiny case) aren't counted.
+    assert gen.compare_benchmark_results([r('a', 11, 0.01, memory=100_000)], [r('a', 11, 0.01, memory=10_000)]) == []
@@ -1,7 +1,9 @@
-from typing import Iterable, Dict, Callable, Any, Optional, List, Tuple, TYPE_CHECKING
+from typing import Iterable, Dict, Callable, Any, Optional, List, Tuple, Union, TYPE_CHECKING
 
+import array
 import dataclasses
 
+import numpy as np
 import stim
 
 from gen._util import complex_key, sorted_complex
@@ -36,22 +38,125 @@ class AtLayer:
     layer: Any
 
 
+def _kind_and_round(layer: Any) -> Optional[Tuple[Any, int]]:
+    if isinstance(layer, tuple) and len(layer) == 2 and isinstance(layer[1], int):
+        return layer
+    return None
+
+
+class _LayerRetention:
+    """Tracks which measurement layers are alive, for evicting old layers from a tracker.
+
+    The keys of each layer are only tracked when `max_layers` is set. Otherwise nothing is kept
+    per key, and evicting layers scans the tracker's keys instead. Evicted layers aren't
+    remembered one by one. For layers that are `(kind, round)` tuples, only
+    the round below which each kind's layers were evicted is kept, so that referring to an evicted
+    key can be reported as such without memory growing with the number of evicted layers.
+    """
+
+    def __init__(self, *, max_layers: Optional[int]):
+        if max_layers is not None and max_layers < 1:
+            raise ValueError(f'{max_layers=} < 1')
+        self.max_layers = max_layers
+        self.layer_keys: Dict[Any, List[AtLayer]] = {}
+        self.evicted_before: Dict[Any, int] = {}
+
+    def copy(self) -> '_LayerRetention':
+        result = _LayerRetention(max_layers=self.max_layers)
+        result.layer_keys = {k: list(v) for k, v in self.layer_keys.items()}
+        result.evicted_before = dict(self.evicted_before)
+        return result
+
+    def note_recorded(self, key: Any) -> List[AtLayer]:
+        """Notes that a key was recorded, and returns the keys that are now expired."""
+        if self.max_layers is None or not isinstance(key, AtLayer):
+            return []
+        keys = self.layer_keys.get(key.layer)
+        if keys is not None:
+            keys.append(key)
+            return []
+        self.layer_keys[key.layer] = [key]
+        if len(self.layer_keys) <= self.max_layers:
+            return []
+        oldest_layer = next(iter(self.layer_keys))
+        kind_round = _kind_and_round(oldest_layer)
+        if kind_round is not None:
+            self._raise_watermark(kind_round[0], kind_round[1] + 1)
+        return self.layer_keys.pop(oldest_layer)
+
+    def _raise_watermark(self, kind: Any, round_index: int) -> None:
+        self.evicted_before[kind] = max(self.evicted_before.get(kind, round_index), round_index)
+
+    def take_layers_before(self, kind: Any, round_index: int, *, all_keys: Iterable[Any]) -> List[AtLayer]:
+        """Evicts the `(kind, r)` layers with `r < round_index`, and returns their keys.
+
+        Args:
+            kind: The kind of layer to evict.
+            round_index: Layers of the given kind with a smaller round are evicted.
+            all_keys: The tracker's keys. Scanned for the evicted keys when layers aren't tracked.
+        """
+        def is_evicted(layer: Any) -> bool:
+            kind_round = _kind_and_round(layer)
+            return kind_round is not None and kind_round[0] == kind and kind_round[1] < round_index
+
+        result = []
+        if self.max_layers is None:
+            result.extend(key for key in all_keys if isinstance(key, AtLayer) and is_evicted(key.layer))
+        else:
+            for layer in list(self.layer_keys):
+                if is_evicted(layer):
+                    result.extend(self.layer_keys.pop(layer))
+        self._raise_watermark(kind, round_index)
+        return result
+
+    def check_missing_key(self, key: Any) -> None:
+        if isinstance(key, AtLayer):
+            kind_round = _kind_and_round(key.layer)
+            if kind_round is not None and kind_round[1] < self.evicted_before.get(kind_round[0], kind_round[1]):
+                raise ValueError(f"Measurement was evicted (its layer is no longer retained): {key=}")
+        raise ValueError(f"No such measurement: {key=}")
+
+
 class MeasurementTracker:
     """Tracks measurements and groups of measurements, for producing stim record targets."""
-    def __init__(self):
+    def __init__(self, *, max_layers: Optional[int] = None):
+        """
+        Args:
+            max_layers: Opt-in retention policy. When set, only the keys of the most recent
+                `max_layers` layers are kept. A layer is the `layer` of an `AtLayer` key, and
+                layers are ordered by when they were first recorded. Keys from older layers are
+                evicted as new layers arrive, and referring to them raises a ValueError (saying
+                the key was evicted, when its layer is a `(kind, round)` tuple). Keys that aren't
+                `AtLayer` instances are never evicted.
+        """
         self.recorded: Dict[Any, Optional[List[int]]] = {}
         self.next_measurement_index = 0
+        self._retention = _LayerRetention(max_layers=max_layers)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.recorded
 
     def copy(self) -> 'MeasurementTracker':
         result = MeasurementTracker()
         result.recorded = {k: list(v) for k, v in self.recorded.items()}
         result.next_measurement_index = self.next_measurement_index
+        result._retention = self._retention.copy()
         return result
 
+    def evict_layers_before(self, kind: Any, round_index: int) -> None:
+        """Forgets the keys of every `(kind, r)` layer with `r < round_index`.
+
+        Referring to an evicted key raises a ValueError.
+        """
+        for key in self._retention.take_layers_before(kind, round_index, all_keys=self.recorded.keys()):
+            self.recorded.pop(key, None)
+
     def _rec(self, key: Any, value: Optional[List[int]]) -> None:
         if key in self.recorded:
             raise ValueError(f'Measurement key collision: {key=}')
         self.recorded[key] = value
+        for expired in self._retention.note_recorded(key):
+            self.recorded.pop(expired, None)
 
     def record_measurement(self, key: Any) -> None:
         self._rec(key, [self.next_measurement_index])
@@ -67,7 +172,7 @@ class MeasurementTracker:
         result = set()
         for key in keys:
             if key not in self.recorded:
-                raise ValueError(f"No such measurement: {key=}")
+                self._retention.check_missing_key(key)
             for v in self.recorded[key]:
                 if v is None:
                     raise ValueError(f"Obstacle at {key=}")
@@ -83,6 +188,130 @@ class MeasurementTracker:
         return [stim.target_rec(t - t0) for t in sorted(times)]
 
 
+class ArrayMeasurementTracker:
+    """A MeasurementTracker that interns keys and stores measurement records in flat arrays.
+
+    Has the same interface as MeasurementTracker, except that there is no `recorded` dictionary.
+    Each key is interned to an integer id. Keys of single measurements store their measurement
+    index in a flat integer array, instead of in a list of their own, and measurement groups are
+    stored as packed index arrays. This uses much less memory than MeasurementTracker when
+    tracking millions of measurements, and merges large groups using numpy.
+    """
+
+    _GROUP = -1
+    _OBSTACLE = -2
+    _MIN_VECTORIZED_MERGE_SIZE = 64
+
+    def __init__(self, *, max_layers: Optional[int] = None):
+        """
+        Args:
+            max_layers: Opt-in retention policy, with the same meaning as for
+                MeasurementTracker. The ids of evicted keys are reused by new keys, so memory
+                stays flat when only a bounded number of layers is retained.
+        """
+        self.key_ids: Dict[Any, int] = {}
+        self._records = array.array('q')
+        self._groups: Dict[int, np.ndarray] = {}
+        self._free_ids: List[int] = []
+        self._retention = _LayerRetention(max_layers=max_layers)
+        self.next_measurement_index = 0
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.key_ids
+
+    def copy(self) -> 'ArrayMeasurementTracker':
+        result = ArrayMeasurementTracker()
+        result.key_ids = dict(self.key_ids)
+        result._records = array.array('q', self._records)
+        result._groups = dict(self._groups)
+        result._free_ids = list(self._free_ids)
+        result._retention = self._retention.copy()
+        result.next_measurement_index = self.next_measurement_index
+        return result
+
+    def evict_layers_before(self, kind: Any, round_index: int) -> None:
+        """Forgets the keys of every `(kind, r)` layer with `r < round_index`.
+
+        Referring to an evicted key raises a ValueError.
+        """
+        self._forget(self._retention.take_layers_before(kind, round_index, all_keys=self.key_ids.keys()))
+
+    def _forget(self, keys: Iterable[Any]) -> None:
+        for key in keys:
+            key_id = self.key_ids.pop(key, None)
+            if key_id is not None:
+                self._groups.pop(key_id, None)
+                self._free_ids.append(key_id)
+
+    def _rec(self, key: Any, value: int) -> int:
+        if key in self.key_ids:
+            raise ValueError(f'Measurement key collision: {key=}')
+        if self._free_ids:
+            key_id = self._free_ids.pop()
+            self._records[key_id] = value
+        else:
+            key_id = len(self._records)
+            self._records.append(value)
+        self.key_ids[key] = key_id
+        self._forget(self._retention.note_recorded(key))
+        return key_id
+
+    def record_measurement(self, key: Any) -> None:
+        self._rec(key, self.next_measurement_index)
+        self.next_measurement_index += 1
+
+    def make_measurement_group(self, sub_keys: Iterable[Any], *, key: Any) -> None:
+        indices = self.measurement_indices(sub_keys)
+        if len(indices) == 1:
+            self._rec(key, indices[0])
+        else:
+            group = np.array(indices, dtype=np.int64)
+            group.setflags(write=False)
+            self._groups[self._rec(key, ArrayMeasurementTracker._GROUP)] = group
+
+    def record_obstacle(self, key: Any) -> None:
+        self._rec(key, ArrayMeasurementTracker._OBSTACLE)
+
+    def measurement_indices(self, keys: Iterable[Any]) -> List[int]:
+        singles = []
+        groups = []
+        for key in keys:
+            key_id = self.key_ids.get(key)
+            if key_id is None:
+                self._retention.check_missing_key(key)
+            v = self._records[key_id]
+            if v >= 0:
+                singles.append(v)
+            elif v == ArrayMeasurementTracker._GROUP:
+                groups.append(self._groups[key_id])
+            else:
+                raise ValueError(f"Obstacle at {key=}")
+
+        if groups:
+            if len(singles) + sum(len(g) for g in groups) >= ArrayMeasurementTracker._MIN_VECTORIZED_MERGE_SIZE:
+                values, counts = np.unique(
+                    np.concatenate([np.array(singles, dtype=np.int64), *groups]),
+                    return_counts=True,
+                )
+                return values[counts & 1 == 1].tolist()
+            for group in groups:
+                singles.extend(group.tolist())
+
+        # Cancel out pairs of equal indices.
+        singles.sort()
+        result = []
+        for v in singles:
+            if result and result[-1] == v:
+                result.pop()
+            else:
+                result.append(v)
+        return result
+
+    def current_measurement_record_targets_for(self, keys: Iterable[Any]) -> List[stim.GateTarget]:
+        t0 = self.next_measurement_index
+        return [stim.target_rec(t - t0) for t in self.measurement_indices(keys)]
+
+
 class Builder:
     """Helper class for building stim circuits.
 
@@ -94,7 +323,7 @@ class Builder:
                  *,
                  q2i: Dict[complex, int],
                  circuit: stim.Circuit,
-                 tracker: MeasurementTracker):
+                 tracker: Union[MeasurementTracker, ArrayMeasurementTracker]):
         self.q2i = q2i
         self.circuit = circuit
         self.tracker = tracker
@@ -112,7 +341,17 @@ class Builder:
     def for_qubits(
             qubits: Iterable[complex],
             *,
-            to_circuit_coord_data: Callable[[complex], complex] = lambda e: e) -> 'Builder':
+            to_circuit_coord_data: Callable[[complex], complex] = lambda e: e,
+            tracker: Union[MeasurementTracker, ArrayMeasurementTracker, None] = None) -> 'Builder':
+        """Creates a builder with the given qubits (indexed in sorted order) declared in its circuit.
+
+        Args:
+            qubits: The qubits to declare.
+            to_circuit_coord_data: Transforms qubit positions into the circuit's QUBIT_COORDS.
+            tracker: The measurement tracker to use. Defaults to a new MeasurementTracker.
+        """
+        if tracker is None:
+            tracker = MeasurementTracker()
         q2i = {q: i for i, q in enumerate(sorted_complex(set(qubits)))}
         circuit = stim.Circuit()
         for q, i in q2i.items():
@@ -121,7 +360,7 @@ class Builder:
         return Builder(
             q2i=q2i,
             circuit=circuit,
-            tracker=MeasurementTracker(),
+            tracker=tracker,
         )
 
     def gate(self,
@@ -243,6 +482,59 @@ class Builder:
                     z |= set(bqs)
                 else:
                     raise NotImplementedError(f'{b=}')
+        targets = self._pauli_product_targets(x=x, y=y, z=z, q2b=q2b)
+        if targets:
+            self.circuit.append('MPP', targets, noise)
+            self.tracker.record_measurement(key)
+        else:
+            self.tracker.make_measurement_group([], key=key)
+
+    def measure_pauli_products(self,
+                               products: Iterable[Dict[complex, str]],
+                               *,
+                               keys: Iterable[Any],
+                               noise: Optional[float] = None) -> None:
+        """Measures several Pauli products using a single MPP instruction.
+
+        Equivalent to calling `measure_pauli_product(q2b=product, key=key, noise=noise)` for each
+        product/key pair, but appends all the products at once.
+
+        Args:
+            products: The products to measure, each given as a mapping from qubit to basis.
+            keys: The measurement keys to track the results under, one per product.
+            noise: Make the measurements noisy.
+        """
+        products = list(products)
+        keys = list(keys)
+        if len(products) != len(keys):
+            raise ValueError(f'{len(products)=} != {len(keys)=}')
+
+        targets = []
+        measured_keys = []
+        for product, key in zip(products, keys):
+            product_targets = self._pauli_product_targets(x=set(), y=set(), z=set(), q2b=product)
+            if product_targets:
+                targets.extend(product_targets)
+                measured_keys.append(key)
+            else:
+                self.tracker.make_measurement_group([], key=key)
+        if targets:
+            self.circuit.append('MPP', targets, noise)
+        for key in measured_keys:
+            self.tracker.record_measurement(key)
+
+    def _pauli_product_targets(
+            self,
+            *,
+            x: set,
+            y: set,
+            z: set,
+            q2b: Optional[Dict[complex, str]] = None,
+    ) -> List[stim.GateTarget]:
+        """Returns MPP targets for the product of the given X, Y, and Z terms (ignoring phase).
+
+        The terms of `q2b` (a mapping from qubit to basis) are added into the given sets.
+        """
         if q2b is not None:
             for q, b in q2b.items():
                 if b == 'X':
@@ -280,10 +572,7 @@ class Builder:
             targets.append(comb)
         if targets:
             targets.pop()
-            self.circuit.append('MPP', targets, noise)
-            self.tracker.record_measurement(key)
-        else:
-            self.tracker.make_measurement_group([], key=key)
+        return targets
 
     def detector(self,
                  keys: Iterable[Any],
@@ -305,10 +594,68 @@ class Builder:
             coords = None
 
         if ignore_non_existent:
-            keys = [k for k in keys if k in self.tracker.recorded]
+            keys = [k for k in keys if k in self.tracker]
         targets = self.tracker.current_measurement_record_targets_for(keys)
         self.circuit.append('DETECTOR', targets, coords)
 
+    def detectors(self,
+                  groups: Iterable[Iterable[Any]],
+                  *,
+                  positions: Iterable[Optional[complex]],
+                  t: float = 0,
+                  extra_coords: Iterable[float] = (),
+                  ignore_non_existent: bool = False,
+                  skip_empty: bool = False) -> None:
+        """Adds a block of detectors, one per group of measurement keys.
+
+        Equivalent to calling `detector(keys, pos=pos, t=t, extra_coords=extra_coords)` for each
+        group and position, but resolves all the groups before computing their record offsets in
+        one vectorized pass and appending the detectors as a single block.
+
+        Args:
+            groups: The measurement keys of each detector.
+            positions: The position of each detector, or None for a detector without coordinates.
+            t: The time coordinate of the detectors.
+            extra_coords: Coordinates to append after the time coordinate of every detector.
+            ignore_non_existent: Drop keys that aren't tracked, instead of failing.
+            skip_empty: Don't add detectors that end up not containing any measurements.
+        """
+        groups = list(groups)
+        positions = list(positions)
+        if len(groups) != len(positions):
+            raise ValueError(f'{len(groups)=} != {len(positions)=}')
+        extra_coords = list(extra_coords)
+        if extra_coords and any(pos is None for pos in positions):
+            raise ValueError('pos is None but extra_coords is not empty')
+        coord_suffix = ''.join(f', {float(c)!r}' for c in [t, *extra_coords])
+
+        indices = []
+        boundaries = [0]
+        heads = []
+        for keys, pos in zip(groups, positions):
+            if ignore_non_existent:
+                keys = [k for k in keys if k in self.tracker]
+            group_indices = self.tracker.measurement_indices(keys)
+            if skip_empty and not group_indices:
+                continue
+            indices.extend(group_indices)
+            boundaries.append(len(indices))
+            if pos is None:
+                heads.append('DETECTOR')
+            else:
+                heads.append(f'DETECTOR({float(pos.real)!r}, {float(pos.imag)!r}{coord_suffix})')
+        if not heads:
+            return
+
+        offsets = np.array(indices, dtype=np.int64) - self.tracker.next_measurement_index
+        recs = [f' rec[{k}]' for k in offsets.tolist()]
+        lines = [
+            head + ''.join(recs[boundaries[k]:boundaries[k + 1]])
+            for k, head in enumerate(heads)
+        ]
+        # Parsing one block of text is much faster than appending each detector separately.
+        self.circuit += stim.Circuit('\n'.join(lines))
+
     def obs_include(self,
                     keys: Iterable[Any],
                     *,
@@ -1,6 +1,9 @@
+import random
+
+import pytest
 import stim
 
-from gen._builder import Builder
+from gen._builder import Builder, MeasurementTracker, ArrayMeasurementTracker, AtLayer
 
 
 def test_builder_init():
@@ -10,3 +13,212 @@ def test_builder_init():
         QUBIT_COORDS(0, 1) 1
         QUBIT_COORDS(3, 2) 2
     """)
+
+
+def test_builder_for_qubits_tracker():
+    tracker = ArrayMeasurementTracker()
+    builder = Builder.for_qubits([0, 1], tracker=tracker)
+    assert builder.tracker is tracker
+    builder.measure([0, 1], save_layer='a')
+    builder.detector([AtLayer(0, 'a'), AtLayer(1, 'a'), AtLayer(1, 'b')], pos=None, ignore_non_existent=True)
+    assert builder.circuit[-1] == stim.CircuitInstruction('DETECTOR', [stim.target_rec(-2), stim.target_rec(-1)])
+    assert isinstance(Builder.for_qubits([0]).tracker, MeasurementTracker)
+
+
+def test_array_measurement_tracker():
+    tracker = ArrayMeasurementTracker()
+    tracker.record_measurement('a')
+    tracker.record_measurement('b')
+    tracker.record_measurement('c')
+    tracker.make_measurement_group(['a', 'b'], key='ab')
+    tracker.make_measurement_group(['ab', 'b'], key='ab_b')
+    tracker.make_measurement_group([], key='empty')
+    tracker.record_obstacle('wall')
+
+    assert 'a' in tracker
+    assert 'd' not in tracker
+    assert tracker.measurement_indices(['ab', 'c']) == [0, 1, 2]
+    assert tracker.measurement_indices(['ab', 'a', 'b']) == []
+    assert tracker.measurement_indices(['ab_b', 'empty']) == [0]
+    assert tracker.current_measurement_record_targets_for(['c', 'ab']) == [
+        stim.target_rec(-3),
+        stim.target_rec(-2),
+        stim.target_rec(-1),
+    ]
+    with pytest.raises(ValueError, match='collision'):
+        tracker.record_measurement('a')
+    with pytest.raises(ValueError, match='No such measurement'):
+        tracker.measurement_indices(['d'])
+    with pytest.raises(ValueError, match='Obstacle'):
+        tracker.measurement_indices(['wall'])
+
+    copy = tracker.copy()
+    copy.record_measurement('d')
+    assert 'd' in copy
+    assert 'd' not in tracker
+    assert copy.next_measurement_index == 4
+    assert tracker.next_measurement_index == 3
+
+
+def test_array_measurement_tracker_matches_measurement_tracker():
+    rng = random.Random(3)
+    expected = MeasurementTracker()
+    actual = ArrayMeasurementTracker()
+    keys = []
+    for k in range(1000):
+        if keys and rng.random() < 0.3:
+            sub_keys = [rng.choice(keys) for _ in range(rng.randrange(100))]
+            expected.make_measurement_group(sub_keys, key=k)
+            actual.make_measurement_group(sub_keys, key=k)
+        else:
+            expected.record_measurement(k)
+            actual.record_measurement(k)
+        keys.append(k)
+        query = [rng.choice(keys) for _ in range(rng.randrange(10))]
+        assert actual.measurement_indices(query) == expected.measurement_indices(query)
+        assert actual.current_measurement_record_targets_for(query) == expected.current_measurement_record_targets_for(query)
+
+
+@pytest.mark.parametrize('tracker_type', [MeasurementTracker, ArrayMeasurementTracker])
+def test_tracker_max_layers(tracker_type):
+    tracker = tracker_type(max_layers=2)
+    tracker.record_measurement(AtLayer('a', ('r', 0)))
+    tracker.record_measurement(AtLayer('b', ('r', 0)))
+    tracker.record_measurement('not_layered')
+    tracker.record_measurement(AtLayer('a', ('r', 1)))
+    assert tracker.measurement_indices([AtLayer('a', ('r', 0)), AtLayer('a', ('r', 1))]) == [0, 3]
+
+    tracker.record_measurement(AtLayer('a', ('r', 2)))
+    assert AtLayer('a', ('r', 0)) not in tracker
+    assert AtLayer('b', ('r', 0)) not in tracker
+    assert tracker.measurement_indices([AtLayer('a', ('r', 1)), AtLayer('a', ('r', 2)), 'not_layered']) == [2, 3, 4]
+    with pytest.raises(ValueError, match='evicted'):
+        tracker.measurement_indices([AtLayer('b', ('r', 0))])
+    with pytest.raises(ValueError, match='No such measurement'):
+        tracker.measurement_indices([AtLayer('c', ('r', 2))])
+    with pytest.raises(ValueError, match='No such measurement'):
+        tracker.measurement_indices([AtLayer('c', ('other', 0))])
+
+    copy = tracker.copy()
+    copy.record_measurement(AtLayer('a', ('r', 3)))
+    assert AtLayer('a', ('r', 1)) not in copy
+    assert AtLayer('a', ('r', 1)) in tracker
+
+    # Layers that aren't (kind, round) tuples are also evicted, but not remembered.
+    tracker = tracker_type(max_layers=1)
+    tracker.record_measurement(AtLayer('a', 'start'))
+    tracker.record_measurement(AtLayer('a', 'end'))
+    assert AtLayer('a', 'start') not in tracker
+    with pytest.raises(ValueError, match='No such measurement'):
+        tracker.measurement_indices([AtLayer('a', 'start')])
+
+    tracker = tracker_type(max_layers=3)
+    for layer in range(3):
+        tracker.record_measurement(AtLayer('a', ('r', layer)))
+    tracker.evict_layers_before('r', 2)
+    assert list(tracker._retention.layer_keys) == [('r', 2)]
+    with pytest.raises(ValueError, match='evicted'):
+        tracker.measurement_indices([AtLayer('a', ('r', 1))])
+    assert tracker.measurement_indices([AtLayer('a', ('r', 2))]) == [2]
+
+    with pytest.raises(ValueError, match='max_layers'):
+        tracker_type(max_layers=0)
+
+
+@pytest.mark.parametrize('tracker_type', [MeasurementTracker, ArrayMeasurementTracker])
+def test_tracker_evict_layers_before(tracker_type):
+    tracker = tracker_type()
+    for layer in range(5):
+        tracker.record_measurement(AtLayer('a', ('r', layer)))
+        tracker.make_measurement_group([AtLayer('a', ('r', layer)), AtLayer('a', ('r', 0))], key=AtLayer('b', ('r', layer)))
+        tracker.record_measurement(AtLayer('a', ('s', layer)))
+    # Without max_layers, the tracker doesn't keep its keys a second time.
+    assert tracker._retention.layer_keys == {}
+    tracker.evict_layers_before('r', 3)
+    assert AtLayer('a', ('r', 2)) not in tracker
+    assert AtLayer('b', ('r', 2)) not in tracker
+    assert AtLayer('a', ('s', 2)) in tracker
+    with pytest.raises(ValueError, match='evicted'):
+        tracker.measurement_indices([AtLayer('b', ('r', 1))])
+    assert tracker._retention.evicted_before == {'r': 3}
+
+    # The watermark never moves back.
+    tracker.evict_layers_before('r', 1)
+    assert tracker._retention.evicted_before == {'r': 3}
+
+    tracker.record_measurement(AtLayer('a', ('r', 5)))
+    tracker.record_measurement(AtLayer('a', ('r', 0)))
+    assert tracker.measurement_indices([AtLayer('b', ('r', 4)), AtLayer('a', ('r', 0)), AtLayer('a', ('r', 5))]) == [0, 8, 10, 11]
+    assert tracker.current_measurement_record_targets_for([AtLayer('a', ('r', 5))]) == [stim.target_rec(-2)]
+
+
+def test_measure_pauli_products():
+    builder = Builder.for_qubits([0, 1, 2, 3])
+    builder.measure_pauli_products(
+        [{0: 'X', 1: 'X'}, {}, {2: 'Z', 3: 'Y'}, {1: 'Z'}],
+        keys=['a', 'b', 'c', 'd'],
+        noise=0.125,
+    )
+    assert builder.circuit == stim.Circuit("""
+        QUBIT_COORDS(0, 0) 0
+        QUBIT_COORDS(1, 0) 1
+        QUBIT_COORDS(2, 0) 2
+        QUBIT_COORDS(3, 0) 3
+        MPP(0.125) X0*X1 Z2*Y3 Z1
+    """)
+    assert builder.tracker.measurement_indices(['a']) == [0]
+    assert builder.tracker.measurement_indices(['b']) == []
+    assert builder.tracker.measurement_indices(['c']) == [1]
+    assert builder.tracker.measurement_indices(['d']) == [2]
+
+    separate = Builder.for_qubits([0, 1, 2, 3])
+    separate.measure_pauli_product(q2b={0: 'X', 1: 'X'}, key='a', noise=0.125)
+    separate.measure_pauli_product(q2b={}, key='b', noise=0.125)
+    separate.measure_pauli_product(q2b={2: 'Z', 3: 'Y'}, key='c', noise=0.125)
+    separate.measure_pauli_product(q2b={1: 'Z'}, key='d', noise=0.125)
+    assert separate.circuit == builder.circuit
+
+    with pytest.raises(ValueError):
+        builder.measure_pauli_products([{0: 'X'}], keys=[])
+
+
+def test_detectors():
+    def make_builder() -> Builder:
+        builder = Builder.for_qubits([0, 1, 2])
+        builder.measure([0, 1, 2], save_layer='a')
+        builder.measure([0, 1], save_layer='b')
+        return builder
+
+    groups = [
+        [AtLayer(0, 'a'), AtLayer(0, 'b')],
+        [AtLayer(1, 'a'), AtLayer(1, 'b'), AtLayer(2, 'b')],
+        [AtLayer(2, 'b')],
+        [AtLayer(2, 'a')],
+    ]
+    positions = [0, 1.5 + 2j, 2, 3j]
+
+    actual = make_builder()
+    actual.detectors(groups, positions=positions, t=1, extra_coords=[0.25], ignore_non_existent=True)
+    expected = make_builder()
+    for keys, pos in zip(groups, positions):
+        expected.detector(keys, pos=pos, t=1, extra_coords=[0.25], ignore_non_existent=True)
+    assert actual.circuit == expected.circuit
+    assert str(actual.circuit).endswith("""
+DETECTOR(0, 0, 1, 0.25) rec[-5] rec[-2]
+DETECTOR(1.5, 2, 1, 0.25) rec[-4] rec[-1]
+DETECTOR(2, 0, 1, 0.25)
+DETECTOR(0, 3, 1, 0.25) rec[-3]""")
+
+    skipped = make_builder()
+    skipped.detectors(groups, positions=[None] * 4, ignore_non_existent=True, skip_empty=True)
+    assert str(skipped.circuit).endswith("""
+DETECTOR rec[-5] rec[-2]
+DETECTOR rec[-4] rec[-1]
+DETECTOR rec[-3]""")
+
+    with pytest.raises(ValueError, match='No such measurement'):
+        make_builder().detectors(groups, positions=positions)
+    with pytest.raises(ValueError, match='extra_coords'):
+        make_builder().detectors(groups, positions=[None] * 4, extra_coords=[1], ignore_non_existent=True)
+    with pytest.raises(ValueError):
+        make_builder().detectors(groups, positions=[])
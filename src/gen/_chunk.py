@@ -1,4 +1,4 @@
-from typing import Iterable, Dict, Callable, Union, List
+from typing import Iterable, Dict, Callable, Union, List, Optional, TYPE_CHECKING
 
 import sinter
 import stim
@@ -8,6 +8,9 @@ from gen._flow import Flow, PauliString
 from gen._patch import Patch
 from gen._tile import Tile
 
+if TYPE_CHECKING:
+    from gen._verification_cache import VerificationCache
+
 
 class Chunk:
     """A circuit chunk with accompanying stabilizer flow assertions."""
@@ -73,8 +76,16 @@ class Chunk:
     def with_repetitions(self, repetitions: int) -> 'ChunkLoop':
         return ChunkLoop([self], repetitions=repetitions)
 
-    def verify(self):
-        """Checks that this chunk's circuit actually implements its flows."""
+    def verify(self, *, cache: Optional['VerificationCache'] = None):
+        """Checks that this chunk's circuit actually implements its flows.
+
+        Args:
+            cache: Optional. When specified, verification is skipped if a chunk with the same
+                content already passed verification through this cache.
+        """
+        if cache is not None:
+            cache.verify(self)
+            return
         for key, group in sinter.group_by(self.flows, key=lambda flow: (flow.start, flow.obs_index)).items():
             if key[0] and len(group) > 1:
                 raise ValueError(f"Multiple flows with same non-empty end: {group}")
@@ -162,9 +173,9 @@ class ChunkLoop:
     def magic(self) -> bool:
         return any(c.magic for c in self.chunks)
 
-    def verify(self):
+    def verify(self, *, cache: Optional['VerificationCache'] = None):
         for c in self.chunks:
-            c.verify()
+            c.verify(cache=cache)
         for k in range(len(self.chunks)):
             before: Chunk = self.chunks[k - 1]
             after: Chunk = self.chunks[k]
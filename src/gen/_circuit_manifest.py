@@ -0,0 +1,298 @@
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import site
+import sys
+import sysconfig
+import types
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import stim
+
+MANIFEST_FILE_NAME = 'manifest.jsonl'
+
+# Number of error mechanisms introduced per target (or target pair, or target product) by noise channels.
+_ERRORS_PER_TARGET_GROUP = {
+    'DEPOLARIZE1': 3,
+    'DEPOLARIZE2': 15,
+    'X_ERROR': 1,
+    'Y_ERROR': 1,
+    'Z_ERROR': 1,
+}
+_NOISY_MEASUREMENTS = {'M', 'MX', 'MY', 'MZ', 'MR', 'MRX', 'MRY', 'MRZ', 'MPP', 'MXX', 'MYY', 'MZZ'}
+_PAIR_GATES = {'DEPOLARIZE2', 'PAULI_CHANNEL_2', 'MXX', 'MYY', 'MZZ'}
+_CORRELATED_ERRORS = {'E', 'CORRELATED_ERROR', 'ELSE_CORRELATED_ERROR'}
+
+
+@functools.lru_cache(maxsize=None)
+def _library_dirs() -> Tuple[pathlib.Path, ...]:
+    """Directories holding the standard library and installed packages."""
+    paths = sysconfig.get_paths()
+    dirs = {paths[k] for k in ['stdlib', 'platstdlib', 'purelib', 'platlib'] if k in paths}
+    dirs.add(site.getusersitepackages())
+    return tuple(pathlib.Path(d).resolve() for d in dirs)
+
+
+def _local_module_path(module: types.ModuleType) -> Optional[pathlib.Path]:
+    """The module's source file, or None if it's builtin or part of the stdlib or an installed package."""
+    path = getattr(module, '__file__', None)
+    if path is None:
+        return None
+    path = pathlib.Path(path).resolve()
+    if any(path.is_relative_to(d) for d in _library_dirs()):
+        return None
+    return path
+
+
+def _referenced_module(value: Any) -> Optional[types.ModuleType]:
+    if isinstance(value, types.ModuleType):
+        return value
+    name = getattr(value, '__module__', None)
+    if not isinstance(name, str):
+        return None
+    return sys.modules.get(name)
+
+
+def local_modules_used_by(func: Callable) -> List[types.ModuleType]:
+    """Returns the module defining `func`, and the local modules it transitively uses.
+
+    A module counts as using another module when one of its globals is that module, or is a
+    function or class defined in that module. Modules from the standard library or from installed
+    packages (stim, numpy, ...) aren't included or followed.
+    """
+    start = sys.modules.get(getattr(func, '__module__', None))
+    if start is None or _local_module_path(start) is None:
+        return []
+
+    seen: Dict[str, types.ModuleType] = {start.__name__: start}
+    queue = [start]
+    while queue:
+        module = queue.pop()
+        for value in list(vars(module).values()):
+            other = _referenced_module(value)
+            if other is None or other.__name__ in seen:
+                continue
+            if _local_module_path(other) is None:
+                continue
+            seen[other.__name__] = other
+            queue.append(other)
+    return [seen[name] for name in sorted(seen)]
+
+
+def construction_source_hash(construction: Callable) -> str:
+    """Returns a hash of the source code that a circuit construction depends on.
+
+    The hash covers the source files of the modules returned by `local_modules_used_by`. Editing
+    one construction's module changes the hash of constructions using that module, but not the
+    hash of unrelated constructions. Editing shared code (e.g. `gen`) changes every hash.
+    """
+    h = hashlib.sha256()
+    modules = local_modules_used_by(construction)
+    if not modules:
+        h.update(getattr(construction, '__qualname__', repr(construction)).encode('utf8'))
+    for module in modules:
+        h.update(module.__name__.encode('utf8'))
+        h.update(b'\0')
+        h.update(_local_module_path(module).read_bytes())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _dem_size_estimate(circuit: stim.Circuit) -> int:
+    total = 0
+    for inst in circuit:
+        if isinstance(inst, stim.CircuitRepeatBlock):
+            total += inst.repeat_count * _dem_size_estimate(inst.body_copy())
+            continue
+        args = inst.gate_args_copy()
+        if not any(args):
+            continue
+        name = inst.name
+        if name in _CORRELATED_ERRORS:
+            total += 1
+            continue
+        if name in _ERRORS_PER_TARGET_GROUP:
+            per_group = _ERRORS_PER_TARGET_GROUP[name]
+        elif name in ['PAULI_CHANNEL_1', 'PAULI_CHANNEL_2']:
+            per_group = sum(1 for a in args if a)
+        elif name in _NOISY_MEASUREMENTS:
+            per_group = 1
+        else:
+            continue
+        targets = inst.targets_copy()
+        num_groups = len(targets)
+        if name == 'MPP':
+            num_groups -= 2 * sum(1 for t in targets if t.is_combiner)
+        elif name in _PAIR_GATES:
+            num_groups //= 2
+        total += per_group * num_groups
+    return total
+
+
+def circuit_stats(circuit: stim.Circuit) -> Dict[str, int]:
+    """Returns cheap-to-compute summary statistics of a circuit, for storing in a manifest.
+
+    The 'dem_size_estimate' entry counts the error mechanisms introduced by the circuit's noise
+    (e.g. 3 per DEPOLARIZE1 target, 1 per noisy measurement), with loops multiplied out. It's an
+    upper bound on the number of errors in the circuit's detector error model, which can be
+    smaller because stim merges equivalent errors and drops errors with no symptoms.
+    """
+    return {
+        'num_qubits': circuit.num_qubits,
+        'num_detectors': circuit.num_detectors,
+        'num_observables': circuit.num_observables,
+        'num_measurements': circuit.num_measurements,
+        'num_ticks': circuit.num_ticks,
+        'dem_size_estimate': _dem_size_estimate(circuit),
+    }
+
+
+class CircuitManifest:
+    """The `manifest.jsonl` file describing the circuits in an output directory.
+
+    Each line is a json object describing one written circuit file. Entries have the keys:
+
+        'path': The name of the circuit file, relative to the output directory.
+        'config': The configuration that produced the file (style, rounds, diameter, noise, ...).
+        'fingerprint': A hash of the configuration together with the source code of the
+            construction (see `construction_source_hash`) and the stim version. When any of
+            these change, the file is out of date.
+        'metadata': The typed key/value pairs encoded in the file name (what
+            `sinter collect --metadata_func auto` would give, e.g. {'r': 12, 'd': 3, 'p': 0.001,
+            'noise': 'uniform', 'c': 'bacon_shor', ...}).
+        'stats': Summary statistics of the circuit (see `circuit_stats`).
+
+    Use `select` to find circuits by their metadata without opening the circuit files.
+
+    New entries are appended as soon as their file is written, so an interrupted run still
+    records the files it finished. When an entry is recorded for a configuration that already
+    had an entry, the later one wins. `compact` rewrites the file with one line per configuration.
+    """
+
+    def __init__(self, out_dir: Union[str, pathlib.Path]):
+        self.out_dir = pathlib.Path(out_dir)
+        self.path = self.out_dir / MANIFEST_FILE_NAME
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._indices: Dict[str, Dict[Any, List[str]]] = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entry = json.loads(line)
+                        self._entries[self._config_key(entry['config'])] = entry
+
+    @staticmethod
+    def _config_key(config: Dict[str, Any]) -> str:
+        return json.dumps(config, sort_keys=True)
+
+    @property
+    def entries(self) -> List[Dict[str, Any]]:
+        return list(self._entries.values())
+
+    def entry_for(self, config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return self._entries.get(self._config_key(config))
+
+    def entry_for_path(self, path: Union[str, pathlib.Path]) -> Optional[Dict[str, Any]]:
+        name = pathlib.Path(path).name
+        for entry in self._entries.values():
+            if entry['path'] == name:
+                return entry
+        return None
+
+    def _index_for(self, key: str) -> Dict[Any, List[str]]:
+        index = self._indices.get(key)
+        if index is None:
+            index = {}
+            for config_key, entry in self._entries.items():
+                metadata = entry.get('metadata', {})
+                if key in metadata:
+                    index.setdefault(metadata[key], []).append(config_key)
+            self._indices[key] = index
+        return index
+
+    def select(
+            self,
+            predicate: Optional[Callable[[Dict[str, Any]], bool]] = None,
+            **metadata: Any,
+    ) -> List[Dict[str, Any]]:
+        """Returns the entries whose metadata matches the given constraints, sorted by path.
+
+        Args:
+            predicate: Called with each candidate entry's metadata dictionary. Entries for which it
+                returns False are excluded. This is the equivalent of sinter's `--filter_func`.
+            **metadata: Required metadata values. A list, tuple, or set value means any of its
+                items is allowed. Entries without the key are excluded. These lookups use an
+                index over the metadata key (built on first use), so they don't scan every entry.
+
+        Examples:
+            manifest.select(c='bacon_shor', d=[3, 5, 7])
+            manifest.select(lambda m: m['r'] == 4 * m['d'], noise='uniform')
+        """
+        candidates: Optional[set] = None
+        for key, value in metadata.items():
+            values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+            index = self._index_for(key)
+            matches = {config_key for v in values for config_key in index.get(v, ())}
+            candidates = matches if candidates is None else candidates & matches
+        if candidates is None:
+            candidates = self._entries.keys()
+        result = [self._entries[k] for k in candidates]
+        if predicate is not None:
+            result = [e for e in result if predicate(e.get('metadata', {}))]
+        return sorted(result, key=lambda e: e['path'])
+
+    def select_paths(
+            self,
+            predicate: Optional[Callable[[Dict[str, Any]], bool]] = None,
+            **metadata: Any,
+    ) -> List[pathlib.Path]:
+        """Like `select`, but returns the paths of the selected circuit files."""
+        return [self.out_dir / e['path'] for e in self.select(predicate, **metadata)]
+
+    def is_up_to_date(self, *, config: Dict[str, Any], fingerprint: str) -> bool:
+        """Determines if the configuration's file exists and was made from the same fingerprint."""
+        entry = self.entry_for(config)
+        return entry is not None and entry['fingerprint'] == fingerprint and (self.out_dir / entry['path']).exists()
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        """Appends an entry for a freshly written file.
+
+        If the configuration's previous file had a different name (e.g. because its qubit count
+        changed), the previous file is deleted so that it isn't mistaken for a current one. Each
+        deletion is printed.
+        """
+        key = self._config_key(entry['config'])
+        old = self._entries.get(key)
+        if old is not None and old['path'] != entry['path']:
+            old_path = self.out_dir / old['path']
+            try:
+                old_path.unlink()
+            except FileNotFoundError:
+                pass
+            else:
+                print(f'removed outdated file://{old_path.absolute()}')
+        self._entries[key] = entry
+        self._indices.clear()
+        with open(self.path, 'a') as f:
+            print(json.dumps(entry), file=f)
+
+    def compact(self) -> None:
+        """Atomically rewrites the manifest with one line per configuration, sorted by path."""
+        tmp_path = self.path.with_name(f'.{self.path.name}.{os.getpid()}.tmp')
+        try:
+            with open(tmp_path, 'w') as f:
+                for entry in sorted(self._entries.values(), key=lambda e: e['path']):
+                    print(json.dumps(entry), file=f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        return f'gen.CircuitManifest({str(self.out_dir)!r})'
@@ -0,0 +1,136 @@
+import json
+import pathlib
+
+import sinter
+import stim
+
+import gen
+from gen._circuit_manifest import local_modules_used_by
+
+
+def _construction():
+    pass
+
+
+def test_construction_source_hash():
+    modules = [m.__name__ for m in local_modules_used_by(_construction)]
+    assert 'gen._circuit_manifest_test' in modules
+    assert 'gen._circuit_manifest' in modules
+    assert 'gen._chunk' in modules
+    assert not any(m.startswith('stim') or m.startswith('numpy') or m == 'json' for m in modules)
+
+    h = gen.construction_source_hash(_construction)
+    assert h == gen.construction_source_hash(_construction)
+    assert h != gen.construction_source_hash(json.dumps)
+    assert gen.construction_source_hash(json.dumps) != gen.construction_source_hash(json.loads)
+
+
+def test_circuit_manifest(tmp_path: pathlib.Path, capsys):
+    manifest = gen.CircuitManifest(tmp_path)
+    assert len(manifest) == 0
+    config_a = {'style': 'a', 'diameter': 3}
+    config_b = {'style': 'b', 'diameter': 3}
+    (tmp_path / 'a_q=5.stim').write_text('')
+    (tmp_path / 'b.stim').write_text('')
+    manifest.record({'path': 'a_q=5.stim', 'config': config_a, 'fingerprint': '1'})
+    manifest.record({'path': 'b.stim', 'config': config_b, 'fingerprint': '2'})
+    assert manifest.is_up_to_date(config=config_a, fingerprint='1')
+    assert not manifest.is_up_to_date(config=config_a, fingerprint='2')
+    assert not manifest.is_up_to_date(config={'style': 'c'}, fingerprint='1')
+
+    # Re-recording a configuration under a new name removes its old file.
+    (tmp_path / 'a_q=6.stim').write_text('')
+    manifest.record({'path': 'a_q=6.stim', 'config': config_a, 'fingerprint': '3'})
+    assert not (tmp_path / 'a_q=5.stim').exists()
+    assert capsys.readouterr().out == f'removed outdated file://{(tmp_path / "a_q=5.stim").absolute()}\n'
+    assert len((tmp_path / 'manifest.jsonl').read_text().splitlines()) == 3
+
+    reloaded = gen.CircuitManifest(tmp_path)
+    assert len(reloaded) == 2
+    assert reloaded.entry_for(config_a)['path'] == 'a_q=6.stim'
+    assert reloaded.is_up_to_date(config=config_a, fingerprint='3')
+    (tmp_path / 'b.stim').unlink()
+    assert not reloaded.is_up_to_date(config=config_b, fingerprint='2')
+
+    reloaded.compact()
+    assert [json.loads(line)['path'] for line in (tmp_path / 'manifest.jsonl').read_text().splitlines()] == [
+        'a_q=6.stim',
+        'b.stim',
+    ]
+    assert sorted(e.name for e in tmp_path.iterdir()) == ['a_q=6.stim', 'manifest.jsonl']
+
+
+def test_circuit_stats():
+    circuit = stim.Circuit('''
+        QUBIT_COORDS(0, 0) 0
+        R 0 1 2
+        TICK
+        DEPOLARIZE1(0.1) 0 1
+        DEPOLARIZE2(0.1) 0 1
+        PAULI_CHANNEL_1(0.1, 0, 0.2) 2
+        REPEAT 3 {
+            X_ERROR(0.1) 0
+            TICK
+            M(0.01) 0
+            DETECTOR rec[-1]
+        }
+        E(0.1) X0 X1
+        MPP(0.01) X0*X1 Z2
+        M 0
+        OBSERVABLE_INCLUDE(0) rec[-1]
+    ''')
+    assert gen.circuit_stats(circuit) == {
+        'num_qubits': 3,
+        'num_detectors': 3,
+        'num_observables': 1,
+        'num_measurements': 6,
+        'num_ticks': 4,
+        'dem_size_estimate': 6 + 15 + 2 + 3 * 2 + 1 + 2,
+    }
+    assert gen.circuit_stats(stim.Circuit())['dem_size_estimate'] == 0
+
+
+def test_circuit_manifest_select(tmp_path: pathlib.Path):
+    manifest = gen.CircuitManifest(tmp_path)
+    for d in [3, 5, 7]:
+        for c in ['bacon_shor', 'fractal_bacon_shor']:
+            name = f'r={4*d},d={d},p=0.001,noise=uniform,c={c},q={d*d}.stim'
+            manifest.record({
+                'path': name,
+                'config': {'d': d, 'c': c},
+                'fingerprint': '',
+                'metadata': sinter.comma_separated_key_values(name),
+                'stats': {},
+            })
+    manifest.record({'path': 'old.stim', 'config': {}, 'fingerprint': ''})
+
+    def ds(entries):
+        return [(e['metadata']['c'], e['metadata']['d']) for e in entries]
+
+    assert len(manifest.select()) == 7
+    assert ds(manifest.select(c='bacon_shor')) == [('bacon_shor', 3), ('bacon_shor', 5), ('bacon_shor', 7)]
+    assert ds(manifest.select(d=[3, 7], p=0.001)) == [
+        ('bacon_shor', 3),
+        ('fractal_bacon_shor', 3),
+        ('bacon_shor', 7),
+        ('fractal_bacon_shor', 7),
+    ]
+    assert ds(manifest.select(lambda m: m['q'] > 9 and 'fractal' in m['c'], noise='uniform')) == [
+        ('fractal_bacon_shor', 5),
+        ('fractal_bacon_shor', 7),
+    ]
+    assert manifest.select(c='surface') == []
+    assert manifest.select(d=3, c='surface') == []
+    assert manifest.select_paths(c='bacon_shor', d=5) == [tmp_path / 'r=20,d=5,p=0.001,noise=uniform,c=bacon_shor,q=25.stim']
+    assert manifest.entry_for_path(tmp_path / 'old.stim')['config'] == {}
+
+    # Indices are rebuilt after new entries are recorded, and survive reloading.
+    manifest.record({
+        'path': 'r=36,d=9,p=0.001,noise=uniform,c=bacon_shor,q=81.stim',
+        'config': {'d': 9, 'c': 'bacon_shor'},
+        'fingerprint': '',
+        'metadata': sinter.comma_separated_key_values('r=36,d=9,p=0.001,noise=uniform,c=bacon_shor,q=81.stim'),
+        'stats': {},
+    })
+    assert len(manifest.select(c='bacon_shor')) == 4
+    assert len(gen.CircuitManifest(tmp_path).select(c='bacon_shor')) == 4
@@ -0,0 +1,125 @@
+import gzip
+import io
+import os
+import pathlib
+from typing import Optional, Union, TextIO
+
+import stim
+
+COMPRESSIONS = ('gzip', 'zstd')
+
+
+def _compression_for_path(path: pathlib.Path) -> Optional[str]:
+    if path.suffix == '.gz':
+        return 'gzip'
+    if path.suffix == '.zst':
+        return 'zstd'
+    return None
+
+
+def _open_compressed_text_writer(raw: io.BufferedWriter, compression: Optional[str]) -> TextIO:
+    if compression is None:
+        binary = raw
+    elif compression == 'gzip':
+        # No file name or timestamp in the header, so the same circuit always gives the same bytes.
+        binary = gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0)
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError as ex:
+            raise ImportError("Writing zstd compressed circuits requires the `zstandard` package.") from ex
+        binary = zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+    else:
+        raise NotImplementedError(f'{compression=}')
+    return io.TextIOWrapper(binary, encoding='utf8', newline='\n', write_through=False)
+
+
+def _write_circuit_text(
+        circuit: stim.Circuit,
+        *,
+        out: TextIO,
+        indent: str,
+        max_batch_size: int,
+) -> None:
+    """Writes the same text as `str(circuit) + '\\n'` (with the given indentation), a piece at a time.
+
+    Runs of instructions are converted to text in batches of at most `max_batch_size`
+    instructions. Repeat blocks are written recursively, so that a large loop body is never
+    converted to text all at once.
+    """
+    if len(circuit) == 0:
+        out.write('\n')
+        return
+
+    def flush(start: int, stop: int):
+        if start < stop:
+            text = str(circuit[start:stop])
+            if indent:
+                text = indent + text.replace('\n', '\n' + indent)
+            out.write(text)
+            out.write('\n')
+
+    start = 0
+    for k, inst in enumerate(circuit):
+        if isinstance(inst, stim.CircuitRepeatBlock):
+            flush(start, k)
+            start = k + 1
+            out.write(f'{indent}REPEAT {inst.repeat_count} {{\n')
+            _write_circuit_text(
+                inst.body_copy(),
+                out=out,
+                indent=indent + '    ',
+                max_batch_size=max_batch_size,
+            )
+            out.write(f'{indent}}}\n')
+        elif k + 1 - start >= max_batch_size:
+            flush(start, k + 1)
+            start = k + 1
+    flush(start, len(circuit))
+
+
+def write_circuit_file(
+        path: Union[str, pathlib.Path],
+        circuit: stim.Circuit,
+        *,
+        compression: Optional[str] = 'auto',
+        max_batch_size: int = 1024,
+) -> pathlib.Path:
+    """Writes a circuit to a file without ever holding the entire circuit's text in memory.
+
+    The written text is identical to `print(circuit, file=f)`, but it's produced a batch of
+    instructions at a time (and a loop body at a time), so peak memory is bounded by the size of
+    a batch instead of by the size of the whole circuit.
+
+    The file is written atomically: the text goes into a temporary file in the same directory,
+    which is renamed to the destination once complete. An interrupted write doesn't leave a
+    partial file at the destination.
+
+    Args:
+        path: Where to write the circuit.
+        circuit: The circuit to write.
+        compression: 'gzip', 'zstd' (requires the `zstandard` package), None for uncompressed
+            text, or 'auto' to pick based on the path's suffix ('.gz' or '.zst').
+        max_batch_size: The maximum number of instructions converted to text at once.
+
+    Returns:
+        The path that was written.
+    """
+    path = pathlib.Path(path)
+    if compression == 'auto':
+        compression = _compression_for_path(path)
+    if compression is not None and compression not in COMPRESSIONS:
+        raise NotImplementedError(f'{compression=}')
+    if max_batch_size < 1:
+        raise ValueError(f'{max_batch_size=} < 1')
+
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as raw:
+            with _open_compressed_text_writer(raw, compression) as out:
+                _write_circuit_text(circuit, out=out, indent='', max_batch_size=max_batch_size)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return path
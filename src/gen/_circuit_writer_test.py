@@ -0,0 +1,86 @@
+import gzip
+import pathlib
+
+import pytest
+import stim
+
+import gen
+from gen._circuit_writer import _compression_for_path
+
+
+_CIRCUIT = stim.Circuit("""
+    QUBIT_COORDS(0, 1) 0
+    R 0 1 2
+    TICK
+    REPEAT 3 {
+        CX 0 1
+        TICK
+        REPEAT 2 {
+            H 0
+            TICK
+            M(0.125) 1
+            DETECTOR(1, 2, 3) rec[-1]
+        }
+        SHIFT_COORDS(0, 0, 1)
+    }
+    MPP X0*Y1*!Z2
+    OBSERVABLE_INCLUDE(0) rec[-1]
+""")
+
+
+@pytest.mark.parametrize('max_batch_size', [1, 2, 3, 1024])
+def test_write_circuit_file_matches_print(tmp_path: pathlib.Path, max_batch_size: int):
+    for circuit in [_CIRCUIT, stim.Circuit(), stim.Circuit('H 0'), _CIRCUIT * 3]:
+        path = tmp_path / 'circuit.stim'
+        gen.write_circuit_file(path, circuit, max_batch_size=max_batch_size)
+        with open(tmp_path / 'expected.stim', 'w') as f:
+            print(circuit, file=f)
+        assert path.read_text() == (tmp_path / 'expected.stim').read_text()
+        assert stim.Circuit.from_file(path) == circuit
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['circuit.stim', 'expected.stim']
+
+
+def test_write_circuit_file_gzip(tmp_path: pathlib.Path):
+    path = gen.write_circuit_file(tmp_path / 'circuit.stim.gz', _CIRCUIT)
+    assert gzip.decompress(path.read_bytes()).decode('utf8') == str(_CIRCUIT) + '\n'
+
+    # Same bytes every time.
+    other = gen.write_circuit_file(tmp_path / 'other.stim.gz', _CIRCUIT)
+    assert other.read_bytes() == path.read_bytes()
+
+    forced = gen.write_circuit_file(tmp_path / 'forced.stim', _CIRCUIT, compression='gzip')
+    assert forced.read_bytes() == path.read_bytes()
+
+
+def test_write_circuit_file_zstd(tmp_path: pathlib.Path):
+    zstandard = pytest.importorskip('zstandard')
+    path = gen.write_circuit_file(tmp_path / 'circuit.stim.zst', _CIRCUIT)
+    text = zstandard.ZstdDecompressor().stream_reader(path.read_bytes()).read().decode('utf8')
+    assert text == str(_CIRCUIT) + '\n'
+
+
+def test_write_circuit_file_failure_leaves_no_partial_file(tmp_path: pathlib.Path):
+    path = tmp_path / 'circuit.stim'
+    path.write_text('old contents')
+    with pytest.raises(NotImplementedError):
+        gen.write_circuit_file(path, _CIRCUIT, compression='brotli')
+    with pytest.raises(ValueError):
+        gen.write_circuit_file(path, _CIRCUIT, max_batch_size=0)
+
+    class Interrupted(Exception):
+        pass
+
+    class ExplodingCircuit(stim.Circuit):
+        def __getitem__(self, item):
+            raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        gen.write_circuit_file(path, ExplodingCircuit(str(_CIRCUIT)))
+    assert path.read_text() == 'old contents'
+    assert [p.name for p in tmp_path.iterdir()] == ['circuit.stim']
+
+
+def test_compression_for_path():
+    assert _compression_for_path(pathlib.Path('a/b.stim')) is None
+    assert _compression_for_path(pathlib.Path('a/b.stim.gz')) == 'gzip'
+    assert _compression_for_path(pathlib.Path('a/b.stim.zst')) == 'zstd'
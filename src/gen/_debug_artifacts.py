@@ -0,0 +1,90 @@
+import concurrent.futures
+import multiprocessing
+import os
+import pathlib
+from typing import Any, Callable, List, Optional, Union
+
+import stim
+
+from gen._util import write_file
+
+_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pending: List[concurrent.futures.Future] = []
+
+
+def detector_slice_svg(circuit: stim.Circuit) -> Any:
+    return circuit.diagram("time+detector-slice-svg")
+
+
+def _render_and_write(path: pathlib.Path, render: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+    write_file(path, render(*args, **kwargs))
+
+
+def _num_background_workers() -> int:
+    """Leaves one cpu for generating circuits, and uses up to 4 others for rendering."""
+    if multiprocessing.parent_process() is not None:
+        # Already in a worker process (e.g. of `_generate_circuits(workers=...)`), whose siblings
+        # are using the other cpus. Also, a worker process can't exit while it has live children.
+        return 0
+    try:
+        num_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        num_cpus = os.cpu_count() or 1
+    return min(4, num_cpus - 1)
+
+
+def _get_pool() -> Optional[concurrent.futures.ProcessPoolExecutor]:
+    global _pool, _pool_pid, _pending
+    if _pool is None or _pool_pid != os.getpid():
+        # A pool inherited from a parent process (e.g. by a forked generation worker) isn't usable.
+        num_workers = _num_background_workers()
+        if num_workers < 1:
+            return None
+        _pool = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers)
+        _pool_pid = os.getpid()
+        _pending = []
+    return _pool
+
+
+def write_debug_artifact(
+        path: Union[str, pathlib.Path],
+        render: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any,
+) -> None:
+    """Writes `render(*args, **kwargs)` to the given path, in a background worker process.
+
+    Rendering debug artifacts (html viewers, svg diagrams) of large circuits can take longer than
+    generating the circuit. Doing it in the background lets circuit generation continue in the
+    meantime. `render` and its arguments must be picklable (e.g. a module-level function given
+    stim circuits and patches). Call `flush_debug_artifacts` to wait for the files to be written.
+
+    When there's no spare cpu to render on, the artifact is rendered and written immediately.
+    """
+    pool = _get_pool()
+    if pool is None:
+        _render_and_write(pathlib.Path(path), render, args, kwargs)
+    else:
+        _pending.append(pool.submit(_render_and_write, pathlib.Path(path), render, args, kwargs))
+
+
+def flush_debug_artifacts() -> None:
+    """Waits for all artifacts given to `write_debug_artifact` to be written.
+
+    Raises:
+        Exception: The first error raised while rendering or writing an artifact.
+    """
+    global _pending
+    if _pool_pid != os.getpid():
+        return
+    pending, _pending = _pending, []
+    error = None
+    for future in pending:
+        try:
+            future.result()
+        except Exception as ex:
+            if error is None:
+                error = ex
+    if error is not None:
+        raise error
@@ -0,0 +1,35 @@
+import pathlib
+
+import pytest
+import stim
+
+import gen._debug_artifacts
+from gen._debug_artifacts import write_debug_artifact, flush_debug_artifacts, detector_slice_svg
+
+
+def _fail(message: str):
+    raise ValueError(message)
+
+
+def test_write_debug_artifact(tmp_path: pathlib.Path, num_background_workers: int):
+    circuit = stim.Circuit('H 0\nCX 0 1\nM 0 1\nDETECTOR rec[-1] rec[-2]')
+    write_debug_artifact(tmp_path / 'a.svg', detector_slice_svg, circuit)
+    write_debug_artifact(tmp_path / 'b.txt', str, 'contents')
+    flush_debug_artifacts()
+    assert (tmp_path / 'a.svg').read_text() == str(circuit.diagram("time+detector-slice-svg")) + '\n'
+    assert (tmp_path / 'b.txt').read_text() == 'contents\n'
+    assert (gen._debug_artifacts._pool is not None) == (num_background_workers > 0)
+
+
+def test_flush_debug_artifacts_reports_failures(tmp_path: pathlib.Path, num_background_workers: int):
+    if num_background_workers == 0:
+        with pytest.raises(ValueError, match='first'):
+            write_debug_artifact(tmp_path / 'a.txt', _fail, 'first')
+        return
+    write_debug_artifact(tmp_path / 'a.txt', _fail, 'first')
+    write_debug_artifact(tmp_path / 'b.txt', str, 'fine')
+    write_debug_artifact(tmp_path / 'c.txt', _fail, 'second')
+    with pytest.raises(ValueError, match='first'):
+        flush_debug_artifacts()
+    assert (tmp_path / 'b.txt').exists()
+    flush_debug_artifacts()
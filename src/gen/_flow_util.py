@@ -1,3 +1,4 @@
+import hashlib
 from typing import Union, List, Tuple, Any, Dict, Literal, Iterable
 
 import stim
@@ -124,11 +125,97 @@ def _append_circuit_with_reindexed_qubits_to_circuit(
             raise NotImplementedError(f'{inst=}')
 
 
+class _ReindexCache:
+    """Memoizes chunk circuits rewritten to use the qubit indices of the circuit being compiled.
+
+    The same chunk often appears many times (e.g. in each compiled iteration of a loop), and
+    rewriting its circuit target by target is expensive. Entries are keyed by chunk identity,
+    and keep the chunk alive so that its id can't be reused by another chunk.
+    """
+
+    def __init__(self, q2i: Dict[complex, int]):
+        self.q2i = q2i
+        self._cache: Dict[int, Tuple[Chunk, stim.Circuit]] = {}
+
+    def reindexed_chunk_circuit(self, chunk: Chunk) -> stim.Circuit:
+        cached = self._cache.get(id(chunk))
+        if cached is not None and cached[0] is chunk:
+            return cached[1]
+        result = stim.Circuit()
+        if all(self.q2i[q] == i for q, i in chunk.q2i.items()):
+            _append_circuit_without_qubit_coords_to_circuit(circuit=chunk.circuit, out=result)
+        else:
+            _append_circuit_with_reindexed_qubits_to_circuit(
+                circuit=chunk.circuit,
+                old_q2i=chunk.q2i,
+                new_q2i=self.q2i,
+                out=result,
+            )
+        self._cache[id(chunk)] = (chunk, result)
+        return result
+
+
+def _append_circuit_without_qubit_coords_to_circuit(
+        *,
+        circuit: stim.Circuit,
+        out: stim.Circuit,
+) -> None:
+    for inst in circuit:
+        if isinstance(inst, stim.CircuitRepeatBlock):
+            block = stim.Circuit()
+            _append_circuit_without_qubit_coords_to_circuit(circuit=inst.body_copy(), out=block)
+            out.append(stim.CircuitRepeatBlock(repeat_count=inst.repeat_count, body=block))
+        elif inst.name != 'QUBIT_COORDS':
+            out.append(inst)
+
+
 class _ChunkCompileState:
     def __init__(self, *, open_flows: Dict[Tuple[PauliString, Any], Union[Flow, Literal["discard"]]], measure_offset: int):
         self.open_flows = open_flows
         self.measure_offset = measure_offset
 
+    def fingerprint(self) -> Any:
+        """Returns a hashable summary of the state, relative to the current measurement offset.
+
+        Compiling the same chunk from two states with equal fingerprints produces the same
+        circuit, and resulting states that also have equal fingerprints.
+        """
+        return frozenset(
+            (key, flow if flow == 'discard' else (
+                flow.start,
+                flow.end,
+                tuple(m - self.measure_offset for m in flow.measurement_indices),
+                flow.obs_index,
+                flow.additional_coords,
+                flow.center,
+                flow.postselect,
+            ))
+            for key, flow in self.open_flows.items()
+        )
+
+    def shifted(self, measurement_shift: int) -> '_ChunkCompileState':
+        """Returns the equivalent state after the given number of additional measurements."""
+        return _ChunkCompileState(
+            open_flows={
+                key: flow if flow == 'discard' else Flow(
+                    start=flow.start,
+                    end=flow.end,
+                    measurement_indices=[m + measurement_shift for m in flow.measurement_indices],
+                    obs_index=flow.obs_index,
+                    additional_coords=flow.additional_coords,
+                    center=flow.center,
+                    postselect=flow.postselect,
+                    allow_vacuous=True,
+                )
+                for key, flow in self.open_flows.items()
+            },
+            measure_offset=self.measure_offset + measurement_shift,
+        )
+
+
+def _circuit_hash(circuit: stim.Circuit) -> bytes:
+    return hashlib.sha256(str(circuit).encode()).digest()
+
 
 def _compile_chunk_into_circuit_many_repetitions(
         *,
@@ -138,6 +225,7 @@ def _compile_chunk_into_circuit_many_repetitions(
         ignore_errors: bool,
         out_circuit: stim.Circuit,
         q2i: Dict[complex, int],
+        reindex_cache: '_ReindexCache',
 ) -> _ChunkCompileState:
     if chunk_loop.repetitions == 0:
         return state
@@ -149,20 +237,18 @@ def _compile_chunk_into_circuit_many_repetitions(
             ignore_errors=ignore_errors,
             out_circuit=out_circuit,
             q2i=q2i,
+            reindex_cache=reindex_cache,
         )
     assert chunk_loop.repetitions > 1
 
+    # Compile iterations until the compile state (relative to the measurement offset) repeats.
+    # From then on the iterations are periodic, so the rest of the loop doesn't need compiling.
     no_reps_loop = chunk_loop.with_repetitions(1)
     circuits = []
-    measure_offset_start_of_loop = state.measure_offset
+    states = [state]
+    seen_fingerprints = {state.fingerprint(): 0}
+    cycle_start = None
     while len(circuits) < chunk_loop.repetitions:
-        fully_in_loop = len(circuits) > 0 and min([
-            m
-            for flow in state.open_flows.values()
-            if isinstance(flow, Flow)
-            for m in flow.measurement_indices
-        ], default=measure_offset_start_of_loop) >= measure_offset_start_of_loop
-
         circuits.append(stim.Circuit())
         state = _compile_chunk_into_circuit(
             chunk=no_reps_loop,
@@ -171,25 +257,37 @@ def _compile_chunk_into_circuit_many_repetitions(
             ignore_errors=ignore_errors,
             out_circuit=circuits[-1],
             q2i=q2i,
+            reindex_cache=reindex_cache,
         )
-
-        if fully_in_loop:
-            # The circuit is guaranteed to repeat now. Don't do each iteration individually.
-            finish_reps = chunk_loop.repetitions - len(circuits) + 1
-            while len(circuits) > 1 and circuits[-1] == circuits[-2]:
-                finish_reps += 1
-                circuits.pop()
-            circuits[-1] *= finish_reps
+        states.append(state)
+        fingerprint = state.fingerprint()
+        if fingerprint in seen_fingerprints:
+            cycle_start = seen_fingerprints[fingerprint]
             break
+        seen_fingerprints[fingerprint] = len(circuits)
+
+    # Describe the loop as runs of (circuit, repetitions).
+    runs = [(circuit, 1) for circuit in circuits]
+    if cycle_start is not None:
+        period = len(circuits) - cycle_start
+        num_cycles, remainder = divmod(chunk_loop.repetitions - cycle_start, period)
+        cycle = stim.Circuit()
+        for circuit in circuits[cycle_start:]:
+            cycle += circuit
+        runs = runs[:cycle_start] + [(cycle, num_cycles)] + runs[cycle_start:cycle_start + remainder]
+        cycle_measurements = states[-1].measure_offset - states[cycle_start].measure_offset
+        state = states[cycle_start + remainder].shifted(cycle_measurements * num_cycles)
 
     # Fuse iterations that happened to be equal.
-    k = 0
-    while k < len(circuits):
-        k2 = k + 1
-        while k2 < len(circuits) and circuits[k2] == circuits[k]:
-            k2 += 1
-        out_circuit += circuits[k] * (k2 - k)
-        k = k2
+    fused_runs = []
+    for circuit, reps in runs:
+        h = _circuit_hash(circuit)
+        if fused_runs and fused_runs[-1][1] == h:
+            fused_runs[-1][2] += reps
+        else:
+            fused_runs.append([circuit, h, reps])
+    for circuit, _, reps in fused_runs:
+        out_circuit += circuit * reps
 
     return state
 
@@ -202,6 +300,7 @@ def _compile_chunk_into_circuit_sequence(
         ignore_errors: bool,
         out_circuit: stim.Circuit,
         q2i: Dict[complex, int],
+        reindex_cache: '_ReindexCache',
 ) -> _ChunkCompileState:
     for sub_chunk in chunks:
         state = _compile_chunk_into_circuit(
@@ -211,6 +310,7 @@ def _compile_chunk_into_circuit_sequence(
             ignore_errors=ignore_errors,
             out_circuit=out_circuit,
             q2i=q2i,
+            reindex_cache=reindex_cache,
         )
     return state
 
@@ -223,6 +323,7 @@ def _compile_chunk_into_circuit_atomic(
         ignore_errors: bool,
         out_circuit: stim.Circuit,
         q2i: Dict[complex, int],
+        reindex_cache: '_ReindexCache',
 ) -> _ChunkCompileState:
     prev_flows = dict(state.open_flows)
     next_flows: Dict[Tuple[PauliString, Any], Union[Flow, Literal['discard']]] = {}
@@ -267,7 +368,7 @@ def _compile_chunk_into_circuit_atomic(
                 raise ValueError(f"Some flows were left over (not matched) when moving into chunk: {list(prev_flows.values())!r}")
 
     new_measure_offset = state.measure_offset + chunk.circuit.num_measurements
-    _append_circuit_with_reindexed_qubits_to_circuit(circuit=chunk.circuit, out=out_circuit, old_q2i=chunk.q2i, new_q2i=q2i)
+    out_circuit += reindex_cache.reindexed_chunk_circuit(chunk)
     if include_detectors:
         any_detectors = False
         for flow in dumped_flows:
@@ -303,6 +404,7 @@ def _compile_chunk_into_circuit(
     ignore_errors: bool,
     out_circuit: stim.Circuit,
     q2i: Dict[complex, int],
+    reindex_cache: '_ReindexCache',
 ) -> _ChunkCompileState:
     if isinstance(chunk, ChunkLoop):
         return _compile_chunk_into_circuit_many_repetitions(
@@ -312,6 +414,7 @@ def _compile_chunk_into_circuit(
             ignore_errors=ignore_errors,
             out_circuit=out_circuit,
             q2i=q2i,
+            reindex_cache=reindex_cache,
         )
 
     return _compile_chunk_into_circuit_atomic(
@@ -321,6 +424,7 @@ def _compile_chunk_into_circuit(
         ignore_errors=ignore_errors,
         out_circuit=out_circuit,
         q2i=q2i,
+        reindex_cache=reindex_cache,
     )
 
 
@@ -350,6 +454,7 @@ def compile_chunks_into_circuit(
         full_circuit.append('QUBIT_COORDS', i, [q.real, q.imag])
 
     state = _ChunkCompileState(open_flows={}, measure_offset=0)
+    reindex_cache = _ReindexCache(q2i)
     for k, chunk in enumerate(chunks):
         state = _compile_chunk_into_circuit(
             chunk=chunk,
@@ -358,6 +463,7 @@ def compile_chunks_into_circuit(
             ignore_errors=ignore_errors,
             out_circuit=full_circuit,
             q2i=q2i,
+            reindex_cache=reindex_cache,
         )
     if include_detectors:
         if state.open_flows:
@@ -1,6 +1,7 @@
 import stim
 
 import gen
+from gen._flow_util import _ReindexCache
 
 
 def test_magic_init_for_chunk():
@@ -143,3 +144,69 @@ def test_compile_postselected_chunks():
         DETECTOR(0, 0, 1) rec[-2] rec[-1]
         TICK
     """)
+
+
+def test_compile_chunk_loop_matches_unrolled():
+    init = gen.Chunk(
+        circuit=stim.Circuit("R 0"),
+        q2i={0: 0},
+        flows=[gen.Flow(center=0, end=gen.PauliString({0: 'Z'}))],
+    )
+    bulk = gen.Chunk(
+        circuit=stim.Circuit("M 0"),
+        q2i={0: 0},
+        flows=[
+            gen.Flow(center=0, start=gen.PauliString({0: 'Z'}), measurement_indices=[0]),
+            gen.Flow(center=0, end=gen.PauliString({0: 'Z'}), measurement_indices=[0]),
+        ],
+    )
+    end = gen.Chunk(
+        circuit=stim.Circuit("M 0"),
+        q2i={0: 0},
+        flows=[gen.Flow(center=0, start=gen.PauliString({0: 'Z'}), measurement_indices=[0])],
+    )
+
+    for loop, reps in [
+        (gen.ChunkLoop([bulk], 2), 2),
+        (gen.ChunkLoop([bulk], 7), 7),
+        (gen.ChunkLoop([gen.ChunkLoop([bulk], 2), bulk], 3), 9),
+    ]:
+        folded = gen.compile_chunks_into_circuit([init, loop, end])
+        unrolled = gen.compile_chunks_into_circuit([init] + [bulk] * reps + [end])
+        assert folded.flattened() == unrolled.flattened()
+        if reps > 2:
+            assert len(folded) < len(unrolled)
+
+
+def test_reindex_cache():
+    chunk = gen.Chunk(
+        circuit=stim.Circuit("""
+            QUBIT_COORDS(1, 0) 0
+            H 0
+            REPEAT 2 {
+                CX 0 1
+            }
+            MPP X0*Z1
+        """),
+        q2i={1: 0, 2: 1},
+        flows=[],
+    )
+    shifted_cache = _ReindexCache({0: 0, 1: 1, 2: 2})
+    shifted = shifted_cache.reindexed_chunk_circuit(chunk)
+    assert shifted == stim.Circuit("""
+        H 1
+        REPEAT 2 {
+            CX 1 2
+        }
+        MPP X1*Z2
+    """)
+    assert shifted_cache.reindexed_chunk_circuit(chunk) is shifted
+
+    same_cache = _ReindexCache({1: 0, 2: 1})
+    assert same_cache.reindexed_chunk_circuit(chunk) == stim.Circuit("""
+        H 0
+        REPEAT 2 {
+            CX 0 1
+        }
+        MPP X0*Z1
+    """)
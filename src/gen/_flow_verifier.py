@@ -56,7 +56,83 @@ REV_DICT = {
 }
 
 
+def _swap(x1, z1, x2, z2):
+    return x2, z2, x1, z1
+
+
+def _cz(x1, z1, x2, z2):
+    return x1, z1 ^ x2, x2, z2 ^ x1
+
+
+def _xcx(x1, z1, x2, z2):
+    return x1 ^ z2, z1, x2 ^ z1, z2
+
+
+def _s_s(x1, z1, x2, z2):
+    return x1, z1 ^ x1, x2, z2 ^ x2
+
+
+def _sqrt_x_sqrt_x(x1, z1, x2, z2):
+    return x1 ^ z1, z1, x2 ^ z2, z2
+
+
+def _cy(x1, z1, x2, z2):
+    return x1, z1 ^ x2 ^ z2, x2 ^ x1, z2 ^ x1
+
+
+def _xcy(x1, z1, x2, z2):
+    return x1 ^ x2 ^ z2, z1, x2 ^ z1, z2 ^ z1
+
+
+# How each gate acts on the X and Z bit rows of its target(s), when propagating flows backwards.
+REV_ONE_QUBIT_ACTIONS = {
+    'H': lambda x, z: (z, x),
+    'SQRT_Y': lambda x, z: (z, x),
+    'SQRT_Y_DAG': lambda x, z: (z, x),
+    'I': lambda x, z: (x, z),
+    'X': lambda x, z: (x, z),
+    'Y': lambda x, z: (x, z),
+    'Z': lambda x, z: (x, z),
+    'S': lambda x, z: (x, z ^ x),
+    'S_DAG': lambda x, z: (x, z ^ x),
+    'H_XY': lambda x, z: (x, z ^ x),
+    'SQRT_X': lambda x, z: (x ^ z, z),
+    'SQRT_X_DAG': lambda x, z: (x ^ z, z),
+    'H_YZ': lambda x, z: (x ^ z, z),
+    'C_XYZ': lambda x, z: (z, z ^ x),
+    'C_ZYX': lambda x, z: (x ^ z, x),
+}
+REV_TWO_QUBIT_ACTIONS = {
+    'XCZ': lambda x1, z1, x2, z2: (x1 ^ x2, z1, x2, z2 ^ z1),
+    'CX': lambda x1, z1, x2, z2: (x1, z1 ^ z2, x2 ^ x1, z2),
+    'CZ': _cz,
+    'CY': _cy,
+    'YCZ': lambda x1, z1, x2, z2: _cy(x2, z2, x1, z1)[2:] + _cy(x2, z2, x1, z1)[:2],
+    'ISWAP': lambda *v: _s_s(*_cz(*_swap(*v))),
+    'ISWAP_DAG': lambda *v: _s_s(*_cz(*_swap(*v))),
+    'SQRT_ZZ': lambda *v: _s_s(*_cz(*v)),
+    'SQRT_ZZ_DAG': lambda *v: _s_s(*_cz(*v)),
+    'XCX': _xcx,
+    'YCY': lambda *v: _s_s(*_xcx(*_s_s(*v))),
+    'SQRT_YY': lambda *v: _s_s(*_sqrt_x_sqrt_x(*_xcx(*_s_s(*v)))),
+    'SQRT_YY_DAG': lambda *v: _s_s(*_sqrt_x_sqrt_x(*_xcx(*_s_s(*v)))),
+    'SQRT_XX': lambda *v: _sqrt_x_sqrt_x(*_xcx(*v)),
+    'SQRT_XX_DAG': lambda *v: _sqrt_x_sqrt_x(*_xcx(*v)),
+    'SWAP': _swap,
+    'XCY': _xcy,
+    'YCX': lambda x1, z1, x2, z2: _xcy(x2, z2, x1, z1)[2:] + _xcy(x2, z2, x1, z1)[:2],
+}
+
+
 class FlowStabilizerVerifier:
+    """Propagates flows backwards through a chunk's circuit, to check that they're satisfied.
+
+    The Pauli terms of the flows are stored as bit-packed matrices: `xs[q, w]` and `zs[q, w]`
+    are uint64 words whose bit `b` is the X (or Z) component on qubit `q` of flow `64*w + b`.
+    Gates are applied to all their targets at once (unless targets repeat within an
+    instruction), with each gate updating whole rows of words.
+    """
+
     def __init__(self, next_measurement: int, q2i: Dict[complex, int], flows: Iterable[Flow]):
         self.flows: Tuple[Flow, ...] = tuple(flows)
         self.q2i = q2i
@@ -65,30 +141,50 @@ class FlowStabilizerVerifier:
         self.reset_index = 0
         self.next_measurement = next_measurement
         self.reset_to_flow_indices: DefaultDict[int, List[int]] = collections.defaultdict(list)
+        self.num_feedback_operations = 0
         num_qubits = max(q2i.values()) + 1
-        self.xs = np.zeros(shape=(num_qubits, len(self.flows)), dtype=np.bool_)
-        self.zs = np.zeros(shape=(num_qubits, len(self.flows)), dtype=np.bool_)
+        num_words = (len(self.flows) + 63) // 64
+        self.xs = np.zeros(shape=(num_qubits, num_words), dtype=np.uint64)
+        self.zs = np.zeros(shape=(num_qubits, num_words), dtype=np.uint64)
         for k in range(len(self.flows)):
             flow: Flow = self.flows[k]
             for m in flow.measurement_indices:
                 self.i2m[m].append(k)
-            for q, p in flow.end.qubits.items():
-                assert p == 'X' or p == 'Y' or p == 'Z'
-                self.xs[q2i[q], k] = p == 'X' or p == 'Y'
-                self.zs[q2i[q], k] = p == 'Z' or p == 'Y'
+            self._xor_pauli_string_into_flow(k, flow.end.qubits)
+
+    def _xor_pauli_string_into_flow(self, k: int, qubits: Dict[complex, str]):
+        w, bit = divmod(k, 64)
+        bit = np.uint64(1 << bit)
+        for q, p in qubits.items():
+            assert p == 'X' or p == 'Y' or p == 'Z'
+            if p == 'X' or p == 'Y':
+                self.xs[self.q2i[q], w] ^= bit
+            if p == 'Z' or p == 'Y':
+                self.zs[self.q2i[q], w] ^= bit
+
+    def flow_mask(self, flow_indices: Iterable[int]) -> np.ndarray:
+        """Returns a row of words with the bits of the given flows toggled."""
+        mask = np.zeros(shape=self.xs.shape[1], dtype=np.uint64)
+        for k in flow_indices:
+            mask[k >> 6] ^= np.uint64(1 << (k & 63))
+        return mask
+
+    def flow_indices(self, words: np.ndarray) -> List[int]:
+        """Returns the indices of the flows whose bits are set in the given row of words."""
+        bits = np.unpackbits(words.astype('<u8').view(np.uint8), bitorder='little')
+        return [k for k in np.flatnonzero(bits).tolist() if k < len(self.flows)]
 
     def fail_if(self, mask: np.ndarray, msg: str):
         if np.any(mask):
-            for k in range(len(mask)):
-                if mask[k]:
-                    self.fail(k, msg)
+            self.fail(self.flow_indices(mask)[0], msg)
 
     def pauli_terms(self, k: int) -> str:
         i2q = {i: q for q, i in self.q2i.items()}
+        w, bit = divmod(k, 64)
         terms = []
         for q in range(self.xs.shape[0]):
-            x = self.xs[q, k]
-            z = self.zs[q, k]
+            x = int(self.xs[q, w] >> np.uint64(bit)) & 1
+            z = int(self.zs[q, w] >> np.uint64(bit)) & 1
             if x or z:
                 terms.append('_XZY'[x + z*2] + repr(i2q[q]))
         return '*'.join(terms)
@@ -98,14 +194,9 @@ class FlowStabilizerVerifier:
 
     def finish(self):
         for k in range(len(self.flows)):
-            for q, p in self.flows[k].start.qubits.items():
-                assert p == 'X' or p == 'Y' or p == 'Z'
-                self.xs[self.q2i[q], k] ^= p == 'X' or p == 'Y'
-                self.zs[self.q2i[q], k] ^= p == 'Z' or p == 'Y'
+            self._xor_pauli_string_into_flow(k, self.flows[k].start.qubits)
         if np.any(self.xs) or np.any(self.zs):
-            for k in range(len(self.flows)):
-                if np.any(self.xs[:, k]) or np.any(self.zs[:, k]):
-                    self.fail(k, "Mismatch at start")
+            self.fail_if(np.bitwise_or.reduce(self.xs | self.zs, axis=0), "Mismatch at start")
 
     @staticmethod
     def verify(chunk: 'Chunk') -> 'FlowStabilizerVerifier':
@@ -114,11 +205,87 @@ class FlowStabilizerVerifier:
             flows=chunk.flows,
             next_measurement=chunk.circuit.num_measurements - 1,
         )
-        for inst in chunk.circuit.flattened()[::-1]:
-            verifier.rev_apply(inst)
+        verifier.rev_apply_circuit(chunk.circuit)
         verifier.finish()
         return verifier
 
+    def rev_apply_circuit(self, circuit: stim.Circuit):
+        """Applies the instructions of a circuit in reverse order, without flattening it.
+
+        Iterations of a REPEAT block are applied one at a time until an iteration leaves the flow
+        state unchanged. Later iterations would also leave the state unchanged, up to the next
+        iteration containing a measurement that is part of a flow. So those iterations are
+        skipped, with their bookkeeping (measurement/reset indices, destructive measurements,
+        reset flows) replayed from the last applied iteration.
+        """
+        for inst in circuit[::-1]:
+            if isinstance(inst, stim.CircuitRepeatBlock):
+                self._rev_apply_repeat_block(inst)
+            else:
+                self.rev_apply(inst)
+
+    def _rev_apply_repeat_block(self, block: stim.CircuitRepeatBlock):
+        body = block.body_copy()
+        remaining = block.repeat_count
+        while remaining > 0:
+            prev_xs = self.xs.copy()
+            prev_zs = self.zs.copy()
+            prev_next_measurement = self.next_measurement
+            prev_reset_index = self.reset_index
+            prev_num_feedback_operations = self.num_feedback_operations
+
+            self.rev_apply_circuit(body)
+            remaining -= 1
+
+            if (remaining == 0
+                    or self.num_feedback_operations != prev_num_feedback_operations
+                    or not np.array_equal(prev_xs, self.xs)
+                    or not np.array_equal(prev_zs, self.zs)):
+                continue
+            measurements_per_iteration = prev_next_measurement - self.next_measurement
+            if any(self.i2m.get(m) for m in range(self.next_measurement + 1, prev_next_measurement + 1)):
+                continue
+
+            # Skip iterations up to the next one with a measurement that's part of a flow.
+            skip = remaining
+            if measurements_per_iteration:
+                lowest_measurement = self.next_measurement - remaining * measurements_per_iteration + 1
+                next_used_measurement = max([
+                    m
+                    for m, flow_indices in self.i2m.items()
+                    if flow_indices and lowest_measurement <= m <= self.next_measurement
+                ], default=None)
+                if next_used_measurement is not None:
+                    skip = (self.next_measurement - next_used_measurement) // measurements_per_iteration
+            self._replay_iterations(
+                skip=skip,
+                prev_next_measurement=prev_next_measurement,
+                prev_reset_index=prev_reset_index,
+            )
+            remaining -= skip
+
+    def _replay_iterations(self, *, skip: int, prev_next_measurement: int, prev_reset_index: int):
+        """Repeats the bookkeeping of the last applied iteration, for skipped iterations."""
+        measurements_per_iteration = prev_next_measurement - self.next_measurement
+        resets_per_iteration = self.reset_index - prev_reset_index
+        destructive = [
+            m
+            for m in range(self.next_measurement + 1, prev_next_measurement + 1)
+            if m in self.measurement_to_can_be_destructive
+        ]
+        reset_flows = {
+            r: list(self.reset_to_flow_indices[r])
+            for r in range(prev_reset_index, self.reset_index)
+            if r in self.reset_to_flow_indices
+        }
+        for j in range(1, skip + 1):
+            for m in destructive:
+                self.measurement_to_can_be_destructive.add(m - j * measurements_per_iteration)
+            for r, flow_indices in reset_flows.items():
+                self.reset_to_flow_indices[r + j * resets_per_iteration].extend(flow_indices)
+        self.next_measurement -= skip * measurements_per_iteration
+        self.reset_index += skip * resets_per_iteration
+
     @staticmethod
     def invert(chunk: 'Chunk') -> Chunk:
         v = FlowStabilizerVerifier.verify(chunk)
@@ -188,80 +355,119 @@ class FlowStabilizerVerifier:
             discarded_outputs=chunk.discarded_inputs,
         )
 
+    def _rev_apply_action(self, inst: stim.CircuitInstruction):
+        """Applies a unitary gate to all of its targets at once, when its targets are distinct."""
+        targets = inst.targets_copy()
+        for t in targets:
+            assert t.is_qubit_target
+        qs = np.array([t.value for t in targets], dtype=np.int64)
+        if inst.name in REV_ONE_QUBIT_ACTIONS:
+            action = REV_ONE_QUBIT_ACTIONS[inst.name]
+            groups = [qs]
+        else:
+            action = REV_TWO_QUBIT_ACTIONS[inst.name]
+            groups = [qs[0::2], qs[1::2]]
+
+        if len(np.unique(qs)) != len(qs):
+            # Targets overlap, so the order they're applied in matters. Apply them one at a time.
+            for k in range(len(groups[0]))[::-1]:
+                self._rev_apply_action_to(action, [g[k:k + 1] for g in groups])
+        else:
+            self._rev_apply_action_to(action, groups)
+
+    def _rev_apply_action_to(self, action, groups: List[np.ndarray]):
+        rows = []
+        for g in groups:
+            rows.append(self.xs[g])
+            rows.append(self.zs[g])
+        rows = action(*rows)
+        for k, g in enumerate(groups):
+            self.xs[g] = rows[2 * k]
+            self.zs[g] = rows[2 * k + 1]
+
+    def _rev_apply_feedback(self, inst: stim.CircuitInstruction, *, pauli_rows: np.ndarray):
+        """Applies a CX or CZ, which may have classically controlled targets like `CX rec[-1] 0`.
+
+        Instructions with measurement record targets are applied one target pair at a time.
+        """
+        ts = inst.targets_copy()
+        if not any(t.is_measurement_record_target for t in ts):
+            self._rev_apply_action(inst)
+            return
+        for k in range(0, len(ts), 2)[::-1]:
+            t1 = ts[k]
+            t2 = ts[k + 1]
+            assert t2.is_qubit_target
+            if t1.is_measurement_record_target:
+                self.num_feedback_operations += 1
+                m = self.next_measurement + t1.value + 1
+                self.i2m[m].extend(self.flow_indices(pauli_rows[t2.value]))
+            else:
+                self._rev_apply_action(stim.CircuitInstruction(inst.name, [t1, t2]))
+
+    def _rev_apply_reset(self, inst: stim.CircuitInstruction, *, xs: bool, zs: bool):
+        """Applies a reset. The flow terms left on the qubit must match its reset basis."""
+        for t in inst.targets_copy()[::-1]:
+            assert t.is_qubit_target
+            q = t.value
+            if xs and zs:
+                self.fail_if(self.xs[q] ^ self.zs[q], f"Anticommuted with {inst.name}")
+                kept = self.xs[q]
+            elif xs:
+                self.fail_if(self.zs[q], f"Anticommuted with {inst.name}")
+                kept = self.xs[q]
+            else:
+                self.fail_if(self.xs[q], f"Anticommuted with {inst.name}")
+                kept = self.zs[q]
+            flow_indices = self.flow_indices(kept)
+            if flow_indices:
+                self.reset_to_flow_indices[self.reset_index].extend(flow_indices)
+            self.reset_index += 1
+            self.xs[q] = 0
+            self.zs[q] = 0
+
+    def _rev_apply_measure(self, inst: stim.CircuitInstruction, *, xs: bool, zs: bool, name: str):
+        """Applies a single-qubit measurement, toggling the measured basis into its flows."""
+        for t in inst.targets_copy()[::-1]:
+            assert t.is_qubit_target
+            q = t.value
+            m = self.next_measurement
+            self.next_measurement -= 1
+            if xs and zs:
+                self.fail_if(self.xs[q] ^ self.zs[q], f"Anticommuted with {name}")
+            elif xs:
+                self.fail_if(self.zs[q], f"Anticommuted with {name}")
+            else:
+                self.fail_if(self.xs[q], f"Anticommuted with {name}")
+            if not np.any(self.xs[q]) and not np.any(self.zs[q]):
+                self.measurement_to_can_be_destructive.add(m)
+            flow_indices = self.i2m.get(m)
+            if flow_indices:
+                mask = self.flow_mask(flow_indices)
+                if xs:
+                    self.xs[q] ^= mask
+                if zs:
+                    self.zs[q] ^= mask
+
     def rev_apply(self, inst: stim.CircuitInstruction):
-        if inst.name == 'H' or inst.name == 'SQRT_Y' or inst.name == "SQRT_Y_DAG":
-            for t in inst.targets_copy()[::-1]:
-                assert t.is_qubit_target
-                q = t.value
-                tmp = self.xs[q].copy()
-                self.xs[q, :] = self.zs[q]
-                self.zs[q, :] = tmp
-        elif inst.name == 'I' or inst.name == 'Z' or inst.name == 'X' or inst.name == 'Y':
-            pass
-        elif inst.name == 'S' or inst.name == 'S_DAG' or inst.name == 'H_XY':
-            for t in inst.targets_copy()[::-1]:
-                assert t.is_qubit_target
-                q = t.value
-                self.zs[q, :] ^= self.xs[q]
-        elif inst.name == 'SQRT_X' or inst.name == 'SQRT_X_DAG' or inst.name == 'H_YZ':
-            for t in inst.targets_copy()[::-1]:
-                assert t.is_qubit_target
-                q = t.value
-                self.xs[q, :] ^= self.zs[q]
-        elif inst.name == 'C_XYZ':
-            for t in inst.targets_copy()[::-1]:
-                assert t.is_qubit_target
-                q = t.value
-                self.zs[q, :] ^= self.xs[q]
-                self.xs[q, :] ^= self.zs[q]
-        elif inst.name == 'C_ZYX':
-            for t in inst.targets_copy()[::-1]:
-                assert t.is_qubit_target
-                q = t.value
-                self.xs[q, :] ^= self.zs[q]
-                self.zs[q, :] ^= self.xs[q]
+        if inst.name == 'CX':
+            self._rev_apply_feedback(inst, pauli_rows=self.zs)
+        elif inst.name == 'CZ':
+            self._rev_apply_feedback(inst, pauli_rows=self.xs)
+        elif inst.name in REV_ONE_QUBIT_ACTIONS or inst.name in REV_TWO_QUBIT_ACTIONS:
+            self._rev_apply_action(inst)
         elif inst.name == 'RY':
-            for t in inst.targets_copy()[::-1]:
-                assert t.is_qubit_target
-                q = t.value
-                self.fail_if(self.xs[q] ^ self.zs[q], "Anticommuted with RY")
-                for k in range(len(self.flows)):
-                    if self.xs[q, k] and self.zs[q, k]:
-                        self.reset_to_flow_indices[self.reset_index].append(k)
-                self.reset_index += 1
-                self.xs[q, :] = 0
-                self.zs[q, :] = 0
+            self._rev_apply_reset(inst, xs=True, zs=True)
         elif inst.name == 'RX':
-            for t in inst.targets_copy()[::-1]:
-                assert t.is_qubit_target
-                q = t.value
-                self.fail_if(self.zs[q], "Anticommuted with RX")
-                for k in range(len(self.flows)):
-                    if self.xs[q, k]:
-                        self.reset_to_flow_indices[self.reset_index].append(k)
-                self.reset_index += 1
-                self.xs[q, :] = 0
+            self._rev_apply_reset(inst, xs=True, zs=False)
         elif inst.name == 'R':
-            for t in inst.targets_copy()[::-1]:
-                assert t.is_qubit_target
-                q = t.value
-                self.fail_if(self.xs[q], "Anticommuted with R")
-                for k in range(len(self.flows)):
-                    if self.zs[q, k]:
-                        self.reset_to_flow_indices[self.reset_index].append(k)
-                self.reset_index += 1
-                self.zs[q, :] = 0
+            self._rev_apply_reset(inst, xs=False, zs=True)
         elif inst.name == 'M':
-            for t in inst.targets_copy()[::-1]:
-                assert t.is_qubit_target
-                q = t.value
-                m = self.next_measurement
-                self.next_measurement -= 1
-                self.fail_if(self.xs[q], "Anticommuted with M")
-                if not np.any(self.xs[q, :]) and not np.any(self.zs[q, :]):
-                    self.measurement_to_can_be_destructive.add(m)
-                for s in self.i2m[m]:
-                    self.zs[q, s] ^= True
+            self._rev_apply_measure(inst, xs=False, zs=True, name='M')
+        elif inst.name == 'MY':
+            self._rev_apply_measure(inst, xs=True, zs=True, name='M')
+        elif inst.name == 'MX':
+            self._rev_apply_measure(inst, xs=True, zs=False, name='MX')
         elif inst.name == 'MR':
             for gate in 'RM':
                 self.rev_apply(stim.CircuitInstruction(name=gate, targets=inst.targets_copy(), gate_args=inst.gate_args_copy()))
@@ -277,215 +483,6 @@ class FlowStabilizerVerifier:
         elif inst.name == 'MRY':
             for gate in ['RY', 'MY']:
                 self.rev_apply(stim.CircuitInstruction(name=gate, targets=inst.targets_copy(), gate_args=inst.gate_args_copy()))
-        elif inst.name == 'MY':
-            for t in inst.targets_copy()[::-1]:
-                assert t.is_qubit_target
-                q = t.value
-                m = self.next_measurement
-                self.next_measurement -= 1
-                self.fail_if(self.xs[q] ^ self.zs[q], "Anticommuted with M")
-                if not np.any(self.xs[q, :]) and not np.any(self.zs[q, :]):
-                    self.measurement_to_can_be_destructive.add(m)
-                for s in self.i2m[m]:
-                    self.xs[q, s] ^= True
-                    self.zs[q, s] ^= True
-        elif inst.name == 'MX':
-            for t in inst.targets_copy()[::-1]:
-                assert t.is_qubit_target
-                q = t.value
-                m = self.next_measurement
-                self.next_measurement -= 1
-                self.fail_if(self.zs[q], "Anticommuted with MX")
-                if not np.any(self.xs[q, :]) and not np.any(self.zs[q, :]):
-                    self.measurement_to_can_be_destructive.add(m)
-                for s in self.i2m[m]:
-                    self.xs[q, s] ^= True
-        elif inst.name == 'XCZ':
-            ts = inst.targets_copy()
-            for k in range(0, len(ts), 2)[::-1]:
-                t1 = ts[k]
-                t2 = ts[k + 1]
-                assert t1.is_qubit_target
-                assert t2.is_qubit_target
-                q1 = t1.value
-                q2 = t2.value
-                self.xs[q1] ^= self.xs[q2]
-                self.zs[q2] ^= self.zs[q1]
-        elif inst.name == 'CX':
-            ts = inst.targets_copy()
-            for k in range(0, len(ts), 2)[::-1]:
-                t1 = ts[k]
-                t2 = ts[k + 1]
-                assert t2.is_qubit_target
-                q2 = t2.value
-                if t1.is_measurement_record_target:
-                    m = self.next_measurement + t1.value + 1
-                    for s in np.flatnonzero(self.zs[q2, :]):
-                        self.i2m[m].append(s)
-                else:
-                    assert t1.is_qubit_target
-                    q1 = t1.value
-                    self.xs[q2] ^= self.xs[q1]
-                    self.zs[q1] ^= self.zs[q2]
-        elif inst.name == 'CZ':
-            ts = inst.targets_copy()
-            for k in range(0, len(ts), 2)[::-1]:
-                t1 = ts[k]
-                t2 = ts[k + 1]
-                assert t2.is_qubit_target
-                q2 = t2.value
-                if t1.is_measurement_record_target:
-                    m = self.next_measurement + t1.value + 1
-                    for s in np.flatnonzero(self.xs[q2, :]):
-                        self.i2m[m].append(s)
-                else:
-                    assert t1.is_qubit_target
-                    q1 = t1.value
-                    self.zs[q2] ^= self.xs[q1]
-                    self.zs[q1] ^= self.xs[q2]
-        elif inst.name == 'CY' or inst.name == 'YCZ':
-            ts = inst.targets_copy()
-            for k in range(0, len(ts), 2)[::-1]:
-                t1 = ts[k]
-                t2 = ts[k + 1]
-                if inst.name == 'YCZ':
-                    t1, t2 = t2, t1
-                assert t1.is_qubit_target
-                assert t2.is_qubit_target
-                q1 = t1.value
-                q2 = t2.value
-                yt = self.xs[q2] ^ self.zs[q2]
-                self.zs[q1] ^= yt
-                self.zs[q2] ^= self.xs[q1]
-                self.xs[q2] ^= self.xs[q1]
-        elif inst.name == 'ISWAP' or inst.name == 'ISWAP_DAG':
-            ts = inst.targets_copy()
-            for k in range(0, len(ts), 2)[::-1]:
-                t1 = ts[k]
-                t2 = ts[k + 1]
-                assert t1.is_qubit_target
-                assert t2.is_qubit_target
-                q1 = t1.value
-                q2 = t2.value
-                # swap
-                for bs in [self.xs, self.zs]:
-                    bs[q1] ^= bs[q2]
-                    bs[q2] ^= bs[q1]
-                    bs[q1] ^= bs[q2]
-                # cz
-                self.zs[q2] ^= self.xs[q1]
-                self.zs[q1] ^= self.xs[q2]
-                # s s
-                self.zs[q1, :] ^= self.xs[q1]
-                self.zs[q2, :] ^= self.xs[q2]
-        elif inst.name == 'SQRT_ZZ' or inst.name == 'SQRT_ZZ_DAG':
-            ts = inst.targets_copy()
-            for k in range(0, len(ts), 2)[::-1]:
-                t1 = ts[k]
-                t2 = ts[k + 1]
-                assert t1.is_qubit_target
-                assert t2.is_qubit_target
-                q1 = t1.value
-                q2 = t2.value
-                # cz
-                self.zs[q2] ^= self.xs[q1]
-                self.zs[q1] ^= self.xs[q2]
-                # s s
-                self.zs[q1, :] ^= self.xs[q1]
-                self.zs[q2, :] ^= self.xs[q2]
-        elif inst.name == 'XCX':
-            ts = inst.targets_copy()
-            for k in range(0, len(ts), 2)[::-1]:
-                t1 = ts[k]
-                t2 = ts[k + 1]
-                assert t1.is_qubit_target
-                assert t2.is_qubit_target
-                q1 = t1.value
-                q2 = t2.value
-                self.xs[q2] ^= self.zs[q1]
-                self.xs[q1] ^= self.zs[q2]
-        elif inst.name == 'YCY':
-            ts = inst.targets_copy()
-            for k in range(0, len(ts), 2)[::-1]:
-                t1 = ts[k]
-                t2 = ts[k + 1]
-                assert t1.is_qubit_target
-                assert t2.is_qubit_target
-                q1 = t1.value
-                q2 = t2.value
-                # s s
-                self.zs[q1, :] ^= self.xs[q1]
-                self.zs[q2, :] ^= self.xs[q2]
-                # xcx
-                self.xs[q2] ^= self.zs[q1]
-                self.xs[q1] ^= self.zs[q2]
-                # s s
-                self.zs[q1, :] ^= self.xs[q1]
-                self.zs[q2, :] ^= self.xs[q2]
-        elif inst.name == 'SQRT_YY' or inst.name == 'SQRT_YY_DAG':
-            ts = inst.targets_copy()
-            for k in range(0, len(ts), 2)[::-1]:
-                t1 = ts[k]
-                t2 = ts[k + 1]
-                assert t1.is_qubit_target
-                assert t2.is_qubit_target
-                q1 = t1.value
-                q2 = t2.value
-                # s s
-                self.zs[q1, :] ^= self.xs[q1]
-                self.zs[q2, :] ^= self.xs[q2]
-                # xcx
-                self.xs[q2] ^= self.zs[q1]
-                self.xs[q1] ^= self.zs[q2]
-                # sqrt_x sqrt_x
-                self.xs[q1, :] ^= self.zs[q1]
-                self.xs[q2, :] ^= self.zs[q2]
-                # s s
-                self.zs[q1, :] ^= self.xs[q1]
-                self.zs[q2, :] ^= self.xs[q2]
-        elif inst.name == 'SQRT_XX' or inst.name == 'SQRT_XX_DAG':
-            ts = inst.targets_copy()
-            for k in range(0, len(ts), 2)[::-1]:
-                t1 = ts[k]
-                t2 = ts[k + 1]
-                assert t1.is_qubit_target
-                assert t2.is_qubit_target
-                q1 = t1.value
-                q2 = t2.value
-                # xcx
-                self.xs[q2] ^= self.zs[q1]
-                self.xs[q1] ^= self.zs[q2]
-                # sqrt_x sqrt_x
-                self.xs[q1, :] ^= self.zs[q1]
-                self.xs[q2, :] ^= self.zs[q2]
-        elif inst.name == 'SWAP':
-            ts = inst.targets_copy()
-            for k in range(0, len(ts), 2)[::-1]:
-                t1 = ts[k]
-                t2 = ts[k + 1]
-                assert t1.is_qubit_target
-                assert t2.is_qubit_target
-                q1 = t1.value
-                q2 = t2.value
-                for bs in [self.xs, self.zs]:
-                    bs[q1] ^= bs[q2]
-                    bs[q2] ^= bs[q1]
-                    bs[q1] ^= bs[q2]
-        elif inst.name == 'XCY' or inst.name == 'YCX':
-            ts = inst.targets_copy()
-            for k in range(0, len(ts), 2)[::-1]:
-                t1 = ts[k]
-                t2 = ts[k + 1]
-                if inst.name == 'YCX':
-                    t1, t2 = t2, t1
-                assert t1.is_qubit_target
-                assert t2.is_qubit_target
-                q1 = t1.value
-                q2 = t2.value
-                yt = self.xs[q2] ^ self.zs[q2]
-                self.xs[q1] ^= yt
-                self.zs[q2] ^= self.zs[q1]
-                self.xs[q2] ^= self.zs[q1]
         elif inst.name == 'MPP':
             targets = inst.targets_copy()[::-1]
             start = 0
@@ -507,22 +504,24 @@ class FlowStabilizerVerifier:
                     else:
                         raise NotImplementedError(f'{inst=}')
 
-                for k in range(self.xs.shape[1]):
-                    x_combos = np.sum(np.bitwise_and(self.xs[:, k], z_mask), axis=0)
-                    z_combos = np.sum(np.bitwise_and(self.zs[:, k], x_mask), axis=0)
-                    if np.any((x_combos + z_combos) & 1):
-                        raise ValueError("Anticommuted with MPP")
+                anticommutes = (
+                    np.bitwise_xor.reduce(self.xs[z_mask], axis=0)
+                    ^ np.bitwise_xor.reduce(self.zs[x_mask], axis=0)
+                )
+                self.fail_if(anticommutes, "Anticommuted with MPP")
                 m = self.next_measurement
                 self.next_measurement -= 1
-                for s in self.i2m[m]:
-                    self.zs[:, s] ^= z_mask
-                    self.xs[:, s] ^= x_mask
+                flow_indices = self.i2m.get(m)
+                if flow_indices:
+                    mask = self.flow_mask(flow_indices)
+                    self.zs[z_mask] ^= mask
+                    self.xs[x_mask] ^= mask
 
                 start = end
 
         elif inst.name == 'TICK':
             pass
-        elif inst.name == 'QUBIT_COORDS':
+        elif inst.name == 'QUBIT_COORDS' or inst.name == 'SHIFT_COORDS':
             pass
         else:
             raise NotImplementedError(f'{inst=}')
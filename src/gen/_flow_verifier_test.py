@@ -1,3 +1,5 @@
+import random
+
 import pytest
 import stim
 
@@ -371,6 +373,41 @@ def test_verify_gate_flows_vs_stim_tableau(gate: str):
         inverse.verify()
 
 
+@pytest.mark.parametrize('gate,targets', [
+    (gate, targets)
+    for gate in ['H', 'S', 'C_XYZ', 'SQRT_X', 'CX', 'CY', 'ISWAP', 'SQRT_YY', 'XCY', 'YCZ']
+    for targets in ['0 1 2 3 4 5', '0 1 1 2 2 0 5 3']
+])
+def test_verify_many_flows_through_multi_target_gate(gate: str, targets: str):
+    # More than 64 flows, so the packed flow state spans several words.
+    circuit = stim.Circuit(f'{gate} {targets}')
+    tableau = stim.Tableau.from_circuit(circuit)
+    q2i = {q: q for q in range(6)}
+    # Distinct starts with only I or Z on qubit 0, so multiplying one by X0 can't create a duplicate.
+    starts = [
+        stim.PauliString('_Z'[n & 1] + ''.join('_XYZ'[(n >> (2 * j + 1)) & 3] for j in range(5)))
+        for n in random.Random(0).sample(range(1, 2 * 4**5), 150)
+    ]
+    flows = [
+        gen.Flow(
+            center=0,
+            start=gen.PauliString.from_stim_pauli_string(start),
+            end=gen.PauliString.from_stim_pauli_string(tableau(start)),
+            allow_vacuous=True,
+        )
+        for start in starts
+    ]
+    gen.Chunk(circuit=circuit, q2i=q2i, flows=flows).verify()
+
+    bad_flow = gen.Flow(
+        center=0,
+        start=gen.PauliString.from_stim_pauli_string(starts[-1] * stim.PauliString('X_____')),
+        end=gen.PauliString.from_stim_pauli_string(tableau(starts[-1])),
+        allow_vacuous=True,
+    )
+    with pytest.raises(ValueError, match='Mismatch at start'):
+        gen.Chunk(circuit=circuit, q2i=q2i, flows=[*flows[:-1], bad_flow]).verify()
+
 
 def test_verify_swap():
     chunk = gen.Chunk(
@@ -729,3 +766,64 @@ def test_reproduce_feedback_verification_failure():
             ),
         ],
     ).verify()
+
+
+def _repetition_code_loop_chunk(rounds: int, flows_measurement_indices, extra_flows=()) -> gen.Chunk:
+    return gen.Chunk(
+        circuit=stim.Circuit(f"""
+            R 0 1 2 3 4
+            TICK
+            REPEAT {rounds} {{
+                CX 0 3 1 3 1 4 2 4
+                TICK
+                M 3 4
+                TICK
+                R 3 4
+                SHIFT_COORDS(0, 0, 1)
+                TICK
+            }}
+            M 0 1 2
+        """),
+        q2i={0: 0, 1: 1, 2: 2, 3: 3, 4: 4},
+        flows=[
+            gen.Flow(center=0, end=gen.PauliString({0: 'Z', 1: 'Z'})),
+            *[
+                gen.Flow(center=0, measurement_indices=ms)
+                for ms in flows_measurement_indices
+            ],
+            *extra_flows,
+        ],
+    )
+
+
+def test_verify_repeat_block_matches_flattened():
+    rounds = 50
+    n = 2 * rounds
+    chunk = _repetition_code_loop_chunk(rounds, [
+        [0],
+        [1],
+        [20, 22],
+        [n - 2, n, n + 1],
+        [n - 1, n + 1, n + 2],
+    ])
+    flat_chunk = gen.Chunk(circuit=chunk.circuit.flattened(), q2i=chunk.q2i, flows=chunk.flows)
+
+    v = gen.FlowStabilizerVerifier.verify(chunk)
+    v_flat = gen.FlowStabilizerVerifier.verify(flat_chunk)
+    assert v.next_measurement == v_flat.next_measurement == -1
+    assert v.reset_index == v_flat.reset_index
+    assert v.measurement_to_can_be_destructive == v_flat.measurement_to_can_be_destructive
+    assert dict(v.reset_to_flow_indices) == dict(v_flat.reset_to_flow_indices)
+    assert gen.FlowStabilizerVerifier.invert(chunk) == gen.FlowStabilizerVerifier.invert(flat_chunk)
+
+    with pytest.raises(ValueError, match='Anticommuted'):
+        _repetition_code_loop_chunk(rounds, [[20, 24]], [gen.Flow(center=0, end=gen.PauliString({0: 'X'}))]).verify()
+
+
+def test_verify_repeat_block_skips_steady_state_iterations():
+    rounds = 10**5
+    n = 2 * rounds
+    chunk = _repetition_code_loop_chunk(rounds, [[0], [n // 2, n // 2 + 2], [n - 2, n, n + 1]])
+    chunk.verify()
+    with pytest.raises(ValueError, match='Mismatch'):
+        _repetition_code_loop_chunk(rounds, [[0]], [gen.Flow(center=0, start=gen.PauliString({1: 'Z'}))]).verify()
@@ -1,17 +1,31 @@
 import argparse
+import collections
+import concurrent.futures
+import contextlib
 import dataclasses
+import functools
+import hashlib
 import itertools
+import json
+import os
 import pathlib
+import sys
+import traceback
 from typing import Union, List, Optional, Dict, \
-    Callable, Any
+    Callable, Any, Iterator, Tuple, Iterable, ContextManager
 
+import sinter
 import stim
 
 from gen._chunk import Chunk, ChunkLoop
+from gen._circuit_manifest import CircuitManifest, construction_source_hash, circuit_stats
+from gen._circuit_writer import write_circuit_file, COMPRESSIONS
+from gen._debug_artifacts import write_debug_artifact, flush_debug_artifacts, detector_slice_svg
 from gen._flow_util import compile_chunks_into_circuit
 from gen._layer_translate import to_z_basis_interaction_circuit
-from gen._noise import NoiseModel
+from gen._noise import NoiseModel, NoiseTemplate
 from gen._patch import Patch
+from gen._stage_profiler import StageProfiler, PROFILE_DETAILS
 from gen._util import write_file
 from gen._viz_circuit_html import stim_circuit_html_viewer
 from gen._viz_patch_svg import patch_svg_viewer
@@ -25,15 +39,12 @@ class CircuitBuildParams:
     custom: Dict[str, Any]
 
 
-def main_generate_circuits(
+def _add_circuit_sweep_arguments(
+        parser: argparse.ArgumentParser,
         *,
         constructions: Dict[str, Callable[[CircuitBuildParams], List[Chunk]]],
-        extras: Optional[Dict[str, type]] = None,
+        extras: Dict[str, type],
 ) -> None:
-    if extras is None:
-        extras = {}
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--out_dir", type=str, required=True)
     parser.add_argument("--diameter", nargs='+', required=True, type=int)
     parser.add_argument("--rounds", nargs='+', required=True, type=str)
     parser.add_argument("--noise_strength", nargs='+', default=(None,), type=float)
@@ -44,10 +55,10 @@ def main_generate_circuits(
     parser.add_argument("--custom", default=None)
     for extra in extras:
         parser.add_argument("--" + extra, nargs='+', type=extras[extra], default=None)
-    args = parser.parse_args()
 
-    _generate_circuits(
-        constructions=constructions,
+
+def _circuit_sweep_kwargs(args: argparse.Namespace, *, extras: Dict[str, type]) -> Dict[str, Any]:
+    return dict(
         diameters=args.diameter,
         noise_strengths=args.noise_strength,
         rounds_funcs=args.rounds,
@@ -57,13 +68,148 @@ def main_generate_circuits(
         customs=args.custom,
         convert_to_czs=args.convert_to_cz,
         debug_out_dir=args.debug_out_dir,
+    )
+
+
+def main_generate_circuits(
+        *,
+        constructions: Dict[str, Callable[[CircuitBuildParams], List[Chunk]]],
+        extras: Optional[Dict[str, type]] = None,
+) -> None:
+    if extras is None:
+        extras = {}
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out_dir", type=str, required=True)
+    _add_circuit_sweep_arguments(parser, constructions=constructions, extras=extras)
+    parser.add_argument("--workers", default=1, type=int, help="Number of worker processes to generate circuits with.")
+    parser.add_argument("--compression", default=None, choices=COMPRESSIONS, help="Compress the written circuit files (as .stim.gz or .stim.zst). Note that `sinter collect --circuits` can't read compressed files: decompress them first, or use tools/collect_stats to sample the sweep without writing files.")
+    parser.add_argument("--skip_up_to_date", action='store_true', help="Skip configurations whose file in out_dir's manifest is up to date.")
+    parser.add_argument("--profile_out", default=None, type=str, help="Write per-stage timing and memory records of each configuration to this JSON lines file.")
+    parser.add_argument("--profile_detail", default=None, choices=PROFILE_DETAILS, help="Also dump cProfile stats or tracemalloc allocations of each configuration's slowest stage next to --profile_out.")
+    args = parser.parse_args()
+    if args.profile_detail is not None and args.profile_out is None:
+        parser.error("--profile_detail requires --profile_out")
+
+    _generate_circuits(
+        constructions=constructions,
+        **_circuit_sweep_kwargs(args, extras=extras),
         out_dir=args.out_dir,
+        workers=args.workers,
+        compression=args.compression,
+        skip_up_to_date=args.skip_up_to_date,
+        profile_out=args.profile_out,
+        profile_detail=args.profile_detail,
     )
 
 
-def _generate_circuits(
+def main_collect_stats(
+        *,
+        constructions: Dict[str, Callable[[CircuitBuildParams], List[Chunk]]],
+        extras: Optional[Dict[str, type]] = None,
+) -> None:
+    """Samples the circuits of a sweep with sinter, without writing them to disk first.
+
+    Takes the same circuit sweep arguments as `main_generate_circuits`. Circuits are built only as
+    sinter's workers need more tasks, and each task's json metadata matches what
+    `sinter collect --metadata_func auto` would derive from the file `main_generate_circuits`
+    writes for the same configuration.
+    """
+    if extras is None:
+        extras = {}
+    parser = argparse.ArgumentParser()
+    _add_circuit_sweep_arguments(parser, constructions=constructions, extras=extras)
+    parser.add_argument("--save_resume_filepath", type=str, required=True)
+    parser.add_argument("--decoders", nargs='+', default=('pymatching',), type=str)
+    parser.add_argument("--max_shots", type=int, default=None)
+    parser.add_argument("--max_errors", type=int, default=None)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    sweep = _circuit_sweep_kwargs(args, extras=extras)
+    num_tasks = sum(1 for _ in _iter_circuit_jobs(**{k: v for k, v in sweep.items() if k != 'debug_out_dir'}))
+    sinter.collect(
+        num_workers=args.processes,
+        tasks=iter_sinter_tasks(constructions=constructions, **sweep),
+        hint_num_tasks=num_tasks,
+        save_resume_filepath=args.save_resume_filepath,
+        decoders=args.decoders,
+        max_shots=args.max_shots,
+        max_errors=args.max_errors,
+        print_progress=True,
+    )
+
+
+@dataclasses.dataclass
+class _CircuitJob:
+    """One configuration from the product of the command line parameters."""
+    params: CircuitBuildParams
+    noise_model_name: str
+    noise_strength: Optional[float]
+    convert_to_cz: bool
+    item_extras: Tuple[Tuple[str, Any], ...]
+    custom_dict: Dict[str, Any]
+
+    def noise_model(self) -> Optional[NoiseModel]:
+        if self.noise_model_name in ['SI1000', 'si1000']:
+            return NoiseModel.si1000(self.noise_strength)
+        elif self.noise_model_name in ['uniform', 'UniformDepolarizing']:
+            return NoiseModel.uniform_depolarizing(self.noise_strength)
+        elif self.noise_model_name == "None":
+            return None
+        else:
+            raise NotImplementedError(f'{self.noise_model_name=}')
+
+    def out_path(self, *, out_dir: pathlib.Path, num_qubits: int, compression: Optional[str] = None) -> pathlib.Path:
+        extra_tags = ''
+        for k, v in self.item_extras:
+            extra_tags += f',{k}={v}'
+        if self.convert_to_cz:
+            extra_tags += ',g=cz'
+        else:
+            extra_tags += ',g=all'
+        for k, v in self.custom_dict.items():
+            extra_tags += f',{k}={v}'
+        p = self.params
+        suffix = {None: '', 'gzip': '.gz', 'zstd': '.zst'}[compression]
+        return out_dir / f'r={p.rounds},d={p.diameter},p={self.noise_strength},noise={self.noise_model_name},c={p.style},q={num_qubits}{extra_tags}.stim{suffix}'
+
+    def json_metadata(self, *, num_qubits: int) -> Dict[str, Any]:
+        """The metadata `sinter collect --metadata_func auto` derives from this job's file name."""
+        return sinter.comma_separated_key_values(str(self.out_path(out_dir=pathlib.Path(), num_qubits=num_qubits)))
+
+    def config(self, *, compression: Optional[str] = None) -> Dict[str, Any]:
+        """The json-friendly configuration identifying this job in a circuit manifest.
+
+        The compression is part of the configuration, so that compressed and uncompressed files
+        of the same circuit are separate manifest entries.
+        """
+        p = self.params
+        return json.loads(json.dumps({
+            'style': p.style,
+            'rounds': p.rounds,
+            'diameter': p.diameter,
+            'custom': p.custom,
+            'noise_model': self.noise_model_name,
+            'noise_strength': self.noise_strength,
+            'convert_to_cz': self.convert_to_cz,
+            'compression': compression,
+        }, default=repr))
+
+    def fingerprint(self, *, construction_hash: str, compression: Optional[str] = None) -> str:
+        """A hash of everything that determines the contents of this job's file."""
+        return hashlib.sha256(json.dumps({
+            'config': self.config(compression=compression),
+            'construction': construction_hash,
+            'stim': stim.__version__,
+        }, sort_keys=True).encode('utf8')).hexdigest()
+
+    def __str__(self) -> str:
+        p = self.params
+        return f'style={p.style},d={p.diameter},r={p.rounds},p={self.noise_strength},noise={self.noise_model_name},custom={p.custom}'
+
+
+def _iter_circuit_jobs(
         *,
-        constructions: Dict[str, Callable[[CircuitBuildParams], List['Chunk']]],
         diameters: List[int],
         noise_strengths: List[float],
         rounds_funcs: List[str],
@@ -72,20 +218,12 @@ def _generate_circuits(
         extras: Dict[str, Optional[List[Any]]],
         customs: Optional[str],
         convert_to_czs: List[str],
-        debug_out_dir: Union[None, str, pathlib.Path],
-        out_dir: Union[str, pathlib.Path],
-) -> None:
-    out_dir = pathlib.Path(out_dir)
-    out_dir.mkdir(exist_ok=True, parents=True)
-    if debug_out_dir is not None:
-        debug_out_dir = pathlib.Path(debug_out_dir)
-        debug_out_dir.mkdir(exist_ok=True, parents=True)
-
-    extras_product = itertools.product(*[
+) -> Iterator[_CircuitJob]:
+    extras_product = list(itertools.product(*[
         [(k, v) for v in vs]
         for k, vs in extras.items()
         if vs is not None
-    ])
+    ]))
     for (
         diameter,
         noise_strength,
@@ -105,16 +243,7 @@ def _generate_circuits(
     ):
         if noise_model_name != "None" and noise_strength is None:
             raise ValueError("Must specify --noise_strength")
-        auto_cz = False
-        if noise_model_name in ['SI1000', 'si1000']:
-            noise_model = NoiseModel.si1000(noise_strength)
-            auto_cz = True
-        elif noise_model_name in ['uniform', 'UniformDepolarizing']:
-            noise_model = NoiseModel.uniform_depolarizing(noise_strength)
-        elif noise_model_name == "None":
-            noise_model = None
-        else:
-            raise NotImplementedError(f'{noise_model_name=}')
+        auto_cz = noise_model_name in ['SI1000', 'si1000']
 
         rounds = eval(rounds_func, {'d': diameter})
         if convert_to_cz_arg == 'auto':
@@ -128,37 +257,385 @@ def _generate_circuits(
         else:
             custom_dict = {}
         assert custom_dict.keys().isdisjoint(extras_dict.keys())
-        circuit = _generate_single_circuit(
-            constructions=constructions,
+        yield _CircuitJob(
             params=CircuitBuildParams(style=style, rounds=rounds, diameter=diameter, custom={**extras_dict, **custom_dict}),
-            noise=noise_model,
-            debug_out_dir=debug_out_dir,
+            noise_model_name=noise_model_name,
+            noise_strength=noise_strength,
             convert_to_cz=convert_to_cz,
+            item_extras=tuple(item_extras),
+            custom_dict=custom_dict,
         )
-        q = circuit.num_qubits
-        extra_tags = ''
-        for k, v in item_extras:
-            extra_tags += f',{k}={v}'
-        if convert_to_cz:
-            extra_tags += ',g=cz'
+
+
+def _group_circuit_jobs(jobs: Iterable[_CircuitJob]) -> List[List[_CircuitJob]]:
+    """Groups configurations that only differ in their noise, so they can share one noiseless build."""
+    groups: Dict[str, List[_CircuitJob]] = {}
+    for job in jobs:
+        key = repr((job.params, job.convert_to_cz))
+        groups.setdefault(key, []).append(job)
+    return list(groups.values())
+
+
+def _split_job_groups(groups: List[List[_CircuitJob]], *, workers: int) -> List[List[_CircuitJob]]:
+    """Splits groups of configurations into pieces, so that a pool of workers has enough tasks.
+
+    Each piece repeats its group's noiseless build, so groups are only split into pieces about as
+    large as a fair share of a worker's configurations (e.g. one configuration swept over 26 noise
+    strengths becomes `workers` pieces of about 26/workers strengths each).
+    """
+    num_jobs = sum(len(group) for group in groups)
+    piece_size = max(1, -(-num_jobs // max(1, workers)))
+    pieces = []
+    for group in groups:
+        num_pieces = -(-len(group) // piece_size)
+        for k in range(num_pieces):
+            pieces.append(group[k * len(group) // num_pieces:(k + 1) * len(group) // num_pieces])
+    return pieces
+
+
+def _profile_stage(profiler: Optional[StageProfiler], name: str) -> ContextManager[Dict[str, Any]]:
+    if profiler is None:
+        return contextlib.nullcontext({})
+    return profiler.stage(name)
+
+
+def _iter_noisy_circuits(
+        jobs: List[_CircuitJob],
+        *,
+        constructions: Dict[str, Callable[[CircuitBuildParams], List['Chunk']]],
+        debug_out_dir: Optional[pathlib.Path],
+        profiler: Optional[StageProfiler] = None,
+        on_error: Optional[Callable[[_CircuitJob, Exception], None]] = None,
+) -> Iterator[Tuple[_CircuitJob, stim.Circuit, Optional[StageProfiler]]]:
+    """Builds the noiseless circuit shared by the given jobs once, then yields a noisy version per job.
+
+    If a profiler is given, the noiseless build's stages are recorded into it, and each job is
+    yielded with a fork of it that also holds the job's own stages. Compiling a noise template
+    shared by several jobs is recorded as a 'noise_template' stage of the first of those jobs.
+
+    If `on_error` is given, a job whose circuit fails to build is passed to it (with the error)
+    and skipped, instead of the error propagating. A failure of the shared noiseless build is
+    passed to it for every job.
+    """
+    try:
+        ideal = _generate_single_ideal_circuit(
+            constructions=constructions,
+            params=jobs[0].params,
+            debug_out_dir=debug_out_dir,
+            convert_to_cz=jobs[0].convert_to_cz,
+            profiler=profiler,
+        )
+    except Exception as ex:
+        if on_error is None:
+            raise
+        for job in jobs:
+            on_error(job, ex)
+        return
+    model_counts = collections.Counter(job.noise_model_name for job in jobs)
+    templates: Dict[str, Optional[NoiseTemplate]] = {}
+    for job in jobs:
+        job_profiler = None if profiler is None else profiler.fork(shared=len(jobs) > 1)
+        try:
+            noise = job.noise_model()
+            template = None
+            if noise is not None and model_counts[job.noise_model_name] > 1:
+                # Several strengths of the same model: only place the noise once.
+                if job.noise_model_name not in templates:
+                    with _profile_stage(job_profiler, 'noise_template'):
+                        try:
+                            templates[job.noise_model_name] = noise.compile_template(ideal.body)
+                        except ValueError:
+                            templates[job.noise_model_name] = None
+                template = templates[job.noise_model_name]
+            noisy = ideal.with_noise(noise, template=template, debug_out_dir=debug_out_dir, profiler=job_profiler)
+        except Exception as ex:
+            if on_error is None:
+                raise
+            on_error(job, ex)
+            continue
+        yield job, noisy, job_profiler
+    if debug_out_dir is not None:
+        flush_debug_artifacts()
+
+
+@dataclasses.dataclass
+class _JobResult:
+    path: Optional[pathlib.Path]
+    stats: Optional[Dict[str, int]]
+    profile: Optional[Dict[str, Any]]
+    error: Optional[str] = None
+
+
+def _run_circuit_jobs(
+        jobs: List[_CircuitJob],
+        *,
+        constructions: Dict[str, Callable[[CircuitBuildParams], List['Chunk']]],
+        debug_out_dir: Optional[pathlib.Path],
+        out_dir: pathlib.Path,
+        compression: Optional[str] = None,
+        profile: bool = False,
+        profile_detail: Optional[str] = None,
+        profile_dump_prefix: Optional[pathlib.Path] = None,
+        catch_errors: bool = False,
+) -> List[_JobResult]:
+    """Builds the noiseless circuit shared by the given jobs once, then writes a noisy version per job.
+
+    Returns one result per job, in the same order as the jobs.
+
+    When `profile` is set, each result carries a profile record: the job's stages (see
+    `StageProfiler`), and the path where the details of its slowest stage were dumped (when
+    `profile_detail` is set) as `{profile_dump_prefix}.{file name}.{stage}.{prof|txt}`.
+
+    When `catch_errors` is set, a job that fails doesn't stop the other jobs. Its result has no
+    path and holds the formatted traceback of the failure as its `error`.
+    """
+    profiler = StageProfiler(detail=profile_detail) if profile else None
+    results: Dict[int, _JobResult] = {}
+
+    def on_error(job: _CircuitJob, ex: Exception) -> None:
+        error = ''.join(traceback.format_exception(type(ex), ex, ex.__traceback__))
+        results[id(job)] = _JobResult(path=None, stats=None, profile=None, error=error)
+
+    for job, circuit, job_profiler in _iter_noisy_circuits(
+            jobs,
+            constructions=constructions,
+            debug_out_dir=debug_out_dir,
+            profiler=profiler,
+            on_error=on_error if catch_errors else None):
+        path = job.out_path(out_dir=out_dir, num_qubits=circuit.num_qubits, compression=compression)
+        try:
+            with _profile_stage(job_profiler, 'serialization'):
+                write_circuit_file(path, circuit, compression=compression)
+        except Exception as ex:
+            if not catch_errors:
+                raise
+            on_error(job, ex)
+            continue
+        record = None
+        if job_profiler is not None:
+            dumped = None
+            if profile_detail is not None:
+                dumped = job_profiler.dump_slowest(profile_dump_prefix.with_name(f'{profile_dump_prefix.name}.{path.name}'))
+            record = {
+                'path': path.name,
+                'config': job.config(compression=compression),
+                'slowest_stage': job_profiler.slowest_stage,
+                'slowest_stage_detail': None if dumped is None else str(dumped),
+                'total_wall_seconds': sum(r['wall_seconds'] for r in job_profiler.records),
+                'stages': job_profiler.records,
+            }
+        results[id(job)] = _JobResult(path=path, stats=circuit_stats(circuit), profile=record)
+    return [results[id(job)] for job in jobs]
+
+
+def iter_sinter_tasks(
+        *,
+        constructions: Dict[str, Callable[[CircuitBuildParams], List['Chunk']]],
+        diameters: List[int],
+        noise_strengths: List[float],
+        rounds_funcs: List[str],
+        noise_model_names: List[str],
+        styles: List[str],
+        extras: Dict[str, Optional[List[Any]]],
+        customs: Optional[str],
+        convert_to_czs: List[str],
+        debug_out_dir: Union[None, str, pathlib.Path] = None,
+) -> Iterator[sinter.Task]:
+    """Lazily yields a sinter task for each configuration in the product of the given parameters.
+
+    Takes the same parameters as `_generate_circuits` (minus the output options). Tasks are
+    built on demand, so handing this iterator to `sinter.collect` only builds circuits as
+    workers become free. Configurations that only differ in their noise share one noiseless
+    build. Each task's `json_metadata` is the dictionary `sinter collect --metadata_func auto`
+    would derive from the file name the configuration would be written to.
+    """
+    if debug_out_dir is not None:
+        debug_out_dir = pathlib.Path(debug_out_dir)
+        debug_out_dir.mkdir(exist_ok=True, parents=True)
+    jobs = _iter_circuit_jobs(
+        diameters=diameters,
+        noise_strengths=noise_strengths,
+        rounds_funcs=rounds_funcs,
+        noise_model_names=noise_model_names,
+        styles=styles,
+        extras=extras,
+        customs=customs,
+        convert_to_czs=convert_to_czs,
+    )
+    for group in _group_circuit_jobs(jobs):
+        for job, circuit, _ in _iter_noisy_circuits(group, constructions=constructions, debug_out_dir=debug_out_dir):
+            yield sinter.Task(
+                circuit=circuit,
+                json_metadata=job.json_metadata(num_qubits=circuit.num_qubits),
+            )
+
+
+def _generate_circuits(
+        *,
+        constructions: Dict[str, Callable[[CircuitBuildParams], List['Chunk']]],
+        diameters: List[int],
+        noise_strengths: List[float],
+        rounds_funcs: List[str],
+        noise_model_names: List[str],
+        styles: List[str],
+        extras: Dict[str, Optional[List[Any]]],
+        customs: Optional[str],
+        convert_to_czs: List[str],
+        debug_out_dir: Union[None, str, pathlib.Path],
+        out_dir: Union[str, pathlib.Path],
+        workers: int = 1,
+        compression: Optional[str] = None,
+        skip_up_to_date: bool = False,
+        profile_out: Union[None, str, pathlib.Path] = None,
+        profile_detail: Optional[str] = None,
+) -> None:
+    """Generates and writes a circuit for each configuration in the product of the given parameters.
+
+    Configurations that only differ in their noise model or noise strength share a single
+    construction and compilation of the noiseless circuit; only the noise pass is repeated.
+
+    Every written file gets an entry in the `manifest.jsonl` file of the output directory (see
+    `gen.CircuitManifest`), recording the file's metadata, summary statistics of its circuit, and
+    a fingerprint of the configuration and of the source code of the construction that produced it.
+
+    Args:
+        workers: When larger than 1, configurations are farmed out to a pool of this many worker
+            processes. Each worker process is reused across configurations, so it only pays for
+            importing stim/sinter once. Files are written as soon as their configuration finishes.
+            A failing configuration is reported without stopping the others, and an error is
+            raised after all configurations have been attempted. Noise sweeps are split across
+            the workers, with each worker building the noiseless circuit of its piece once.
+        compression: How to compress the written circuit files ('gzip', 'zstd', or None). Files
+            are streamed to disk and written atomically either way. Compressed files end with
+            '.stim.gz' or '.stim.zst', and `sinter collect --circuits` can't read them, so they
+            have to be decompressed before being sampled that way.
+        skip_up_to_date: Don't regenerate configurations whose manifest entry has a matching
+            fingerprint and whose file still exists. Only configurations whose parameters or
+            construction source code changed are rebuilt.
+        profile_out: Where to write a JSON line per generated configuration, holding the wall
+            time, CPU time, peak RSS growth, and output instruction count of each stage
+            (construction, compile, with_inlined_feedback, to_z_basis, noise_template,
+            noisy_circuit, serialization). Stages shared by configurations that only differ in their noise are
+            repeated in each of their lines, marked as shared.
+        profile_detail: 'cprofile' or 'tracemalloc' to also dump the details of each
+            configuration's slowest stage into files next to `profile_out`.
+    """
+    if profile_detail is not None and profile_out is None:
+        raise ValueError('profile_detail requires profile_out')
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(exist_ok=True, parents=True)
+    if debug_out_dir is not None:
+        debug_out_dir = pathlib.Path(debug_out_dir)
+        debug_out_dir.mkdir(exist_ok=True, parents=True)
+
+    all_jobs = list(_iter_circuit_jobs(
+        diameters=diameters,
+        noise_strengths=noise_strengths,
+        rounds_funcs=rounds_funcs,
+        noise_model_names=noise_model_names,
+        styles=styles,
+        extras=extras,
+        customs=customs,
+        convert_to_czs=convert_to_czs,
+    ))
+    construction_hashes = {
+        style: construction_source_hash(constructions[style])
+        for style in set(styles)
+        if style in constructions
+    }
+    fingerprints = {
+        id(job): job.fingerprint(construction_hash=construction_hashes.get(job.params.style, ''), compression=compression)
+        for job in all_jobs
+    }
+    manifest = CircuitManifest(out_dir)
+    jobs = []
+    for job in all_jobs:
+        if skip_up_to_date and manifest.is_up_to_date(config=job.config(compression=compression), fingerprint=fingerprints[id(job)]):
+            path = out_dir / manifest.entry_for(job.config(compression=compression))['path']
+            print(f'up to date file://{path.absolute()}')
         else:
-            extra_tags += ',g=all'
-        for k, v in custom_dict.items():
-            extra_tags += f',{k}={v}'
-        path = out_dir / f'r={rounds},d={diameter},p={noise_strength},noise={noise_model_name},c={style},q={q}{extra_tags}.stim'
-        with open(path, 'w') as f:
-            print(circuit, file=f)
-        print(f'wrote file://{path.absolute()}')
+            jobs.append(job)
 
+    if profile_out is not None:
+        profile_out = pathlib.Path(profile_out)
+        profile_out.parent.mkdir(exist_ok=True, parents=True)
+        profile_out.write_text('')
 
-def _generate_single_circuit(
+    def record(job: _CircuitJob, result: _JobResult):
+        manifest.record({
+            'path': result.path.name,
+            'config': job.config(compression=compression),
+            'fingerprint': fingerprints[id(job)],
+            'metadata': job.json_metadata(num_qubits=result.stats['num_qubits']),
+            'stats': result.stats,
+        })
+        if profile_out is not None:
+            with open(profile_out, 'a') as f:
+                print(json.dumps(result.profile), file=f)
+
+    groups = _group_circuit_jobs(jobs)
+    run = functools.partial(
+        _run_circuit_jobs,
+        constructions=constructions,
+        debug_out_dir=debug_out_dir,
+        out_dir=out_dir,
+        compression=compression,
+        profile=profile_out is not None,
+        profile_detail=profile_detail,
+        profile_dump_prefix=profile_out,
+    )
+
+    if workers <= 1:
+        for group in groups:
+            for job, result in zip(group, run(group)):
+                record(job, result)
+                print(f'wrote file://{result.path.absolute()}')
+        manifest.compact()
+        return
+
+    failures = []
+    done = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        future_to_group = {
+            pool.submit(run, group, catch_errors=True): group
+            for group in _split_job_groups(groups, workers=workers)
+        }
+        for future in concurrent.futures.as_completed(future_to_group):
+            group = future_to_group[future]
+            try:
+                results = future.result()
+            except Exception as ex:
+                for job in group:
+                    done += 1
+                    failures.append(job)
+                    print(f'[{done}/{len(jobs)}] FAILED {job}', file=sys.stderr)
+                traceback.print_exception(type(ex), ex, ex.__traceback__, file=sys.stderr)
+            else:
+                for job, result in zip(group, results):
+                    done += 1
+                    if result.error is not None:
+                        failures.append(job)
+                        print(f'[{done}/{len(jobs)}] FAILED {job}', file=sys.stderr)
+                        print(result.error, file=sys.stderr, end='')
+                        continue
+                    record(job, result)
+                    print(f'[{done}/{len(jobs)}] wrote file://{result.path.absolute()}', flush=True)
+    manifest.compact()
+
+    if failures:
+        raise RuntimeError(
+            f'{len(failures)} of {len(jobs)} configurations failed:\n'
+            + '\n'.join(str(job) for job in failures))
+
+
+def _generate_single_ideal_circuit(
         *,
         constructions: Dict[str, Callable[[CircuitBuildParams], List['Chunk']]],
-        noise: Optional[NoiseModel],
         params: CircuitBuildParams,
         debug_out_dir: Union[None, str, pathlib.Path] = None,
         convert_to_cz: bool = True,
-) -> stim.Circuit:
+        profiler: Optional[StageProfiler] = None,
+) -> '_IdealCircuit':
     if debug_out_dir is not None:
         debug_out_dir = pathlib.Path(debug_out_dir)
         debug_out_dir.mkdir(exist_ok=True, parents=True)
@@ -166,17 +643,89 @@ def _generate_single_circuit(
     construction = constructions.get(params.style)
     if construction is None:
         raise NotImplementedError(f'{params=}')
-    chunks = construction(params)
+    with _profile_stage(profiler, 'construction') as stage:
+        chunks = construction(params)
+        stage['output'] = chunks
 
-    return generate_noisy_circuit_from_chunks(
+    return _generate_ideal_circuit_from_chunks(
         chunks=chunks,
         allow_magic_chunks='magic' in params.style,
-        noise=noise,
         debug_out_dir=debug_out_dir,
         convert_to_cz=convert_to_cz,
+        profiler=profiler,
     )
 
 
+def _generate_single_circuit(
+        *,
+        constructions: Dict[str, Callable[[CircuitBuildParams], List['Chunk']]],
+        noise: Optional[NoiseModel],
+        params: CircuitBuildParams,
+        debug_out_dir: Union[None, str, pathlib.Path] = None,
+        convert_to_cz: bool = True,
+) -> stim.Circuit:
+    ideal = _generate_single_ideal_circuit(
+        constructions=constructions,
+        params=params,
+        debug_out_dir=debug_out_dir,
+        convert_to_cz=convert_to_cz,
+    )
+    noisy_circuit = ideal.with_noise(noise, debug_out_dir=debug_out_dir)
+    if debug_out_dir is not None:
+        flush_debug_artifacts()
+    return noisy_circuit
+
+
+@dataclasses.dataclass
+class _IdealCircuit:
+    """A compiled noiseless circuit, split into the parts that noise should and shouldn't be applied to."""
+    magic_head: stim.Circuit
+    body: stim.Circuit
+    magic_tail: stim.Circuit
+    debug_patch: Optional[Patch]
+
+    def with_noise(
+            self,
+            noise: Optional[NoiseModel],
+            *,
+            template: Optional[NoiseTemplate] = None,
+            debug_out_dir: Union[None, str, pathlib.Path] = None,
+            profiler: Optional[StageProfiler] = None,
+    ) -> stim.Circuit:
+        """Returns the noisy circuit.
+
+        Args:
+            noise: The noise model to apply to the body of the circuit.
+            template: A template compiled from the body by a model of the same family as `noise`.
+                When specified, the noisy body is emitted from the template instead of running the
+                noise pass again.
+            debug_out_dir: Where to write debug artifacts, if anywhere. They're rendered in the
+                background; call `flush_debug_artifacts` to wait for them.
+            profiler: Where to record the cost of adding the noise, if anywhere.
+        """
+        with _profile_stage(profiler, 'noisy_circuit') as stage:
+            body = self.body
+            if noise is not None and template is not None:
+                body = template.noisy_circuit(noise.noise_strength)
+            elif noise is not None:
+                body = noise.noisy_circuit(body)
+            noisy_circuit = self.magic_head + body + self.magic_tail
+            stage['output'] = noisy_circuit
+
+        if debug_out_dir is not None:
+            debug_out_dir = pathlib.Path(debug_out_dir)
+            write_debug_artifact(
+                debug_out_dir / "noisy_circuit.html",
+                stim_circuit_html_viewer,
+                noisy_circuit,
+                patch=self.debug_patch,
+            )
+            write_file(debug_out_dir / "noisy_circuit.stim", noisy_circuit)
+            write_debug_artifact(debug_out_dir / "noisy_circuit_dets.svg", detector_slice_svg, noisy_circuit)
+
+        return noisy_circuit
+
+
 def generate_noisy_circuit_from_chunks(
         *,
         chunks: List[Union[Chunk, ChunkLoop]],
@@ -184,7 +733,63 @@ def generate_noisy_circuit_from_chunks(
         allow_magic_chunks: bool,
         convert_to_cz: bool,
         debug_out_dir: Union[None, str, pathlib.Path] = None,
+        profiler: Optional[StageProfiler] = None,
 ) -> stim.Circuit:
+    """Compiles chunks into a circuit, converts it to CZ gates if requested, and adds noise.
+
+    If a profiler is given, the cost of each stage (compile, with_inlined_feedback, to_z_basis,
+    noisy_circuit) is recorded into it.
+
+    If a debug output directory is given, html viewers and diagrams of the intermediate circuits
+    are rendered into it by background worker processes while the circuit is being generated.
+    They're all written by the time this method returns.
+    """
+    ideal = _generate_ideal_circuit_from_chunks(
+        chunks=chunks,
+        allow_magic_chunks=allow_magic_chunks,
+        convert_to_cz=convert_to_cz,
+        debug_out_dir=debug_out_dir,
+        profiler=profiler,
+    )
+    noisy_circuit = ideal.with_noise(noise, debug_out_dir=debug_out_dir, profiler=profiler)
+    if debug_out_dir is not None:
+        flush_debug_artifacts()
+    return noisy_circuit
+
+
+def _write_ideal_circuit_debug_artifacts(
+        *,
+        chunks: List[Union[Chunk, ChunkLoop]],
+        circuit: stim.Circuit,
+        debug_out_dir: pathlib.Path,
+) -> None:
+    patch_dict = {}
+    cur_tick = 0
+    last_patch = Patch([])
+    if chunks[0].start_patch() != last_patch:
+        patch_dict[0] = chunks[0].start_patch()
+        last_patch = chunks[0].start_patch()
+        cur_tick += 1
+
+    for c in ChunkLoop(chunks, repetitions=1).flattened():
+        cur_tick += c.tick_count()
+        if c.end_patch() != last_patch:
+            patch_dict[cur_tick] = c.end_patch().without_wraparound_tiles()
+            last_patch = c.end_patch()
+            cur_tick += 1
+    write_debug_artifact(debug_out_dir / "ideal_circuit.html", stim_circuit_html_viewer, circuit, patch=patch_dict)
+    write_file(debug_out_dir / "ideal_circuit.stim", circuit)
+    write_debug_artifact(debug_out_dir / "ideal_circuit_dets.svg", detector_slice_svg, circuit)
+
+
+def _generate_ideal_circuit_from_chunks(
+        *,
+        chunks: List[Union[Chunk, ChunkLoop]],
+        allow_magic_chunks: bool,
+        convert_to_cz: bool,
+        debug_out_dir: Union[None, str, pathlib.Path] = None,
+        profiler: Optional[StageProfiler] = None,
+) -> _IdealCircuit:
     if debug_out_dir is not None:
         debug_out_dir = pathlib.Path(debug_out_dir)
         debug_out_dir.mkdir(exist_ok=True, parents=True)
@@ -196,36 +801,35 @@ def generate_noisy_circuit_from_chunks(
         patches = [chunk.end_patch() for chunk in chunks[:-1]]
         changed_patches = [patches[k] for k in range(len(patches)) if k == 0 or patches[k] != patches[k-1]]
         allowed_qubits = {q for patch in changed_patches for q in patch.used_set}
-        write_file(debug_out_dir / "patch.svg", patch_svg_viewer(
+        write_debug_artifact(
+            debug_out_dir / "patch.svg",
+            patch_svg_viewer,
             changed_patches,
             show_order=False,
             available_qubits=allowed_qubits,
-        ))
+        )
 
+    with _profile_stage(profiler, 'compile') as stage:
+        try:
+            body = compile_chunks_into_circuit(chunks)
+        except Exception:
+            if debug_out_dir is not None:
+                # Show what the chunks compile into when their flows aren't checked, to help debug the failure.
+                _write_ideal_circuit_debug_artifacts(
+                    chunks=chunks,
+                    circuit=compile_chunks_into_circuit(chunks, ignore_errors=True),
+                    debug_out_dir=debug_out_dir,
+                )
+                flush_debug_artifacts()
+            raise
+        stage['output'] = body
     if debug_out_dir is not None:
-        ignore_errors_ideal_circuit = compile_chunks_into_circuit(chunks, ignore_errors=True)
-        patch_dict = {}
-        cur_tick = 0
-        last_patch = Patch([])
-        if chunks[0].start_patch() != last_patch:
-            patch_dict[0] = chunks[0].start_patch()
-            last_patch = chunks[0].start_patch()
-            cur_tick += 1
+        # Compiling while ignoring errors only differs when there are errors, so reuse the circuit.
+        _write_ideal_circuit_debug_artifacts(chunks=chunks, circuit=body, debug_out_dir=debug_out_dir)
 
-        for c in ChunkLoop(chunks, repetitions=1).flattened():
-            cur_tick += c.tick_count()
-            if c.end_patch() != last_patch:
-                patch_dict[cur_tick] = c.end_patch().without_wraparound_tiles()
-                last_patch = c.end_patch()
-                cur_tick += 1
-        write_file(debug_out_dir / "ideal_circuit.html", stim_circuit_html_viewer(
-            ignore_errors_ideal_circuit,
-            patch=patch_dict,
-        ))
-        write_file(debug_out_dir / "ideal_circuit.stim", ignore_errors_ideal_circuit)
-        write_file(debug_out_dir / "ideal_circuit_dets.svg", ignore_errors_ideal_circuit.diagram("time+detector-slice-svg"))
-
-    body = compile_chunks_into_circuit(chunks).with_inlined_feedback()
+    with _profile_stage(profiler, 'with_inlined_feedback') as stage:
+        body = body.with_inlined_feedback()
+        stage['output'] = body
     mpp_indices = [
         k
         for k, inst in enumerate(body)
@@ -240,26 +844,23 @@ def generate_noisy_circuit_from_chunks(
     body = body[body_start:body_end]
 
     if convert_to_cz:
-        body = to_z_basis_interaction_circuit(body, is_entire_circuit=len(magic_head) == len(magic_tail) == 0)
+        with _profile_stage(profiler, 'to_z_basis') as stage:
+            body = to_z_basis_interaction_circuit(body, is_entire_circuit=len(magic_head) == len(magic_tail) == 0)
+            stage['output'] = body
         if debug_out_dir is not None:
             ideal_circuit = magic_head + body + magic_tail
-            write_file(debug_out_dir / "ideal_cz_circuit.html", stim_circuit_html_viewer(
+            write_debug_artifact(
+                debug_out_dir / "ideal_cz_circuit.html",
+                stim_circuit_html_viewer,
                 ideal_circuit,
                 patch=chunks[0].end_patch().without_wraparound_tiles(),
-            ))
+            )
             write_file(debug_out_dir / "ideal_cz_circuit.stim", ideal_circuit)
-            write_file(debug_out_dir / "ideal_cz_circuit_dets.svg", ideal_circuit.diagram("time+detector-slice-svg"))
-
-    if noise is not None:
-        body = noise.noisy_circuit(body)
-    noisy_circuit = magic_head + body + magic_tail
-
-    if debug_out_dir is not None:
-        write_file(debug_out_dir / "noisy_circuit.html", stim_circuit_html_viewer(
-            noisy_circuit,
-            patch=chunks[0].end_patch().without_wraparound_tiles(),
-        ))
-        write_file(debug_out_dir / "noisy_circuit.stim", noisy_circuit)
-        write_file(debug_out_dir / "noisy_circuit_dets.svg", noisy_circuit.diagram("time+detector-slice-svg"))
+            write_debug_artifact(debug_out_dir / "ideal_cz_circuit_dets.svg", detector_slice_svg, ideal_circuit)
 
-    return noisy_circuit
+    return _IdealCircuit(
+        magic_head=magic_head,
+        body=body,
+        magic_tail=magic_tail,
+        debug_patch=None if debug_out_dir is None else chunks[0].end_patch().without_wraparound_tiles(),
+    )
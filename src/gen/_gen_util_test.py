@@ -0,0 +1,391 @@
+import dataclasses
+import gzip
+import importlib.util
+import json
+import pathlib
+import sys
+from typing import List
+
+import pytest
+import sinter
+import stim
+
+import gen
+from gen._gen_util import _generate_circuits, _group_circuit_jobs, _iter_circuit_jobs, _run_circuit_jobs, _split_job_groups
+
+
+def _tiny_construction(params: gen.CircuitBuildParams) -> List[gen.Chunk]:
+    if params.diameter == 0:
+        raise ValueError("bad diameter")
+    circuit = stim.Circuit()
+    for k in range(params.diameter):
+        circuit.append('QUBIT_COORDS', [k], [k, 0])
+    circuit.append('R', range(params.diameter))
+    circuit.append('TICK')
+    circuit.append('M', range(params.diameter))
+    for k in range(params.diameter):
+        circuit.append('DETECTOR', [stim.target_rec(-k - 1)], [k, 0, 0])
+    return [gen.Chunk(
+        circuit=circuit,
+        q2i={k + 0j: k for k in range(params.diameter)},
+        flows=[],
+    )]
+
+
+def _run_tiny(tmp_path: pathlib.Path, **overrides) -> None:
+    """Generates circuits of the tiny construction into `tmp_path`, with the given changes to the defaults."""
+    _generate_circuits(**{
+        'constructions': {'tiny': _tiny_construction},
+        'diameters': [2],
+        'noise_strengths': [1e-3],
+        'rounds_funcs': ['d'],
+        'noise_model_names': ['uniform'],
+        'styles': ['tiny'],
+        'extras': {},
+        'customs': None,
+        'convert_to_czs': ['0'],
+        'debug_out_dir': None,
+        'out_dir': tmp_path,
+        **overrides,
+    })
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_generate_circuits_workers(tmp_path: pathlib.Path, workers: int):
+    _run_tiny(tmp_path, diameters=[2, 3], noise_strengths=[1e-3, 1e-2], workers=workers)
+    paths = sorted(e.name for e in tmp_path.glob('*.stim*'))
+    assert paths == [
+        'r=2,d=2,p=0.001,noise=uniform,c=tiny,q=2,g=all.stim',
+        'r=2,d=2,p=0.01,noise=uniform,c=tiny,q=2,g=all.stim',
+        'r=3,d=3,p=0.001,noise=uniform,c=tiny,q=3,g=all.stim',
+        'r=3,d=3,p=0.01,noise=uniform,c=tiny,q=3,g=all.stim',
+    ]
+    assert [e['path'] for e in gen.CircuitManifest(tmp_path).select(noise='uniform')] == paths
+    circuit = stim.Circuit.from_file(tmp_path / paths[0])
+    assert circuit == gen.NoiseModel.uniform_depolarizing(1e-3).noisy_circuit(
+        _tiny_construction(gen.CircuitBuildParams(style='tiny', rounds=2, diameter=2, custom={}))[0].circuit
+    )
+
+
+def test_generate_circuits_workers_reports_failures(tmp_path: pathlib.Path):
+    with pytest.raises(RuntimeError, match='1 of 2 configurations failed'):
+        _run_tiny(tmp_path, diameters=[0, 2], workers=2)
+    assert [e.name for e in tmp_path.glob('*.stim*')] == [
+        'r=2,d=2,p=0.001,noise=uniform,c=tiny,q=2,g=all.stim',
+    ]
+
+
+def test_generate_circuits_workers_reports_failures_per_configuration(tmp_path: pathlib.Path, capsys):
+    # Each of the two pieces given to the workers holds a working and a failing noise model.
+    with pytest.raises(RuntimeError, match='2 of 4 configurations failed'):
+        _run_tiny(tmp_path, noise_strengths=[1e-3, 2e-3], noise_model_names=['uniform', 'bogus'], workers=2)
+    assert sorted(e.name for e in tmp_path.glob('*.stim*')) == [
+        'r=2,d=2,p=0.001,noise=uniform,c=tiny,q=2,g=all.stim',
+        'r=2,d=2,p=0.002,noise=uniform,c=tiny,q=2,g=all.stim',
+    ]
+    assert len(gen.CircuitManifest(tmp_path)) == 2
+    err = capsys.readouterr().err
+    assert err.count('FAILED') == 2
+    assert "self.noise_model_name='bogus'" in err
+
+
+def test_run_circuit_jobs_catch_errors(tmp_path: pathlib.Path):
+    jobs = list(_iter_circuit_jobs(
+        diameters=[2],
+        noise_strengths=[1e-3, 2e-3],
+        rounds_funcs=['d'],
+        noise_model_names=['uniform', 'bogus'],
+        styles=['tiny'],
+        extras={},
+        customs=None,
+        convert_to_czs=['0'],
+    ))
+    kwargs = dict(constructions={'tiny': _tiny_construction}, debug_out_dir=None, out_dir=tmp_path)
+    results = _run_circuit_jobs(jobs, **kwargs, catch_errors=True)
+    assert [r.path is None for r in results] == [False, True, False, True]
+    assert [r.error is None for r in results] == [True, False, True, False]
+    assert 'NotImplementedError' in results[1].error
+    with pytest.raises(NotImplementedError):
+        _run_circuit_jobs(jobs, **kwargs)
+
+    # A failing noiseless build fails every job.
+    results = _run_circuit_jobs(
+        jobs,
+        **{**kwargs, 'constructions': {'tiny': lambda _: _tiny_construction(gen.CircuitBuildParams(style='tiny', rounds=0, diameter=0, custom={}))}},
+        catch_errors=True,
+    )
+    assert all('bad diameter' in r.error for r in results)
+
+
+def test_generate_circuits_reuses_noiseless_circuit(tmp_path: pathlib.Path):
+    calls = []
+
+    def counting_construction(params: gen.CircuitBuildParams) -> List[gen.Chunk]:
+        calls.append(params.diameter)
+        return _tiny_construction(params)
+
+    _run_tiny(
+        tmp_path,
+        constructions={'tiny': counting_construction},
+        diameters=[2, 3],
+        noise_strengths=[1e-3, 2e-3, 3e-3],
+        noise_model_names=['uniform', 'si1000'],
+    )
+    assert sorted(calls) == [2, 3]
+    assert len(list(tmp_path.glob('*.stim*'))) == 12
+    circuit = stim.Circuit.from_file(tmp_path / 'r=3,d=3,p=0.002,noise=si1000,c=tiny,q=3,g=all.stim')
+    assert circuit == gen.NoiseModel.si1000(2e-3).noisy_circuit(
+        _tiny_construction(gen.CircuitBuildParams(style='tiny', rounds=3, diameter=3, custom={}))[0].circuit
+    )
+
+
+def test_split_job_groups():
+    jobs = list(_iter_circuit_jobs(
+        diameters=[3],
+        noise_strengths=[1e-3, 2e-3, 3e-3, 4e-3, 5e-3, 6e-3, 7e-3],
+        rounds_funcs=['d'],
+        noise_model_names=['uniform'],
+        styles=['tiny'],
+        extras={},
+        customs=None,
+        convert_to_czs=['0'],
+    ))
+    groups = _group_circuit_jobs(jobs)
+    assert len(groups) == 1
+
+    pieces = _split_job_groups(groups, workers=3)
+    assert [len(piece) for piece in pieces] == [2, 2, 3]
+    assert [job for piece in pieces for job in piece] == jobs
+    assert _split_job_groups(groups, workers=1) == groups
+    assert len(_split_job_groups(groups, workers=20)) == 7
+
+    # Groups that already give every worker a task aren't split.
+    jobs2 = jobs + [dataclasses.replace(job, params=dataclasses.replace(job.params, diameter=5)) for job in jobs]
+    assert [len(piece) for piece in _split_job_groups(_group_circuit_jobs(jobs2), workers=2)] == [7, 7]
+
+
+def test_generate_circuits_compression(tmp_path: pathlib.Path):
+    _run_tiny(tmp_path, compression='gzip')
+    [path] = tmp_path.glob('*.stim*')
+    assert path.name == 'r=2,d=2,p=0.001,noise=uniform,c=tiny,q=2,g=all.stim.gz'
+    assert stim.Circuit(gzip.decompress(path.read_bytes()).decode('utf8')) == gen.NoiseModel.uniform_depolarizing(1e-3).noisy_circuit(
+        _tiny_construction(gen.CircuitBuildParams(style='tiny', rounds=2, diameter=2, custom={}))[0].circuit
+    )
+
+    # Compressed and uncompressed files of the same circuit don't replace each other.
+    _run_tiny(tmp_path)
+    assert sorted(p.name for p in tmp_path.glob('*.stim*')) == [
+        'r=2,d=2,p=0.001,noise=uniform,c=tiny,q=2,g=all.stim',
+        'r=2,d=2,p=0.001,noise=uniform,c=tiny,q=2,g=all.stim.gz',
+    ]
+    assert len(gen.CircuitManifest(tmp_path)) == 2
+
+
+def test_iter_sinter_tasks(tmp_path: pathlib.Path):
+    calls = []
+
+    def counting_construction(params: gen.CircuitBuildParams) -> List[gen.Chunk]:
+        calls.append(params.diameter)
+        return _tiny_construction(params)
+
+    sweep = dict(
+        diameters=[2, 3],
+        noise_strengths=[1e-3, 2e-3],
+        rounds_funcs=['d'],
+        noise_model_names=['uniform'],
+        styles=['tiny'],
+        extras={},
+        customs=None,
+        convert_to_czs=['0'],
+    )
+    tasks = gen.iter_sinter_tasks(constructions={'tiny': counting_construction}, **sweep)
+    assert calls == []
+    first = next(tasks)
+    assert calls == [2]
+    rest = list(tasks)
+    assert calls == [2, 3]
+
+    _run_tiny(tmp_path, **sweep)
+    expected = {
+        path.name: stim.Circuit.from_file(path)
+        for path in tmp_path.glob('*.stim*')
+    }
+    actual = {}
+    for task in [first, *rest]:
+        name = ','.join(f'{k}={v}' for k, v in task.json_metadata.items()) + '.stim'
+        actual[name] = task.circuit
+        assert task.json_metadata == sinter.comma_separated_key_values(name)
+        json.dumps(task.json_metadata)
+    assert actual == expected
+
+
+def _load_module(monkeypatch, path: pathlib.Path):
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    monkeypatch.setitem(sys.modules, path.stem, module)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_generate_circuits_skip_up_to_date(tmp_path: pathlib.Path, monkeypatch):
+    src_dir = tmp_path / 'src'
+    src_dir.mkdir()
+    out_dir = tmp_path / 'out'
+    modules = {}
+    for style in ['tiny_a', 'tiny_b']:
+        path = src_dir / f'_gen_util_test_{style}.py'
+        path.write_text(
+            'from gen._gen_util_test import _tiny_construction\n'
+            '\n'
+            'CALLS = []\n'
+            '\n'
+            '\n'
+            'def construction(params):\n'
+            '    CALLS.append(params.style)\n'
+            '    return _tiny_construction(params)\n'
+        )
+        modules[style] = _load_module(monkeypatch, path)
+    constructions = {style: module.construction for style, module in modules.items()}
+
+    def run(*, skip_up_to_date: bool):
+        for module in modules.values():
+            module.CALLS.clear()
+        _run_tiny(
+            out_dir,
+            constructions=constructions,
+            noise_strengths=[1e-3, 2e-3],
+            styles=['tiny_a', 'tiny_b'],
+            skip_up_to_date=skip_up_to_date,
+        )
+        return sorted(style for module in modules.values() for style in module.CALLS)
+
+    assert run(skip_up_to_date=True) == ['tiny_a', 'tiny_b']
+    manifest = gen.CircuitManifest(out_dir)
+    assert len(manifest) == 4
+    assert sorted(e['path'] for e in manifest.entries) == sorted(e.name for e in out_dir.glob('*.stim'))
+    for entry in manifest.entries:
+        assert entry['metadata'] == sinter.comma_separated_key_values(entry['path'])
+        assert entry['stats'] == gen.circuit_stats(stim.Circuit.from_file(out_dir / entry['path']))
+    [path] = manifest.select_paths(c='tiny_b', p=0.002)
+    assert path.name == 'r=2,d=2,p=0.002,noise=uniform,c=tiny_b,q=2,g=all.stim'
+    assert run(skip_up_to_date=True) == []
+    assert run(skip_up_to_date=False) == ['tiny_a', 'tiny_b']
+
+    # Editing one construction's source only rebuilds that construction's circuits.
+    with open(src_dir / '_gen_util_test_tiny_b.py', 'a') as f:
+        f.write('# edited\n')
+    assert run(skip_up_to_date=True) == ['tiny_b']
+    assert run(skip_up_to_date=True) == []
+
+    # Missing files are rebuilt.
+    next(out_dir.glob('*p=0.002*c=tiny_a*')).unlink()
+    assert run(skip_up_to_date=True) == ['tiny_a']
+    assert len(gen.CircuitManifest(out_dir)) == 4
+    assert len(list(out_dir.glob('*.stim'))) == 4
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_generate_circuits_profile_out(tmp_path: pathlib.Path, workers: int):
+    _run_tiny(
+        tmp_path / 'out',
+        diameters=[2, 3],
+        noise_strengths=[1e-3, 2e-3],
+        convert_to_czs=['1'],
+        workers=workers,
+        profile_out=tmp_path / 'profile.jsonl',
+        profile_detail='cprofile',
+    )
+    lines = [json.loads(line) for line in (tmp_path / 'profile.jsonl').read_text().splitlines()]
+    assert sorted(line['path'] for line in lines) == sorted(e.name for e in (tmp_path / 'out').glob('*.stim'))
+    for line in lines:
+        stages = line['stages']
+        names = [s['stage'] for s in stages]
+        if 'p=0.001' in line['path']:
+            # The first of the noise strengths pays for placing the noise.
+            assert names[4] == 'noise_template'
+            del names[4]
+        assert names == [
+            'construction',
+            'compile',
+            'with_inlined_feedback',
+            'to_z_basis',
+            'noisy_circuit',
+            'serialization',
+        ]
+        assert [s.get('shared', False) for s in stages] == [True] * 4 + [False] * (len(stages) - 4)
+        assert stages[0]['num_instructions'] == 1
+        assert stages[1]['num_instructions'] > 0
+        assert line['total_wall_seconds'] == pytest.approx(sum(s['wall_seconds'] for s in stages))
+        assert line['slowest_stage'] in [s['stage'] for s in stages]
+        detail = pathlib.Path(line['slowest_stage_detail'])
+        assert detail.name == f'profile.jsonl.{line["path"]}.{line["slowest_stage"]}.prof'
+        assert detail.exists()
+
+    with pytest.raises(ValueError, match='profile_out'):
+        _run_tiny(tmp_path / 'out', profile_detail='cprofile')
+
+
+def test_generate_noisy_circuit_from_chunks_profiler():
+    profiler = gen.StageProfiler()
+    circuit = gen.generate_noisy_circuit_from_chunks(
+        chunks=_tiny_construction(gen.CircuitBuildParams(style='tiny', rounds=3, diameter=3, custom={})),
+        noise=gen.NoiseModel.uniform_depolarizing(1e-3),
+        allow_magic_chunks=False,
+        convert_to_cz=False,
+        profiler=profiler,
+    )
+    assert [r['stage'] for r in profiler.records] == ['compile', 'with_inlined_feedback', 'noisy_circuit']
+    assert profiler.records[-1]['num_instructions'] == gen.count_instructions(circuit)
+
+
+def test_generate_noisy_circuit_from_chunks_debug_out_dir(tmp_path: pathlib.Path, monkeypatch, num_background_workers: int):
+    import gen._gen_util
+    compiles = []
+
+    def counting_compile(chunks, **kwargs):
+        compiles.append(kwargs)
+        return gen.compile_chunks_into_circuit(chunks, **kwargs)
+    monkeypatch.setattr(gen._gen_util, 'compile_chunks_into_circuit', counting_compile)
+
+    chunks = _tiny_construction(gen.CircuitBuildParams(style='tiny', rounds=3, diameter=3, custom={}))
+    circuit = gen.generate_noisy_circuit_from_chunks(
+        chunks=chunks,
+        noise=gen.NoiseModel.uniform_depolarizing(1e-3),
+        allow_magic_chunks=False,
+        convert_to_cz=True,
+        debug_out_dir=tmp_path,
+    )
+    assert compiles == [{}]
+    assert sorted(e.name for e in tmp_path.iterdir()) == [
+        'ideal_circuit.html',
+        'ideal_circuit.stim',
+        'ideal_circuit_dets.svg',
+        'ideal_cz_circuit.html',
+        'ideal_cz_circuit.stim',
+        'ideal_cz_circuit_dets.svg',
+        'noisy_circuit.html',
+        'noisy_circuit.stim',
+        'noisy_circuit_dets.svg',
+        'patch.svg',
+    ]
+    assert stim.Circuit.from_file(tmp_path / 'noisy_circuit.stim') == circuit
+    assert stim.Circuit.from_file(tmp_path / 'ideal_circuit.stim') == gen.compile_chunks_into_circuit(chunks)
+
+    # When compiling fails, the circuit compiled while ignoring errors is still written.
+    compiles.clear()
+    bad_chunk = gen.Chunk(
+        circuit=stim.Circuit('R 0\nM 0'),
+        q2i={0: 0},
+        flows=[gen.Flow(center=0, start=gen.PauliString({0: 'Z'}), measurement_indices=[0])],
+    )
+    with pytest.raises(ValueError, match='Missing prev'):
+        gen.generate_noisy_circuit_from_chunks(
+            chunks=[bad_chunk],
+            noise=None,
+            allow_magic_chunks=False,
+            convert_to_cz=False,
+            debug_out_dir=tmp_path / 'bad',
+        )
+    assert compiles == [{}, {'ignore_errors': True}]
+    assert stim.Circuit.from_file(tmp_path / 'bad' / 'ideal_circuit.stim') == stim.Circuit('QUBIT_COORDS(0, 0) 0\nR 0\nM 0\nTICK')
+    assert (tmp_path / 'bad' / 'ideal_circuit.html').exists()
@@ -1,7 +1,10 @@
-from typing import Optional, Dict, Set, List, Iterator, Union, AbstractSet, DefaultDict, Any
+from typing import Optional, Dict, Set, List, Iterator, Union, AbstractSet, DefaultDict, Tuple, FrozenSet, Callable
 
 import collections
+import fractions
+import hashlib
 
+import numpy as np
 import stim
 
 CLIFFORD_1Q = 'C1'
@@ -131,25 +134,36 @@ class NoiseRule:
     def append_noisy_version_of(self,
                                 *,
                                 split_op: stim.CircuitInstruction,
-                                out_during_moment: stim.Circuit,
-                                after_moments: DefaultDict[Any, stim.Circuit],
+                                targets: List[stim.GateTarget],
+                                out_during_moment: List[str],
+                                after_moments: DefaultDict[Tuple[str, float], List[int]],
                                 immune_qubits: AbstractSet[int]) -> None:
-        targets = split_op.targets_copy()
+        """Appends the noisy version of an operation to the text lines of a moment being built.
+
+        Args:
+            split_op: The operation to make noisy.
+            targets: The operation's targets (i.e. `split_op.targets_copy()`).
+            out_during_moment: Lines of circuit text for the operations during the moment.
+            after_moments: Qubits to apply each (noise channel, probability) to, at the end of
+                the moment.
+            immune_qubits: Qubits to not apply noise to.
+        """
         if immune_qubits and any((t.is_qubit_target or t.is_x_target or t.is_y_target or t.is_z_target) and t.value in immune_qubits for t in targets):
-            out_during_moment.append(split_op)
+            out_during_moment.append(str(split_op))
             return
 
-        args = split_op.gate_args_copy()
         if self.flip_result:
             t = OP_TYPES[split_op.name]
             assert t == MPP or t == JUST_MEASURE_1Q or t == MEASURE_RESET_1Q
-            assert len(args) == 0
-            args = [self.flip_result]
-
-        out_during_moment.append(split_op.name, targets, args)
-        raw_targets = [t.value for t in targets if not t.is_combiner]
-        for op_name, arg in self.after.items():
-            after_moments[(op_name, arg)].append(op_name, raw_targets, arg)
+            assert len(split_op.gate_args_copy()) == 0
+            _, _, targets_text = str(split_op).partition(' ')
+            out_during_moment.append(f'{split_op.name}({self.flip_result!r}) {targets_text}')
+        else:
+            out_during_moment.append(str(split_op))
+        if self.after:
+            raw_targets = [t.value for t in targets if not t.is_combiner]
+            for op_name, arg in self.after.items():
+                after_moments[(op_name, arg)].extend(raw_targets)
 
 
 class NoiseModel:
@@ -162,7 +176,17 @@ class NoiseModel:
                  any_measurement_rule: Optional[NoiseRule] = None,
                  any_clifford_1q_rule: Optional[NoiseRule] = None,
                  any_clifford_2q_rule: Optional[NoiseRule] = None,
-                 allow_multiple_uses_of_a_qubit_in_one_tick: bool = False):
+                 allow_multiple_uses_of_a_qubit_in_one_tick: bool = False,
+                 noise_strength: Optional[float] = None,
+                 at_strength: Optional[Callable[[float], 'NoiseModel']] = None):
+        """
+        Args:
+            noise_strength: The parameter p that all of the model's probabilities are proportional
+                to, if there is one. Required by `compile_template`.
+            at_strength: Makes the same model with another noise strength (e.g. `NoiseModel.si1000`).
+                Required by `compile_template`, which uses it to check that the model's
+                probabilities really are proportional to `noise_strength`.
+        """
         self.idle_depolarization = idle_depolarization
         self.tick_noise = tick_noise
         self.additional_depolarization_waiting_for_m_or_r = additional_depolarization_waiting_for_m_or_r
@@ -172,6 +196,8 @@ class NoiseModel:
         self.any_clifford_1q_rule = any_clifford_1q_rule
         self.any_clifford_2q_rule = any_clifford_2q_rule
         self.allow_multiple_uses_of_a_qubit_in_one_tick = allow_multiple_uses_of_a_qubit_in_one_tick
+        self.noise_strength = noise_strength
+        self.at_strength = at_strength
         assert self.tick_noise is None or not self.tick_noise.flip_result
 
     @staticmethod
@@ -195,7 +221,9 @@ class NoiseModel:
             },
             gate_rules={
                 'R': NoiseRule(after={'X_ERROR': p * 2}),
-            }
+            },
+            noise_strength=p,
+            at_strength=NoiseModel.si1000,
         )
 
     @staticmethod
@@ -226,7 +254,9 @@ class NoiseModel:
                 'RX': NoiseRule(after={'Z_ERROR': p}),
                 'RY': NoiseRule(after={'X_ERROR': p}),
                 'R': NoiseRule(after={'X_ERROR': p}),
-            }
+            },
+            noise_strength=p,
+            at_strength=NoiseModel.uniform_depolarizing,
         )
 
     @staticmethod
@@ -246,7 +276,9 @@ class NoiseModel:
                 'RX': NoiseRule(after={'Z_ERROR': p}),
                 'RY': NoiseRule(after={'X_ERROR': p}),
                 'R': NoiseRule(after={'X_ERROR': p}),
-            }
+            },
+            noise_strength=p,
+            at_strength=NoiseModel.depolarizing_two_body_measurement_noise,
         )
 
     def _noise_rule_for_split_operation(self, *, split_op: stim.CircuitInstruction) -> Optional[NoiseRule]:
@@ -275,48 +307,46 @@ class NoiseModel:
     def _append_idle_error(self,
                            *,
                            moment_split_ops: List[stim.CircuitInstruction],
-                           out: stim.Circuit,
+                           collapse_qubits: List[int],
+                           clifford_qubits: List[int],
+                           out: List[str],
                            system_qubits: AbstractSet[int],
                            immune_qubits: AbstractSet[int],
                            ) -> None:
-        collapse_qubits = []
-        clifford_qubits = []
-        for split_op in moment_split_ops:
-            if occurs_in_classical_control_system(split_op):
-                continue
-            if split_op.name in COLLAPSING_OPS:
-                qubits_out = collapse_qubits
-            else:
-                qubits_out = clifford_qubits
-            for target in split_op.targets_copy():
-                if not target.is_combiner:
-                    qubits_out.append(target.value)
+        num_qubits = 1 + max(
+            max(system_qubits, default=-1),
+            max(immune_qubits, default=-1),
+            max(collapse_qubits, default=-1),
+            max(clifford_qubits, default=-1),
+        )
+        collapse_counts = np.bincount(np.array(collapse_qubits, dtype=np.int64), minlength=num_qubits)
+        clifford_counts = np.bincount(np.array(clifford_qubits, dtype=np.int64), minlength=num_qubits)
 
         # Safety check for operation collisions.
-        usage_counts = collections.Counter(collapse_qubits + clifford_qubits)
-        qubits_used_multiple_times = {q for q, c in usage_counts.items() if c != 1}
-        if qubits_used_multiple_times and not self.allow_multiple_uses_of_a_qubit_in_one_tick:
+        usage_counts = collapse_counts + clifford_counts
+        if not self.allow_multiple_uses_of_a_qubit_in_one_tick and np.any(usage_counts > 1):
             moment = stim.Circuit()
             for op in moment_split_ops:
                 moment.append(op)
             raise ValueError(f"Qubits were operated on multiple times without a TICK in between:\n"
-                             f"multiple uses: {sorted(qubits_used_multiple_times)}\n"
+                             f"multiple uses: {np.flatnonzero(usage_counts > 1).tolist()}\n"
                              f"moment:\n"
                              f"{moment}")
 
-        collapse_qubits_set = set(collapse_qubits)
-        clifford_qubits_set = set(clifford_qubits)
-        idle = sorted(system_qubits - collapse_qubits_set - clifford_qubits_set - immune_qubits)
+        system_mask = _qubit_mask(system_qubits, num_qubits)
+        immune_mask = _qubit_mask(immune_qubits, num_qubits)
+        idle = np.flatnonzero(system_mask & (usage_counts == 0) & ~immune_mask).tolist()
         if idle and self.idle_depolarization:
-            out.append('DEPOLARIZE1', idle, self.idle_depolarization)
+            out.append(f'DEPOLARIZE1({self.idle_depolarization!r}) ' + ' '.join(str(q) for q in idle))
 
-        waiting_for_mr = sorted(system_qubits - collapse_qubits_set - immune_qubits)
-        if collapse_qubits_set and waiting_for_mr and self.additional_depolarization_waiting_for_m_or_r:
-            out.append('DEPOLARIZE1', idle, self.additional_depolarization_waiting_for_m_or_r)
+        # Note: the additional depolarization is applied to the idle qubits, not `waiting_for_mr`.
+        waiting_for_mr = system_mask & (collapse_counts == 0) & ~immune_mask
+        if collapse_qubits and np.any(waiting_for_mr) and self.additional_depolarization_waiting_for_m_or_r:
+            out.append(f'DEPOLARIZE1({self.additional_depolarization_waiting_for_m_or_r!r}) ' + ' '.join(str(q) for q in idle))
 
         if self.tick_noise is not None:
             for k, p in self.tick_noise.after.items():
-                out.append(k, system_qubits, p)
+                out.append(f'{k}({p!r}) ' + ' '.join(str(q) for q in system_qubits))
 
     def _append_noisy_moment(self,
                              *,
@@ -325,27 +355,44 @@ class NoiseModel:
                              system_qubits: AbstractSet[int],
                              immune_qubits: AbstractSet[int],
                              ) -> None:
-        after = collections.defaultdict(stim.Circuit)
+        """Appends the noisy version of one moment of the circuit.
+
+        The moment is written as circuit text and parsed once, instead of appending operations to
+        the output one by one (which is slow for moments with thousands of operations). Stim fuses
+        adjacent compatible operations when parsing, the same way it does when appending them.
+        """
+        lines = []
+        after: DefaultDict[Tuple[str, float], List[int]] = collections.defaultdict(list)
+        collapse_qubits = []
+        clifford_qubits = []
         for split_op in moment_split_ops:
             rule = self._noise_rule_for_split_operation(split_op=split_op)
             if rule is None:
-                out.append(split_op)
-            else:
-                rule.append_noisy_version_of(
-                    split_op=split_op,
-                    out_during_moment=out,
-                    after_moments=after,
-                    immune_qubits=immune_qubits,
-                )
+                lines.append(str(split_op))
+                continue
+            targets = split_op.targets_copy()
+            rule.append_noisy_version_of(
+                split_op=split_op,
+                targets=targets,
+                out_during_moment=lines,
+                after_moments=after,
+                immune_qubits=immune_qubits,
+            )
+            qubits_out = collapse_qubits if split_op.name in COLLAPSING_OPS else clifford_qubits
+            qubits_out.extend(t.value for t in targets if not t.is_combiner)
         for k in sorted(after.keys()):
-            out += after[k]
+            op_name, arg = k
+            lines.append(f'{op_name}({arg!r}) ' + ' '.join(str(q) for q in after[k]))
 
         self._append_idle_error(
             moment_split_ops=moment_split_ops,
-            out=out,
+            collapse_qubits=collapse_qubits,
+            clifford_qubits=clifford_qubits,
+            out=lines,
             system_qubits=system_qubits,
             immune_qubits=immune_qubits,
         )
+        out += stim.Circuit('\n'.join(lines))
 
     def noisy_circuit(self,
                       circuit: stim.Circuit,
@@ -367,7 +414,20 @@ class NoiseModel:
             system_qubits = set(range(circuit.num_qubits))
         if immune_qubits is None:
             immune_qubits = set()
+        return self._noisy_circuit(
+            circuit,
+            system_qubits=system_qubits,
+            immune_qubits=immune_qubits,
+            noisy_body_cache={},
+        )
 
+    def _noisy_circuit(self,
+                       circuit: stim.Circuit,
+                       *,
+                       system_qubits: AbstractSet[int],
+                       immune_qubits: AbstractSet[int],
+                       noisy_body_cache: Dict[Tuple[str, FrozenSet[int], FrozenSet[int]], stim.Circuit],
+                       ) -> stim.Circuit:
         result = stim.Circuit()
 
         first = True
@@ -379,12 +439,23 @@ class NoiseModel:
             else:
                 result.append('TICK')
             if isinstance(moment_split_ops, stim.CircuitRepeatBlock):
-                noisy_body = self.noisy_circuit(
-                    moment_split_ops.body_copy(),
-                    system_qubits=system_qubits,
-                    immune_qubits=immune_qubits,
+                body = moment_split_ops.body_copy()
+                # Identical loop bodies (e.g. from fused chunk loops) only get their noise computed once.
+                key = (
+                    hashlib.sha256(str(body).encode('utf8')).hexdigest(),
+                    frozenset(system_qubits),
+                    frozenset(immune_qubits),
                 )
-                noisy_body.append('TICK')
+                noisy_body = noisy_body_cache.get(key)
+                if noisy_body is None:
+                    noisy_body = self._noisy_circuit(
+                        body,
+                        system_qubits=system_qubits,
+                        immune_qubits=immune_qubits,
+                        noisy_body_cache=noisy_body_cache,
+                    )
+                    noisy_body.append('TICK')
+                    noisy_body_cache[key] = noisy_body
                 result.append(stim.CircuitRepeatBlock(repeat_count=moment_split_ops.repeat_count, body=noisy_body))
             else:
                 self._append_noisy_moment(
@@ -396,6 +467,125 @@ class NoiseModel:
 
         return result
 
+    def compile_template(self,
+                         circuit: stim.Circuit,
+                         *,
+                         system_qubits: Optional[Set[int]] = None,
+                         immune_qubits: Optional[AbstractSet[int]] = None,
+                         ) -> 'NoiseTemplate':
+        """Records where this model places noise in a circuit, so it can be re-emitted for other strengths.
+
+        The placement of noise channels chosen by `noisy_circuit` doesn't depend on the noise
+        strength (as long as it is non-zero), only the probability arguments do. The returned
+        template remembers each probability as a multiple of this model's `noise_strength`, and
+        can produce the noisy circuit for another strength without re-running the noise pass.
+
+        To catch models whose probabilities aren't proportional to the strength (e.g. a fixed
+        measurement error, or a rule using p**2), the noise pass is also run at a second strength
+        (made by `at_strength`) and must exactly match what the template produces for it.
+
+        Args:
+            circuit: The noiseless circuit to layer noise over.
+            system_qubits: All qubits used by the circuit. These are the qubits eligible for idling noise.
+            immune_qubits: Qubits to not apply noise to, even if they are operated on.
+
+        Returns:
+            A template whose `noisy_circuit(p)` matches `noisy_circuit` of the same model family
+            created with strength p.
+
+        Raises:
+            ValueError: The model has no noise strength or `at_strength`, or its probabilities
+                aren't proportional to its noise strength, or the circuit already has noise.
+        """
+        if not self.noise_strength:
+            raise ValueError(f"Can't compile a template for a noise model without a non-zero {self.noise_strength=}.")
+        if self.at_strength is None:
+            raise ValueError("Can't compile a template for a noise model without `at_strength`.")
+        if circuit != circuit.without_noise():
+            raise ValueError("Can't compile a noise template for a circuit that already has noise.")
+        reference = self.noisy_circuit(circuit, system_qubits=system_qubits, immune_qubits=immune_qubits)
+        template = NoiseTemplate(reference=reference, reference_strength=self.noise_strength)
+
+        # Not a power of two multiple of the reference, so that rounding differences also show up.
+        check_strength = self.noise_strength * 0.7
+        expected = self.at_strength(check_strength).noisy_circuit(
+            circuit,
+            system_qubits=system_qubits,
+            immune_qubits=immune_qubits,
+        )
+        if template.noisy_circuit(check_strength) != expected:
+            raise ValueError(
+                f"The noise model's probabilities aren't proportional to its {self.noise_strength=}, "
+                f"so it can't be compiled into a template.")
+        return template
+
+
+class NoiseTemplate:
+    """A noisy circuit with its probabilities stored relative to a noise strength.
+
+    Created by `NoiseModel.compile_template`.
+    """
+
+    def __init__(self, *, reference: stim.Circuit, reference_strength: float):
+        """
+        Args:
+            reference: The circuit produced by the noise model at the reference strength.
+            reference_strength: The noise strength that produced the reference circuit.
+
+        Raises:
+            ValueError: A probability in the reference circuit isn't a small fraction multiple of
+                the reference strength.
+        """
+        self.reference_strength = reference_strength
+        self._parts: List[Union[str, Tuple[int, int]]] = []
+        self._append_parts(reference)
+
+    def _append_parts(self, circuit: stim.Circuit) -> None:
+        for inst in circuit:
+            if isinstance(inst, stim.CircuitRepeatBlock):
+                self._parts.append(f'REPEAT {inst.repeat_count} {{\n')
+                self._append_parts(inst.body_copy())
+                self._parts.append('}\n')
+                continue
+            args = inst.gate_args_copy()
+            if not args or (OP_TYPES[inst.name] != NOISE and inst.name not in COLLAPSING_OPS):
+                self._parts.append(f'{inst}\n')
+                continue
+            text = str(inst)
+            self._parts.append(f'{inst.name}(')
+            for k, arg in enumerate(args):
+                if k:
+                    self._parts.append(',')
+                self._parts.append(self._ratio(arg))
+            self._parts.append(text[text.index(')'):] + '\n')
+
+    def _ratio(self, arg: float) -> Tuple[int, int]:
+        """Expresses a probability as a small fraction multiple of the reference strength.
+
+        Small fractions are used so that `p * numerator / denominator` reproduces expressions like
+        `p / 10` or `p * 5` from the noise model factories exactly.
+
+        Raises:
+            ValueError: No small fraction reproduces the probability exactly.
+        """
+        ratio = fractions.Fraction(arg / self.reference_strength).limit_denominator(1000)
+        if self.reference_strength * ratio.numerator / ratio.denominator != arg:
+            raise ValueError(f"{arg!r} isn't a small fraction multiple of {self.reference_strength=}.")
+        return ratio.numerator, ratio.denominator
+
+    def noisy_circuit(self, p: float) -> stim.Circuit:
+        """Returns the noisy circuit for noise strength p."""
+        return stim.Circuit(''.join(
+            part if isinstance(part, str) else repr(p * part[0] / part[1])
+            for part in self._parts
+        ))
+
+
+def _qubit_mask(qubits: AbstractSet[int], num_qubits: int) -> np.ndarray:
+    mask = np.zeros(num_qubits, dtype=np.bool_)
+    mask[np.fromiter(qubits, dtype=np.int64, count=len(qubits))] = True
+    return mask
+
 
 def occurs_in_classical_control_system(op: stim.CircuitInstruction) -> bool:
     """Determines if an operation is an annotation or a classical control system update."""
@@ -1,7 +1,8 @@
+import pytest
 import stim
 
 import gen
-from gen._noise import _measure_basis, _iter_split_op_moments, occurs_in_classical_control_system, NoiseModel
+from gen._noise import _measure_basis, _iter_split_op_moments, occurs_in_classical_control_system, NoiseModel, COLLAPSING_OPS
 
 
 def test_measure_basis():
@@ -183,3 +184,225 @@ def test_tick_depolarization():
         MPP Z0*Z1 X2*X3 X4*X5*X6
         DEPOLARIZE1(0.375) 0 1 2 3 4 5 6
     """)
+
+
+def test_compile_template():
+    circuit = stim.Circuit("""
+        R 0 1 2 3
+        TICK
+        ISWAP 0 1 2 3
+        TICK
+        H 4 5 6 7
+        TICK
+        REPEAT 3 {
+            MPP Z0*Z1 Z2*Z3
+            TICK
+            M 4
+        }
+        DETECTOR(1, 2, 3) rec[-1]
+        OBSERVABLE_INCLUDE(2) rec[-2]
+    """)
+    for factory in [NoiseModel.si1000, NoiseModel.uniform_depolarizing]:
+        template = factory(1e-3).compile_template(circuit)
+        for p in [1e-3, 2e-3, 3e-4, 0.07]:
+            assert template.noisy_circuit(p) == factory(p).noisy_circuit(circuit)
+
+
+def test_compile_template_rejects_unsupported():
+    with pytest.raises(ValueError, match='noise_strength'):
+        NoiseModel(any_clifford_1q_rule=gen.NoiseRule(after={})).compile_template(stim.Circuit('H 0'))
+    with pytest.raises(ValueError, match='already has noise'):
+        NoiseModel.uniform_depolarizing(1e-3).compile_template(stim.Circuit('X_ERROR(0.1) 0'))
+    with pytest.raises(ValueError, match='at_strength'):
+        NoiseModel(any_clifford_1q_rule=gen.NoiseRule(after={}), noise_strength=1e-3).compile_template(stim.Circuit('H 0'))
+
+
+def _squared_model(p: float) -> NoiseModel:
+    return NoiseModel(
+        any_clifford_1q_rule=gen.NoiseRule(after={'DEPOLARIZE1': p**2}),
+        any_measurement_rule=gen.NoiseRule(after={}),
+        noise_strength=p,
+        at_strength=_squared_model,
+    )
+
+
+def _fixed_measurement_error_model(p: float) -> NoiseModel:
+    return NoiseModel(
+        any_clifford_1q_rule=gen.NoiseRule(after={'DEPOLARIZE1': p}),
+        any_measurement_rule=gen.NoiseRule(after={}, flip_result=0.01),
+        noise_strength=p,
+        at_strength=_fixed_measurement_error_model,
+    )
+
+
+def _irrational_model(p: float) -> NoiseModel:
+    return NoiseModel(
+        any_clifford_1q_rule=gen.NoiseRule(after={'DEPOLARIZE1': p / 3**0.5}),
+        any_measurement_rule=gen.NoiseRule(after={}),
+        noise_strength=p,
+        at_strength=_irrational_model,
+    )
+
+
+@pytest.mark.parametrize('factory', [_squared_model, _fixed_measurement_error_model, _irrational_model])
+def test_compile_template_rejects_non_proportional_models(factory):
+    circuit = stim.Circuit("""
+        H 0
+        TICK
+        M 0
+    """)
+    with pytest.raises(ValueError, match='proportional|small fraction'):
+        factory(1e-3).compile_template(circuit)
+    # The noise pass itself still works.
+    assert factory(1e-3).noisy_circuit(circuit).num_measurements == 1
+
+
+def _reference_noisy_circuit(model: NoiseModel, circuit: stim.Circuit) -> stim.Circuit:
+    """Applies a noise model one operation at a time (no immune qubits, no loops)."""
+    system_qubits = range(circuit.num_qubits)
+    result = stim.Circuit()
+    for k, moment in enumerate(_iter_split_op_moments(circuit, immune_qubits=set())):
+        if k:
+            result.append('TICK')
+        after = stim.Circuit()
+        used = set()
+        collapsed = set()
+        for op in moment:
+            rule = model._noise_rule_for_split_operation(split_op=op)
+            if rule is None:
+                result.append(op)
+                continue
+            qubits = [t.value for t in op.targets_copy() if not t.is_combiner]
+            used.update(qubits)
+            if op.name in COLLAPSING_OPS:
+                collapsed.update(qubits)
+            result.append(op.name, op.targets_copy(), [rule.flip_result] if rule.flip_result else [])
+            for name, p in rule.after.items():
+                after.append(name, qubits, p)
+        result += after
+        idle = [q for q in system_qubits if q not in used]
+        if idle and model.idle_depolarization:
+            result.append('DEPOLARIZE1', idle, model.idle_depolarization)
+        if collapsed and idle and model.additional_depolarization_waiting_for_m_or_r:
+            result.append('DEPOLARIZE1', idle, model.additional_depolarization_waiting_for_m_or_r)
+    return result
+
+
+@pytest.mark.parametrize('model', [
+    NoiseModel.si1000(1e-3),
+    NoiseModel.uniform_depolarizing(1e-3),
+    NoiseModel.depolarizing_two_body_measurement_noise(1e-3),
+])
+def test_noisy_circuit_detector_error_model_matches_per_op_reference(model: NoiseModel):
+    circuits = [
+        stim.Circuit("""
+            R 0 1 2 3 4
+            TICK
+            CX 0 1 2 3
+            TICK
+            CX 2 1 4 3
+            TICK
+            M 1 3
+            DETECTOR rec[-2]
+            DETECTOR rec[-1]
+            TICK
+            R 1 3
+            TICK
+            CX 0 1 2 3
+            TICK
+            CX 2 1 4 3
+            TICK
+            M 1 3
+            DETECTOR rec[-2] rec[-4]
+            DETECTOR rec[-1] rec[-3]
+            TICK
+            M 0 2 4
+            DETECTOR rec[-5] rec[-3] rec[-2]
+            DETECTOR rec[-4] rec[-2] rec[-1]
+            OBSERVABLE_INCLUDE(0) rec[-1]
+        """),
+        stim.Circuit("""
+            RX 0 1 2 3 4 5
+            TICK
+            MPP X0*X1 X2*X3 X4*X5
+            TICK
+            MPP Z0*Z1 Z2*Z3 Z4*Z5
+            TICK
+            MPP X0*X1 X2*X3 X4*X5
+            DETECTOR rec[-1] rec[-7]
+            DETECTOR rec[-2] rec[-8]
+            DETECTOR rec[-3] rec[-9]
+            TICK
+            MX 0 1 2 3 4 5
+            DETECTOR rec[-1] rec[-2] rec[-7]
+            OBSERVABLE_INCLUDE(0) rec[-1] rec[-2] rec[-3] rec[-4] rec[-5] rec[-6]
+        """),
+    ]
+    for circuit in circuits:
+        try:
+            expected = _reference_noisy_circuit(model, circuit)
+        except ValueError:
+            # The model doesn't support some of the circuit's gates.
+            with pytest.raises(ValueError):
+                model.noisy_circuit(circuit)
+            continue
+        actual = model.noisy_circuit(circuit)
+        assert actual.detector_error_model() == expected.detector_error_model()
+        assert actual.num_measurements == expected.num_measurements
+
+
+def test_noisy_circuit_reuses_identical_repeat_bodies(monkeypatch):
+    circuit = stim.Circuit("""
+        R 0 1
+        TICK
+        REPEAT 10 {
+            CX 0 1
+            TICK
+            M 1
+            TICK
+            R 1
+        }
+        TICK
+        REPEAT 20 {
+            CX 0 1
+            TICK
+            M 1
+            TICK
+            R 1
+        }
+        TICK
+        REPEAT 5 {
+            REPEAT 10 {
+                CX 0 1
+                TICK
+                M 1
+                TICK
+                R 1
+            }
+            TICK
+            H 0
+        }
+        M 0
+    """)
+    model = NoiseModel.si1000(1e-3)
+    noisy_moment_count = 0
+    original = NoiseModel._append_noisy_moment
+
+    def counting_append_noisy_moment(self, **kwargs):
+        nonlocal noisy_moment_count
+        noisy_moment_count += 1
+        return original(self, **kwargs)
+
+    monkeypatch.setattr(NoiseModel, '_append_noisy_moment', counting_append_noisy_moment)
+    actual = model.noisy_circuit(circuit)
+
+    # 4 top level moments (R, two empty moments after loops, M 0), the 3 moments of the shared
+    # loop body (once instead of three times), and 2 moments in the outer loop of the nested block.
+    assert noisy_moment_count == 9
+    noisy_body = model.noisy_circuit(circuit[2].body_copy())
+    noisy_body.append('TICK')
+    loops = [inst for inst in actual if isinstance(inst, stim.CircuitRepeatBlock)]
+    assert len(loops) == 3
+    assert loops[0] == stim.CircuitRepeatBlock(10, noisy_body)
+    assert loops[1] == stim.CircuitRepeatBlock(20, noisy_body)
+    assert loops[2].body_copy()[0] == stim.CircuitRepeatBlock(10, noisy_body)
@@ -0,0 +1,116 @@
+from typing import Dict, List, Iterable, Tuple
+
+from gen._flow import PauliString
+from gen._tile import Tile
+from gen._util import sorted_complex
+
+
+_COORD_TO_INDEX: Dict[complex, int] = {}
+_INDEX_TO_COORD: List[complex] = []
+
+
+def _coord_index(q: complex) -> int:
+    index = _COORD_TO_INDEX.get(q)
+    if index is None:
+        index = len(_INDEX_TO_COORD)
+        _COORD_TO_INDEX[q] = index
+        _INDEX_TO_COORD.append(complex(q))
+    return index
+
+
+def _bit_indices(bits: int) -> Iterable[int]:
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class PackedPauliString:
+    """A qubit-to-pauli mapping stored as packed X and Z bit masks.
+
+    Qubit coordinates are interned into a process-wide index, and the X and Z parts of the
+    Pauli string are stored as Python integers used as bit sets (bit k refers to the k'th
+    interned coordinate). Multiplication, anticommutation checks, hashing, and equality work
+    a machine word at a time instead of a qubit at a time.
+
+    Phase is ignored, like in PauliString. Use `from_pauli_string` and `to_pauli_string` to
+    convert to and from the dict-based representation. Coordinates come back out as `complex`
+    values (e.g. `0` comes back as `0j`), which compare and hash equal to the originals.
+    """
+
+    __slots__ = ('xs', 'zs')
+
+    def __init__(self, *, xs: int = 0, zs: int = 0):
+        self.xs = xs
+        self.zs = zs
+
+    @staticmethod
+    def from_qubits(qubits: Dict[complex, str]) -> 'PackedPauliString':
+        xs = 0
+        zs = 0
+        for q, p in qubits.items():
+            bit = 1 << _coord_index(q)
+            if p == 'X':
+                xs |= bit
+            elif p == 'Y':
+                xs |= bit
+                zs |= bit
+            elif p == 'Z':
+                zs |= bit
+            else:
+                raise NotImplementedError(f'{p=}')
+        return PackedPauliString(xs=xs, zs=zs)
+
+    @staticmethod
+    def from_pauli_string(pauli_string: PauliString) -> 'PackedPauliString':
+        return PackedPauliString.from_qubits(pauli_string.qubits)
+
+    @staticmethod
+    def from_tile_data(tile: Tile) -> 'PackedPauliString':
+        return PackedPauliString.from_qubits({
+            k: v
+            for k, v in zip(tile.ordered_data_qubits, tile.bases)
+            if k is not None
+        })
+
+    @property
+    def qubits(self) -> Dict[complex, str]:
+        """The qubit-to-pauli mapping, with qubits in sorted order (like PauliString.qubits)."""
+        unsorted = {}
+        for k in _bit_indices(self.xs | self.zs):
+            bit = 1 << k
+            unsorted[_INDEX_TO_COORD[k]] = '_XZY'[bool(self.xs & bit) + 2 * bool(self.zs & bit)]
+        return {q: unsorted[q] for q in sorted_complex(unsorted.keys())}
+
+    def to_pauli_string(self) -> PauliString:
+        return PauliString(self.qubits)
+
+    def __bool__(self):
+        return bool(self.xs | self.zs)
+
+    def __mul__(self, other: 'PackedPauliString') -> 'PackedPauliString':
+        return PackedPauliString(xs=self.xs ^ other.xs, zs=self.zs ^ other.zs)
+
+    def anticommutes(self, other: 'PackedPauliString') -> bool:
+        return ((self.xs & other.zs) ^ (self.zs & other.xs)).bit_count() % 2 == 1
+
+    def with_xz_flipped(self) -> 'PackedPauliString':
+        return PackedPauliString(xs=self.zs, zs=self.xs)
+
+    def __hash__(self):
+        return hash((self.xs, self.zs))
+
+    def __eq__(self, other):
+        if not isinstance(other, PackedPauliString):
+            return NotImplemented
+        return self.xs == other.xs and self.zs == other.zs
+
+    def __reduce__(self) -> Tuple:
+        # The coordinate index is process-local, so pickle the qubits instead of the bits.
+        return PackedPauliString.from_qubits, (self.qubits,)
+
+    def __repr__(self):
+        return f'PackedPauliString.from_qubits({self.qubits!r})'
+
+    def __str__(self):
+        return str(self.to_pauli_string())
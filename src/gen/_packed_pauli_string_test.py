@@ -0,0 +1,41 @@
+import pickle
+import random
+
+import gen
+
+
+def _random_qubits(rng: random.Random) -> dict:
+    return {
+        rng.randrange(5) + 1j * rng.randrange(5): rng.choice('XYZ')
+        for _ in range(rng.randrange(10))
+    }
+
+
+def test_conversion():
+    p = gen.PauliString({1j: 'X', 0: 'Z', 2: 'Y'})
+    packed = gen.PackedPauliString.from_pauli_string(p)
+    assert packed.to_pauli_string() == p
+    assert list(packed.qubits.items()) == list(p.qubits.items())
+    assert str(packed) == 'Z0j*X1j*Y(2+0j)'
+    assert all(type(q) == complex for q in packed.qubits)
+    assert eval(repr(packed), {'PackedPauliString': gen.PackedPauliString}) == packed
+    assert pickle.loads(pickle.dumps(packed)) == packed
+    assert not gen.PackedPauliString()
+    assert packed
+
+    tile = gen.Tile(ordered_data_qubits=[0, None, 1], measurement_qubit=0.5, bases='XZY')
+    assert gen.PackedPauliString.from_tile_data(tile).to_pauli_string() == gen.PauliString.from_tile_data(tile)
+
+
+def test_matches_pauli_string():
+    rng = random.Random(2)
+    for _ in range(200):
+        a = gen.PauliString(_random_qubits(rng))
+        b = gen.PauliString(_random_qubits(rng))
+        pa = gen.PackedPauliString.from_pauli_string(a)
+        pb = gen.PackedPauliString.from_pauli_string(b)
+        assert (pa * pb).to_pauli_string() == a * b
+        assert pa.anticommutes(pb) == a.anticommutes(b)
+        assert pa.with_xz_flipped().to_pauli_string() == a.with_xz_flipped()
+        assert (pa == pb) == (a == b)
+        assert hash(pa * pb) == hash(gen.PackedPauliString.from_pauli_string(a * b))
@@ -0,0 +1,161 @@
+import contextlib
+import cProfile
+import pathlib
+import pstats
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import stim
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROFILE_DETAILS = ('cprofile', 'tracemalloc')
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def count_instructions(circuit: stim.Circuit) -> int:
+    """Counts the instructions in a circuit, including those inside loop bodies (counted once)."""
+    total = 0
+    for inst in circuit:
+        total += 1
+        if isinstance(inst, stim.CircuitRepeatBlock):
+            total += count_instructions(inst.body_copy())
+    return total
+
+
+class StageProfiler:
+    """Records the cost of each stage of building a circuit.
+
+    Each stage gets a record (a json-friendly dict) with the keys:
+
+        'stage': The stage's name (e.g. 'construction', 'compile', 'noisy_circuit').
+        'wall_seconds': Elapsed wall clock time.
+        'cpu_seconds': CPU time used by the process.
+        'peak_rss_delta_bytes': How much the process's peak resident set size grew during the
+            stage. This is 0 when the stage stayed below a peak reached earlier by the process,
+            and None on platforms without the `resource` module.
+        'num_instructions': The size of what the stage produced: the number of instructions
+            (see `count_instructions`) if it's a circuit, or the number of items (e.g. chunks) if
+            it's a list. The code running the stage reports its product by setting the record's
+            'output' key, which is removed (and measured outside the timed region) when the
+            stage ends.
+
+    In 'tracemalloc' mode records also have a 'traced_peak_bytes' key, giving the peak Python
+    heap usage during the stage.
+
+    Args:
+        detail: None, 'cprofile', or 'tracemalloc'. When set, each stage is run under cProfile or
+            tracemalloc (which slows it down), and the details of the slowest stage are kept so
+            they can be written out with `dump_slowest`.
+    """
+
+    def __init__(self, *, detail: Optional[str] = None):
+        if detail is not None and detail not in PROFILE_DETAILS:
+            raise NotImplementedError(f'{detail=}')
+        self.detail = detail
+        self.records: List[Dict[str, Any]] = []
+        self._slowest_record: Optional[Dict[str, Any]] = None
+        self._slowest_detail: Union[None, pstats.Stats, tracemalloc.Snapshot] = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, Any]]:
+        """Measures the code run inside the `with` block, and yields the stage's record."""
+        record: Dict[str, Any] = {'stage': name, 'num_instructions': None}
+        profile = None
+        started_tracemalloc = False
+        if self.detail == 'cprofile':
+            profile = cProfile.Profile()
+        elif self.detail == 'tracemalloc':
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracemalloc = True
+            tracemalloc.reset_peak()
+
+        rss_before = _peak_rss_bytes()
+        cpu_before = time.process_time()
+        wall_before = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            record['wall_seconds'] = time.perf_counter() - wall_before
+            record['cpu_seconds'] = time.process_time() - cpu_before
+            rss_after = _peak_rss_bytes()
+            record['peak_rss_delta_bytes'] = None if rss_before is None else rss_after - rss_before
+            output = record.pop('output', None)
+            if isinstance(output, stim.Circuit):
+                record['num_instructions'] = count_instructions(output)
+            elif output is not None:
+                record['num_instructions'] = len(output)
+            detail = None
+            if profile is not None:
+                detail = pstats.Stats(profile)
+            elif self.detail == 'tracemalloc':
+                record['traced_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                detail = tracemalloc.take_snapshot()
+                if started_tracemalloc:
+                    tracemalloc.stop()
+            self.records.append(record)
+            if self._slowest_record is None or record['wall_seconds'] > self._slowest_record['wall_seconds']:
+                self._slowest_record = record
+                self._slowest_detail = detail
+
+    def fork(self, *, shared: bool) -> 'StageProfiler':
+        """Returns a profiler that starts with a copy of this profiler's records.
+
+        Used when several configurations reuse the same stages (e.g. one noiseless build shared
+        by several noise strengths). If `shared` is set, the copied records are marked with
+        `'shared': True`.
+        """
+        result = StageProfiler(detail=self.detail)
+        result.records = [{**r, 'shared': True} if shared else dict(r) for r in self.records]
+        if self._slowest_record is not None:
+            k = self.records.index(self._slowest_record)
+            result._slowest_record = result.records[k]
+            result._slowest_detail = self._slowest_detail
+        return result
+
+    @property
+    def slowest_stage(self) -> Optional[str]:
+        return None if self._slowest_record is None else self._slowest_record['stage']
+
+    def dump_slowest(self, path_prefix: Union[str, pathlib.Path]) -> Optional[pathlib.Path]:
+        """Writes the cProfile stats or tracemalloc top allocations of the slowest stage.
+
+        The file is named `{path_prefix}.{stage}.prof` (loadable with `pstats`) in 'cprofile'
+        mode, and `{path_prefix}.{stage}.txt` in 'tracemalloc' mode.
+
+        Returns:
+            The written path, or None if there was no detail to write.
+        """
+        if self._slowest_detail is None:
+            return None
+        path_prefix = pathlib.Path(path_prefix)
+        stage = self._slowest_record['stage']
+        if isinstance(self._slowest_detail, pstats.Stats):
+            path = path_prefix.with_name(f'{path_prefix.name}.{stage}.prof')
+            self._slowest_detail.dump_stats(path)
+        else:
+            path = path_prefix.with_name(f'{path_prefix.name}.{stage}.txt')
+            with open(path, 'w') as f:
+                for stat in self._slowest_detail.statistics('lineno')[:50]:
+                    print(stat, file=f)
+        return path
+
+    def __repr__(self) -> str:
+        return f'gen.StageProfiler(detail={self.detail!r})'
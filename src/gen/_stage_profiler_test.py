@@ -0,0 +1,75 @@
+import pathlib
+import pstats
+
+import pytest
+import stim
+
+import gen
+
+
+def test_count_instructions():
+    assert gen.count_instructions(stim.Circuit()) == 0
+    assert gen.count_instructions(stim.Circuit('''
+        H 0
+        REPEAT 10 {
+            CX 0 1
+            REPEAT 5 {
+                M 0
+                TICK
+            }
+        }
+        M 1
+    ''')) == 7
+
+
+def test_stage_profiler_records():
+    profiler = gen.StageProfiler()
+    with profiler.stage('a') as stage:
+        stage['output'] = stim.Circuit('H 0\nTICK\nM 0')
+    with profiler.stage('b') as stage:
+        stage['output'] = [1, 2]
+    with profiler.stage('c'):
+        sum(range(100000))
+    assert [r['stage'] for r in profiler.records] == ['a', 'b', 'c']
+    assert [r['num_instructions'] for r in profiler.records] == [3, 2, None]
+    for r in profiler.records:
+        assert 'output' not in r
+        assert r['wall_seconds'] >= 0
+        assert r['cpu_seconds'] >= 0
+        assert r['peak_rss_delta_bytes'] is None or r['peak_rss_delta_bytes'] >= 0
+    assert profiler.slowest_stage == max(profiler.records, key=lambda r: r['wall_seconds'])['stage']
+    assert profiler.dump_slowest('unused') is None
+
+    with pytest.raises(ValueError):
+        with profiler.stage('d'):
+            raise ValueError()
+    assert profiler.records[-1]['stage'] == 'd'
+
+    forked = profiler.fork(shared=True)
+    with forked.stage('e'):
+        pass
+    assert len(profiler.records) == 4
+    assert [r.get('shared', False) for r in forked.records] == [True] * 4 + [False]
+
+    with pytest.raises(NotImplementedError):
+        gen.StageProfiler(detail='perf')
+
+
+def test_stage_profiler_dump_slowest(tmp_path: pathlib.Path):
+    profiler = gen.StageProfiler(detail='cprofile')
+    with profiler.stage('fast'):
+        pass
+    with profiler.stage('slow'):
+        stim.Circuit.generated('repetition_code:memory', distance=25, rounds=1000).detector_error_model()
+    path = profiler.dump_slowest(tmp_path / 'out')
+    assert path == tmp_path / 'out.slow.prof'
+    assert pstats.Stats(str(path)).total_calls > 0
+
+    profiler = gen.StageProfiler(detail='tracemalloc')
+    with profiler.stage('alloc'):
+        data = [str(k) for k in range(100000)]
+    del data
+    assert profiler.records[0]['traced_peak_bytes'] > 100000
+    path = profiler.dump_slowest(tmp_path / 'out')
+    assert path == tmp_path / 'out.alloc.txt'
+    assert path.read_text()
@@ -1,5 +1,5 @@
 import pathlib
-from typing import List, Callable, Iterable, TypeVar, Any, Tuple, Dict, Union
+from typing import List, Callable, Iterable, TypeVar, Any, Tuple, Dict, Union, Sequence
 
 import numpy as np
 import stim
@@ -142,6 +142,55 @@ def stim_circuit_with_transformed_moments(
     return result
 
 
+def stim_circuit_from_repeating_segments(segments: Sequence[stim.Circuit]) -> stim.Circuit:
+    """Concatenates circuit segments, using (nested) REPEAT blocks for runs of repeated segments.
+
+    The result is equivalent to the concatenation of the segments after flattening. At each
+    position, the period whose repetitions cover the most segments is folded into a REPEAT block,
+    and the body of that block is folded recursively. This captures self-similar schedules, such
+    as a body that is itself mostly a repetition of a smaller body.
+
+    Segments are compared exactly, so segments should use relative references (e.g. `rec[-k]`
+    and `SHIFT_COORDS`) for repeated structure to be detected.
+
+    Args:
+        segments: The pieces of the circuit, in order. Typically one per round.
+
+    Returns:
+        The concatenated circuit.
+    """
+    ids: Dict[str, int] = {}
+    keys = [ids.setdefault(str(segment), len(ids)) for segment in segments]
+    return _fold_repeating_segments(segments, keys)
+
+
+def _fold_repeating_segments(segments: Sequence[stim.Circuit], keys: Sequence[int]) -> stim.Circuit:
+    n = len(keys)
+    result = stim.Circuit()
+    k = 0
+    while k < n:
+        best_period = 1
+        best_reps = 1
+        for period in range(1, (n - k) // 2 + 1):
+            if best_reps * best_period >= n - k:
+                break
+            reps = 1
+            while (k + (reps + 1) * period <= n
+                   and keys[k + reps * period:k + (reps + 1) * period] == keys[k:k + period]):
+                reps += 1
+            if reps > 1 and reps * period > best_reps * best_period:
+                best_period = period
+                best_reps = reps
+        if best_reps > 1:
+            body = _fold_repeating_segments(segments[k:k + best_period], keys[k:k + best_period])
+            result.append(stim.CircuitRepeatBlock(repeat_count=best_reps, body=body))
+            k += best_reps * best_period
+        else:
+            result += segments[k]
+            k += 1
+    return result
+
+
 def estimate_qubit_count_during_postselection(circuit: stim.Circuit) -> int:
     circuit = circuit.without_noise()
     start = 0
@@ -1,7 +1,7 @@
 import stim
 
 from gen._util import estimate_qubit_count_during_postselection, \
-    count_determined_measurements_in_circuit
+    count_determined_measurements_in_circuit, stim_circuit_from_repeating_segments
 
 
 def test_estimate_qubit_count_during_postselection():
@@ -70,3 +70,41 @@ def test_count_determined_measurements_in_circuit():
         MPP X0*X1*X2
     """)) == 1
 
+
+
+def test_stim_circuit_from_repeating_segments():
+    a = stim.Circuit("H 0\nTICK")
+    b = stim.Circuit("X 0\nTICK")
+    c = stim.Circuit("M 0\nDETECTOR rec[-1]\nTICK")
+
+    assert stim_circuit_from_repeating_segments([]) == stim.Circuit()
+    assert stim_circuit_from_repeating_segments([a, b, c]) == a + b + c
+    assert stim_circuit_from_repeating_segments([a, a, a, b]) == stim.Circuit("""
+        REPEAT 3 {
+            H 0
+            TICK
+        }
+        X 0
+        TICK
+    """)
+    segments = [c] + [a, a, a, b] * 5 + [a]
+    folded = stim_circuit_from_repeating_segments(segments)
+    assert folded == stim.Circuit("""
+        M 0
+        DETECTOR rec[-1]
+        TICK
+        REPEAT 5 {
+            REPEAT 3 {
+                H 0
+                TICK
+            }
+            X 0
+            TICK
+        }
+        H 0
+        TICK
+    """)
+    expected = stim.Circuit()
+    for segment in segments:
+        expected += segment
+    assert folded.flattened() == expected
@@ -0,0 +1,117 @@
+import collections
+import functools
+import hashlib
+import pathlib
+from typing import Optional, Union, TYPE_CHECKING
+
+import stim
+
+from gen._circuit_manifest import construction_source_hash
+
+if TYPE_CHECKING:
+    from gen._chunk import Chunk
+
+
+@functools.lru_cache(maxsize=None)
+def _verifier_source_hash() -> str:
+    """A hash of the stim version and of the source code of the verifier and the modules it uses.
+
+    Mixed into content keys so that results stored by an older verifier aren't trusted.
+    """
+    from gen._flow_verifier import FlowStabilizerVerifier
+    return f'{stim.__version__}:{construction_source_hash(FlowStabilizerVerifier)}'
+
+
+def chunk_content_key(chunk: 'Chunk') -> str:
+    """Returns a stable hash of everything that affects whether a chunk verifies.
+
+    The hash covers the circuit text, the qubit-to-index map, the flows (including their
+    centers, which aren't part of their repr), and the discarded inputs/outputs. It doesn't
+    depend on object identities or the process's hash seed, so it can be used across runs.
+    It also covers the stim version and the source code of the verifier (see
+    `construction_source_hash`), so editing the verifier invalidates previously stored keys.
+    """
+    h = hashlib.sha256()
+
+    def add(item):
+        text = str(item).encode('utf8')
+        h.update(len(text).to_bytes(8, 'little'))
+        h.update(text)
+
+    add(_verifier_source_hash())
+    add(chunk.circuit)
+    add(sorted((q.real, q.imag, i) for q, i in chunk.q2i.items()))
+    for flow in chunk.flows:
+        add((repr(flow), flow.center))
+    add([repr(p) for p in chunk.discarded_inputs])
+    add([repr(p) for p in chunk.discarded_outputs])
+    return h.hexdigest()
+
+
+class VerificationCache:
+    """Remembers which chunks have already passed verification, keyed by their content.
+
+    Only successful verifications are remembered; a chunk that fails verification is checked
+    again (and fails again) every time. Recent keys are kept in an in-memory LRU. If a
+    directory is given, keys are also stored there (as empty marker files), so that other
+    processes and later runs can skip verifying the same chunk.
+
+    Pass an instance to `Chunk.verify(cache=...)` or `ChunkLoop.verify(cache=...)`.
+    """
+
+    def __init__(
+            self,
+            *,
+            max_entries: int = 4096,
+            directory: Union[None, str, pathlib.Path] = None):
+        if max_entries < 1:
+            raise ValueError(f'{max_entries=} < 1')
+        self.max_entries = max_entries
+        self.directory: Optional[pathlib.Path] = None if directory is None else pathlib.Path(directory)
+        self.hits = 0
+        self.misses = 0
+        self._recent: collections.OrderedDict[str, None] = collections.OrderedDict()
+
+    def _marker_path(self, key: str) -> pathlib.Path:
+        return self.directory / key[:2] / key
+
+    def _remember(self, key: str):
+        self._recent[key] = None
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_entries:
+            self._recent.popitem(last=False)
+
+    def contains(self, key: str) -> bool:
+        """Determines if the key was verified before, updating the hit/miss counters."""
+        if key in self._recent:
+            self._recent.move_to_end(key)
+            self.hits += 1
+            return True
+        if self.directory is not None and self._marker_path(key).exists():
+            self._remember(key)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, key: str):
+        """Records that the chunk with the given content key passed verification."""
+        self._remember(key)
+        if self.directory is not None:
+            path = self._marker_path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+
+    def verify(self, chunk: 'Chunk'):
+        """Verifies the chunk, unless a chunk with the same content was already verified."""
+        key = chunk_content_key(chunk)
+        if self.contains(key):
+            return
+        chunk.verify()
+        self.add(key)
+
+    def __len__(self) -> int:
+        return len(self._recent)
+
+    def __repr__(self) -> str:
+        return f'VerificationCache(max_entries={self.max_entries!r}, directory={self.directory!r})'
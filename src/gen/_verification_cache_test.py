@@ -0,0 +1,107 @@
+import pytest
+import stim
+
+import gen
+
+
+def _chunk(*, circuit: str = 'R 0\nM 0', end: str = 'Z', center: complex = 0) -> gen.Chunk:
+    return gen.Chunk(
+        circuit=stim.Circuit(circuit),
+        q2i={0: 0},
+        flows=[
+            gen.Flow(
+                center=center,
+                start=gen.PauliString({}),
+                measurement_indices=[0],
+                end=gen.PauliString({0: end}) if end else gen.PauliString({}),
+            ),
+        ],
+    )
+
+
+def test_chunk_content_key():
+    a = _chunk()
+    assert gen.chunk_content_key(a) == gen.chunk_content_key(_chunk())
+    assert gen.chunk_content_key(a) != gen.chunk_content_key(_chunk(circuit='R 0\nM 0\nTICK'))
+    assert gen.chunk_content_key(a) != gen.chunk_content_key(_chunk(end='X'))
+    assert gen.chunk_content_key(a) != gen.chunk_content_key(_chunk(center=1))
+
+    b = _chunk()
+    b.q2i = {0: 1}
+    assert gen.chunk_content_key(a) != gen.chunk_content_key(b)
+    b = _chunk()
+    b.discarded_outputs = [gen.PauliString({0: 'X'})]
+    assert gen.chunk_content_key(a) != gen.chunk_content_key(b)
+
+
+def test_verification_cache_hits_and_misses():
+    cache = gen.VerificationCache()
+    _chunk().verify(cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    _chunk().verify(cache=cache)
+    _chunk().verify(cache=cache)
+    assert (cache.hits, cache.misses) == (2, 1)
+    _chunk(end='').verify(cache=cache)
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert len(cache) == 2
+
+    # Failures aren't remembered.
+    bad = _chunk(end='X')
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            bad.verify(cache=cache)
+    assert (cache.hits, cache.misses) == (2, 4)
+    assert len(cache) == 2
+
+    loop = gen.ChunkLoop([_chunk(end='')], repetitions=5)
+    loop.verify(cache=cache)
+    assert (cache.hits, cache.misses) == (3, 4)
+
+
+def test_verification_cache_lru():
+    cache = gen.VerificationCache(max_entries=2)
+    a = _chunk()
+    b = _chunk(end='')
+    c = _chunk(center=1)
+    a.verify(cache=cache)
+    b.verify(cache=cache)
+    a.verify(cache=cache)
+    c.verify(cache=cache)
+    assert (cache.hits, cache.misses) == (1, 3)
+    a.verify(cache=cache)
+    assert (cache.hits, cache.misses) == (2, 3)
+    b.verify(cache=cache)
+    assert (cache.hits, cache.misses) == (2, 4)
+
+    with pytest.raises(ValueError):
+        gen.VerificationCache(max_entries=0)
+
+
+def test_verification_cache_directory(tmp_path):
+    cache = gen.VerificationCache(directory=tmp_path)
+    _chunk().verify(cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    other_run = gen.VerificationCache(directory=tmp_path)
+    _chunk().verify(cache=other_run)
+    _chunk(end='').verify(cache=other_run)
+    assert (other_run.hits, other_run.misses) == (1, 1)
+    assert len(list(tmp_path.glob('*/*'))) == 2
+
+
+def test_verification_cache_directory_ignores_results_of_other_verifiers(tmp_path, monkeypatch):
+    gen.VerificationCache(directory=tmp_path).verify(_chunk())
+
+    # E.g. the verifier's source code was edited since the marker was stored.
+    monkeypatch.setattr('gen._verification_cache._verifier_source_hash', lambda: 'edited')
+    cache = gen.VerificationCache(directory=tmp_path)
+    cache.verify(_chunk())
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert len(list(tmp_path.glob('*/*'))) == 2
+
+
+def test_verifier_source_hash():
+    from gen._verification_cache import _verifier_source_hash
+    h = _verifier_source_hash()
+    assert h.startswith(stim.__version__ + ':')
+    assert h == _verifier_source_hash()
@@ -0,0 +1,15 @@
+import pytest
+
+import gen._debug_artifacts
+
+
+@pytest.fixture(params=[0, 2])
+def num_background_workers(request, monkeypatch):
+    """Renders debug artifacts inline (0) or in a fresh pool of background processes (2)."""
+    monkeypatch.setattr(gen._debug_artifacts, '_num_background_workers', lambda: request.param)
+    monkeypatch.setattr(gen._debug_artifacts, '_pool', None)
+    monkeypatch.setattr(gen._debug_artifacts, '_pool_pid', None)
+    monkeypatch.setattr(gen._debug_artifacts, '_pending', [])
+    yield request.param
+    if gen._debug_artifacts._pool is not None:
+        gen._debug_artifacts._pool.shutdown()